@@ -1,25 +1,55 @@
-from flask import Flask, render_template,send_file, request, jsonify, redirect, url_for, session
+from flask import Flask, render_template,send_file, send_from_directory, request, jsonify, redirect, url_for, session
 from flask_migrate import Migrate
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import check_password_hash
 from models import (
     db, User, Park, Equipment, Inspection, 
-    InspectionDetail, InspectionPhoto, DailyReportPhoto,
-    InspectionPartEnum, TypeOfAbnormalityEnum, GradeEnum
+    InspectionDetail, InspectionPhoto, DailyReportPhoto, UploadReceipt,
+    Report, InspectionReport, DailyReport, DailyReportDetail,
+    InspectionPartEnum, TypeOfAbnormalityEnum, GradeEnum, ReportStatusEnum, RoleEnum,
+    user_role_cache
 )
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image
-from openpyxl.drawing.spreadsheet_drawing import AnchorMarker, OneCellAnchor
-from openpyxl.drawing.xdr import XDRPositiveSize2D
-from openpyxl.utils import column_index_from_string
-from openpyxl.styles import Alignment
 # from flask_cors import CORS
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL,
+    INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_TIMEOUT_SEC,
+    PREPROCESS_CACHE_MAX_ENTRIES, PREPROCESS_CACHE_MAX_MB,
+    RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SEC, MODEL_CHECK_INTERVAL_SEC,
+    MODEL_WARMUP, INFERENCE_BACKEND,
+    INFERENCE_MODE, INFERENCE_SERVER_ADDRESS, INFERENCE_SERVER_AUTHKEY,
+    INFERENCE_QUEUE_DEPTH, INFERENCE_RETRY_AFTER_SEC,
+    JOB_WORKERS, JOB_TTL_SEC, JOB_HEARTBEAT_SEC, JOB_LEASE_SEC, JOB_EXECUTION, JOB_MAX_ATTEMPTS,
+    UPLOAD_JOB_BUSY_RETRIES, PART_INFERENCE_WORKERS,
+    JOB_STORE_BACKEND, JOB_STORE_PATH, REPORT_STORAGE_ROOT,
+    PHOTO_CACHE_MAX_AGE_SEC, UPLOAD_MAX_MB,
+    CAPTURE_MIN_SIDE, CAPTURE_JPEG_QUALITY,
+    ARCHIVE_UPLOAD_ENABLED, ARCHIVE_MAX_SIDE, ARCHIVE_JPEG_QUALITY,
+    BULK_UPLOAD_MAX_ITEMS, BULK_INGEST_CHUNK_SIZE, BULK_INGEST_MAX_ITEMS, BULK_INGEST_MAX_MB,
+    CHECKSHEET_EXPORT_WORKERS, CHECKSHEET_EXPORT_MAX_ITEMS,
+    CHECKSHEET_CACHE_ROOT, CHECKSHEET_CACHE_MAX_MB,
+    LIST_PAGE_SIZE, LIST_PAGE_MAX_SIZE
+)
+from inference import (
+    MODELS_CONFIG, InferenceBusy, InferenceClient, ModelRegistry,
+    PreprocessCache, ResultCache, image_digest, predict_with_registry
+)
+from grades import refresh_latest_grades, worst_grade
+from jobs import JobRunner, FINISHED_STATES, create_job_store, public_job
+from report_renderer import (
+    ChecksheetExporter, ChecksheetRenderer, RenderCache, render_cache_key, XLSX_MIMETYPE, ZIP_MIMETYPE
+)
+from photo_storage import (
+    DERIVATIVE_MIME_TYPE, DERIVATIVE_SIZES, ensure_derivative, get_photo_storage, store_derivatives
+)
 import os
 import sys
+import time
 import base64
-from datetime import datetime
-from keras.models import load_model
-from keras.preprocessing import image
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from PIL import Image
 import io
 import json
@@ -30,9 +60,6 @@ import numpy as np
 
 
 
-EMU = 9525
-ICON_PX = 16
-
 BASE_DIR = os.path.dirname(__file__)
 TEMPLATE_PATH = os.path.join(BASE_DIR, "template.xlsx")
 ICON_DIR = os.path.join(BASE_DIR, "icons")
@@ -46,6 +73,7 @@ app.config['SECRET_KEY'] = 'your-fixed-secret-key-change-this-in-production'
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_MB * 1024 * 1024
 
 db.init_app(app)
 migrate = Migrate(app, db)
@@ -59,30 +87,62 @@ migrate = Migrate(app, db)
 # モデル読み込み（改善版：4つのパーツ対応）
 # ============================================================
 
-MODELS_CONFIG = {
-    'chain': {
-        'path': './models/chain.keras',  
-        'size': 224,
-        'classes': ['normal', 'rust_B', 'rust_C']
-    },
-    'joint': {
-        'path': './models/joint.keras',  
-        'size': 224,
-        'classes': ['normal', 'rust_B', 'rust_C']
-    },
-    'pole': {
-        'path': './models/pole.keras', 
-        'size': 224,
-        'classes': ['normal', 'rust_B', 'rust_C']
-    },
-    'seat': {
-        'path': './models/seat.keras', 
-        'size': 224,
-        'classes': ['normal', 'rust_B', 'rust_C', 'crack_B', 'crack_C']
-    }
-}
+# MODELS_CONFIG は inference.py で定義（推論を使わない処理では TensorFlow を読み込まない）
+
+# 前処理済み画像のキャッシュ（内容ハッシュがキー）
+preprocess_cache = PreprocessCache(
+    max_entries=PREPROCESS_CACHE_MAX_ENTRIES,
+    max_bytes=PREPROCESS_CACHE_MAX_MB * 1024 * 1024
+)
+
+# 推論結果のキャッシュ（画像ダイジェスト, パーツ, モデルのフィンガープリント）
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    ttl=RESULT_CACHE_TTL_SEC
+)
+
+# パーツモデルは初回利用時かウォームアップスレッドで読み込む
+model_registry = ModelRegistry(
+    MODELS_CONFIG,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+    check_interval=MODEL_CHECK_INTERVAL_SEC,
+    on_reload=result_cache.invalidate_part,
+    backend=INFERENCE_BACKEND,
+    max_pending=INFERENCE_QUEUE_DEPTH
+)
+
+# INFERENCE_MODE=remote のときは inference_server.py のワーカーに推論を任せる
+# （この Web プロセスではモデルを読み込まない）
+inference_client = None
+if INFERENCE_MODE == 'remote':
+    inference_client = InferenceClient(
+        INFERENCE_SERVER_ADDRESS,
+        INFERENCE_SERVER_AUTHKEY,
+        timeout=INFERENCE_TIMEOUT_SEC
+    )
+
+
+# 1回のアップロード内でパーツごとのデコード・推論を並列に行うスレッドプール
+part_executor = ThreadPoolExecutor(max_workers=PART_INFERENCE_WORKERS, thread_name_prefix='part')
 
-inference_models = {}
+# バックグラウンドジョブ（非同期アップロード・報告書の生成）
+# JOB_EXECUTION=worker のときは投入だけ行い、jobs_worker.py のプロセスが実行する
+job_store = create_job_store(
+    JOB_STORE_BACKEND, ttl=JOB_TTL_SEC, path=JOB_STORE_PATH,
+    lease=JOB_LEASE_SEC, max_attempts=JOB_MAX_ATTEMPTS
+)
+job_runner = JobRunner(
+    job_store, max_workers=JOB_WORKERS,
+    heartbeat_interval=JOB_HEARTBEAT_SEC, execution=JOB_EXECUTION
+)
+
+
+@app.before_request
+def start_model_warmup():
+    """最初のリクエストを受け付けた時点でモデルのウォームアップを開始する"""
+    if MODEL_WARMUP and inference_client is None:
+        model_registry.start_warmup()
 
 
 #ログイン機能
@@ -150,46 +210,14 @@ def home():
 
 
 # ---------------------------帳票機能---------------------------
-# ---------------------------
-# TEXT 用の関数
-# ---------------------------
-def insert_text(ws, cell, value):
-    ws[cell] = value
-    ws[cell].alignment = Alignment(wrap_text=True, vertical="top")
-
-
-# ---------------------------
-# ICON 挿入関数（正しい版）
-# ---------------------------
-def insert_icon(ws, cell, icon_file, dx=0, dy=0):
-    from openpyxl.drawing.image import Image as ExcelImage  # ← 関数内でインポート
-    
-    img_path = os.path.join(ICON_DIR, icon_file)
-    if not os.path.exists(img_path):
-        return
-
-    img = ExcelImage(img_path)  # ← ここで使用
-    img.width = ICON_PX
-    img.height = ICON_PX
-
-    # セル位置
-    col_letter = ''.join(filter(str.isalpha, cell))
-    row_number = int(''.join(filter(str.isdigit, cell)))
-    col_idx = column_index_from_string(col_letter) - 1
-
-    marker = AnchorMarker(
-        col=col_idx,
-        colOff=dx * EMU,
-        row=row_number - 1,
-        rowOff=dy * EMU
-    )
+# テンプレートは最初の生成時に1回だけ解析し、以降は複製して使う（アイコンもメモリに保持）
+checksheet_renderer = ChecksheetRenderer(TEMPLATE_PATH, ICON_DIR)
 
-    img.anchor = OneCellAnchor(
-        _from=marker,
-        ext=XDRPositiveSize2D(EMU * img.width, EMU * img.height)
-    )
+# 同じ items・同じテンプレートの再ダウンロードは、生成済みのファイルを返す
+checksheet_cache = RenderCache(CHECKSHEET_CACHE_ROOT, CHECKSHEET_CACHE_MAX_MB * 1024 * 1024)
 
-    ws.add_image(img)
+# 複数の点検をまとめて出力するときは、点検ごとの生成をワーカープロセスに分散する
+checksheet_exporter = ChecksheetExporter(TEMPLATE_PATH, ICON_DIR, max_workers=CHECKSHEET_EXPORT_WORKERS)
 
 
 # ---------------------------
@@ -249,131 +277,419 @@ def generate_excel():
         if data is None:
             return jsonify({"error": "JSONが正しく送信されていません"}), 400
 
-        if not os.path.exists(TEMPLATE_PATH):
+        if not checksheet_renderer.template_exists():
             return jsonify({"error": "テンプレートファイルが見つかりません"}), 500
 
-        wb = load_workbook(TEMPLATE_PATH)
-        ws = wb.active
+        items = data.get("items", [])
 
-        for item in data.get("items", []):
-            cell = item.get("cell")
-            if not cell:
-                continue
-
-            item_type = item.get("type")
-            dx = item.get("dx", 0)
-            dy = item.get("dy", 0)
+        # items とテンプレートが同じなら内容も同じなので、ハッシュを ETag に使う
+        etag = render_cache_key(items, checksheet_renderer.template_fingerprint())
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            path = checksheet_cache.get(etag)
+            if path is None:
+                stream = checksheet_renderer.render(items)
+                checksheet_cache.put(etag, stream.getvalue())
+            else:
+                stream = path
 
-            if item_type == "icon" and item.get("icon"):
-                insert_icon(ws, cell, item["icon"], dx=dx, dy=dy)
+            response = send_file(
+                stream,
+                as_attachment=True,
+                download_name="点検チェックシート.xlsx",
+                mimetype=XLSX_MIMETYPE,
+                etag=False
+            )
 
-            elif item_type in ("text", "number"):
-                insert_text(ws, cell, str(item.get("value", "")))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
 
-            elif item["type"] == "text":
-                cell = ws[item["cell"]]
-                cell.value = item["text"]
+    except Exception as e:
+        import traceback
+        traceback.print_exc()  # ターミナルに詳細なエラーを出力
+        sys.stderr.write(f"❌ Excel生成エラー: {str(e)}\n")
+        sys.stderr.flush()
+        return jsonify({"error": str(e)}), 500
 
-            elif item_type == "checkbox":
-                if item.get("value"):
-                    insert_icon(ws, cell, item.get("icon", "check.png"), dx=dx, dy=dy)
 
-        stream = io.BytesIO()
-        wb.save(stream)
-        stream.seek(0)
 
+@app.route("/api/checksheets/export", methods=["GET", "POST"])
+def export_checksheets():
+    """
+    複数の点検のチェックシートをまとめて出力
+    
+    Request JSON（GET の場合は同名のクエリパラメータ、inspection_id は繰り返し指定）:
+    {
+        "park_id": 1,                       # 公園の全遊具の点検
+        "date_from": "2026-04-01",          # 点検日の範囲（両端を含む、任意）
+        "date_to": "2026-10-31",
+        "inspection_ids": [1, 2, 3],        # 点検IDを直接指定（任意）
+        "format": "xlsx"                    # "xlsx"（1ブック・点検ごとに1シート）または "zip"（点検ごとに1ファイル）
+    }
+    
+    点検・部位の判定は DB から直接読み込み、ワーカープロセスで生成する。
+    zip の場合は生成できた点検から順に送り出す。
+    """
+    try:
+        if request.method == 'POST':
+            params = request.get_json(silent=True) or {}
+            inspection_ids = params.get('inspection_ids') or []
+        else:
+            params = request.args
+            inspection_ids = request.args.getlist('inspection_id', type=int)
+        
+        export_format = params.get('format', 'xlsx')
+        if export_format not in ('xlsx', 'zip'):
+            return jsonify({'error': f'未対応の形式: {export_format}'}), 400
+        
+        try:
+            date_from = datetime.strptime(params['date_from'], '%Y-%m-%d') if params.get('date_from') else None
+            date_to = datetime.strptime(params['date_to'], '%Y-%m-%d') if params.get('date_to') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': '日付は YYYY-MM-DD 形式で指定してください'}), 400
+        
+        park_id = params.get('park_id')
+        if not park_id and not inspection_ids and not (date_from and date_to):
+            return jsonify({'error': 'park_id、inspection_ids、または date_from と date_to を指定してください'}), 400
+        
+        if not checksheet_renderer.template_exists():
+            return jsonify({'error': 'テンプレートファイルが見つかりません'}), 500
+        
+        records = load_checksheet_records(park_id, date_from, date_to, inspection_ids)
+        if not records:
+            return jsonify({'error': '対象の点検がありません'}), 404
+        if len(records) > CHECKSHEET_EXPORT_MAX_ITEMS:
+            return jsonify({'error': f'1回に出力できるのは {CHECKSHEET_EXPORT_MAX_ITEMS} 件までです'}), 413
+        
+        sys.stderr.write(f"↻ チェックシート一括出力: {len(records)} 件（{export_format}）\n")
+        sys.stderr.flush()
+        
+        if export_format == 'zip':
+            return app.response_class(
+                checksheet_exporter.iter_zip(records),
+                mimetype=ZIP_MIMETYPE,
+                headers={'Content-Disposition': 'attachment; filename="checksheets.zip"'}
+            )
+        
         return send_file(
-            stream,
+            io.BytesIO(checksheet_exporter.workbook(records)),
             as_attachment=True,
-            download_name="点検チェックシート.xlsx",
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            download_name="点検チェックシート一括.xlsx",
+            mimetype=XLSX_MIMETYPE
         )
-
+    
     except Exception as e:
         import traceback
-        traceback.print_exc()  # ターミナルに詳細なエラーを出力
-        sys.stderr.write(f"❌ Excel生成エラー: {str(e)}\n")
+        traceback.print_exc()
+        sys.stderr.write(f"❌ チェックシート一括出力エラー: {str(e)}\n")
         sys.stderr.flush()
-        return jsonify({"error": str(e)}), 500
+        return jsonify({'error': str(e)}), 500
+
+
+def load_checksheet_records(park_id=None, date_from=None, date_to=None, inspection_ids=None):
+    """
+    出力対象の点検を、ワーカープロセスに渡せる dict のリストにする（点検日・点検ID順）
+    
+    点検・遊具・公園は1回の JOIN、部位の判定は1回の IN クエリで取得する。
+    """
+    query = (
+        db.session.query(
+            Inspection.inspection_id, Inspection.inspection_date, Inspection.actions_taken,
+            Equipment.equipment_name, Park.park_name
+        )
+        .join(Equipment, Inspection.equipment_id == Equipment.equipment_id)
+        .join(Park, Equipment.park_id == Park.park_id)
+    )
+    if park_id:
+        query = query.filter(Park.park_id == park_id)
+    if inspection_ids:
+        query = query.filter(Inspection.inspection_id.in_(inspection_ids))
+    if date_from:
+        query = query.filter(Inspection.inspection_date >= date_from)
+    if date_to:
+        query = query.filter(Inspection.inspection_date < date_to + timedelta(days=1))
+    
+    rows = query.order_by(Inspection.inspection_date, Inspection.inspection_id).all()
+    records = {
+        row.inspection_id: {
+            'inspection_id': row.inspection_id,
+            'inspection_date': row.inspection_date,
+            'actions_taken': row.actions_taken,
+            'equipment_name': row.equipment_name,
+            'park_name': row.park_name,
+            'details': []
+        }
+        for row in rows
+    }
+    if not records:
+        return []
+    
+    details = db.session.query(
+        InspectionDetail.inspection_id, InspectionDetail.part,
+        InspectionDetail.condition, InspectionDetail.grade
+    ).filter(InspectionDetail.inspection_id.in_(list(records))).all()
+    for detail in details:
+        records[detail.inspection_id]['details'].append({
+            'part': detail.part.value,
+            'condition': detail.condition.value if detail.condition else None,
+            'grade': detail.grade.name if detail.grade else None
+        })
+    
+    return list(records.values())
+
+# ============================================================
+# 報告書（年4回）の生成ジョブ
+# ============================================================
+
+def fiscal_quarter_range(year, quarter):
+    """
+    年度の四半期の (初日, 末日)。第1四半期は4〜6月、第4四半期は翌年1〜3月
+    """
+    start_month = 4 + (quarter - 1) * 3
+    start_year = year + (start_month - 1) // 12
+    start_month = (start_month - 1) % 12 + 1
+    end_year = start_year + (start_month + 2) // 12
+    end_month = (start_month + 2) % 12 + 1
+    return datetime(start_year, start_month, 1), datetime(end_year, end_month, 1) - timedelta(days=1)
 
 
+def report_file_path(report_id):
+    return os.path.join(REPORT_STORAGE_ROOT, f"report_{report_id}.xlsx")
 
-def load_all_models():
-    """4つのモデルを読み込む"""
-    global inference_models
+
+@app.route('/api/reports', methods=['POST'])
+def create_report():
+    """
+    公園・年度・四半期を指定して報告書の生成ジョブを投入し、202 を返す
     
-    for part_name, config in MODELS_CONFIG.items():
+    Request JSON:
+        {"park_id": 1, "year": 2026, "quarter": 1}
+    
+    生成の進捗は /api/jobs/<job_id>（または /events）、完成後は /api/reports/<report_id>/download から取得する。
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        park_id = int(data['park_id'])
+        year = int(data['year'])
+        quarter = int(data['quarter'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'park_id、year、quarter は必須です'}), 400
+    if quarter not in (1, 2, 3, 4):
+        return jsonify({'error': 'quarter は 1〜4 で指定してください'}), 400
+    
+    Park.query.get_or_404(park_id)
+    if not checksheet_renderer.template_exists():
+        return jsonify({'error': 'テンプレートファイルが見つかりません'}), 500
+    
+    report = Report(park_id=park_id, employee_id=user_id, status=ReportStatusEnum.DRAFT)
+    db.session.add(report)
+    db.session.commit()
+    
+    date_from, date_to = fiscal_quarter_range(year, quarter)
+    download_url = url_for('download_report', report_id=report.report_id)
+    job = job_runner.submit(
+        'render_report',
+        report.report_id, date_from.isoformat(), date_to.isoformat(), download_url,
+        ref=f'report:{report.report_id}'
+    )
+    
+    sys.stderr.write(f"✓ 報告書 {report.report_id} の生成ジョブ {job['job_id']} を投入\n")
+    sys.stderr.flush()
+    
+    return jsonify({
+        'success': True,
+        'report_id': report.report_id,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'report_url': url_for('get_report', report_id=report.report_id),
+        'status_url': url_for('get_job', job_id=job['job_id']),
+        'events_url': url_for('job_events', job_id=job['job_id'])
+    }), 202
+
+
+@job_runner.handler('render_report')
+def run_report_job(report_progress, report_id, date_from, date_to, download_url):
+    """
+    対象期間（ISO 形式の日時）のチェックシートのブックを生成して保存し、点検を報告書に紐付ける
+    
+    紐付けと file_url はファイルを保存できてから1回でコミットする（失敗したらロールバックして
+    ファイルも消すので、ファイルの無い報告書に点検だけ紐付いた状態は残らない）
+    """
+    with app.app_context():
+        report = Report.query.get(report_id)
+        if report is None:
+            raise ValueError(f"報告書ID {report_id} が見つかりません")
+        
+        records = load_checksheet_records(
+            report.park_id, datetime.fromisoformat(date_from), datetime.fromisoformat(date_to)
+        )
+        if not records:
+            raise ValueError("対象期間の点検がありません")
+        report_progress(0.1)
+        
+        data = checksheet_exporter.workbook(records)
+        report_progress(0.8)
+        
+        # 書きかけのファイルがダウンロードされないよう、一時ファイルに書いてから置き換える
+        path = report_file_path(report_id)
+        os.makedirs(REPORT_STORAGE_ROOT, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
         try:
-            model = load_model(config['path'])
-            inference_models[part_name] = model
-            print(f"✓ {part_name} モデル読み込み成功: {config['path']}")
-        except Exception as e:
-            print(f"⚠ {part_name} モデル読み込み失敗: {e}")
-            inference_models[part_name] = None
+            linked = {link.inspection_id for link in report.inspection_links}
+            for record in records:
+                if record['inspection_id'] not in linked:
+                    db.session.add(InspectionReport(inspection_id=record['inspection_id'], report_id=report_id))
+            report.file_url = download_url
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        
+        sys.stderr.write(f"✓ 報告書 {report_id} を生成（点検 {len(records)} 件）\n")
+        sys.stderr.flush()
+        
+        return {
+            'report_id': report_id,
+            'file_url': download_url,
+            'inspection_count': len(records),
+            'file_size': len(data)
+        }
+
 
-# 起動時にモデルを読み込む
-load_all_models()
+@app.route('/api/reports/<int:report_id>', methods=['GET'])
+def get_report(report_id):
+    """報告書の状態（file_url は生成が終わるまで null）と最新の生成ジョブ"""
+    report = Report.query.get_or_404(report_id)
+    job = job_store.find('render_report', f'report:{report_id}')
+    return jsonify({
+        'report_id': report.report_id,
+        'park_id': report.park_id,
+        'employee_id': report.employee_id,
+        'created_date': report.created_date.isoformat() if report.created_date else None,
+        'status': report.status.value if report.status else None,
+        'file_url': report.file_url,
+        'job': public_job(job) if job else None
+    })
+
+
+@app.route('/api/reports/<int:report_id>/download', methods=['GET'])
+def download_report(report_id):
+    """生成済みの報告書ファイルを返す"""
+    report = Report.query.get_or_404(report_id)
+    path = report_file_path(report_id)
+    if not report.file_url or not os.path.exists(path):
+        return jsonify({'error': '報告書はまだ生成されていません'}), 404
+    
+    return send_file(
+        path,
+        as_attachment=True,
+        download_name=f"報告書_{report_id}.xlsx",
+        mimetype=XLSX_MIMETYPE
+    )
 
 # ============================================================
 # 推論関数（改善版）
 # ============================================================
 
-def predict_equipment_part(image_binary, part_name):
+def predict_equipment_part(image_binary, part_name, digest=None):
     """
     画像から指定されたパーツを推論
     
     Args:
         image_binary: バイナリ画像データ
         part_name: 'chain', 'joint', 'pole', 'seat'
+        digest: image_binary の内容ハッシュ（計算済みなら渡す）
     
     Returns:
         (predicted_class, confidence, all_confidences)
         例：('rust_B', 0.85, {'normal': 0.05, 'rust_B': 0.85, 'rust_C': 0.10})
+    
+    推論キューが満杯の場合は InferenceBusy を送出（呼び出し側で 503 を返す）
     """
+    return predict_parts(image_binary, [part_name], digest)[part_name]
+
+
+def predict_parts(image_binary, part_names, digest=None):
+    """
+    同じ画像を複数パーツのモデルで推論
     
-    if part_name not in inference_models or inference_models[part_name] is None:
-        return None, None, None
+    キャッシュ済みのパーツはそのまま返し、残りだけを推論する。
+    複数パーツを推論する場合はマルチヘッドモデルでバックボーンを1回だけ計算する
     
-    try:
-        # 画像をPIL Imageに変換
-        img = Image.open(io.BytesIO(image_binary))
-        
-        # RGB に変換
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # モデルに合わせてリサイズ
-        img_size = MODELS_CONFIG[part_name]['size']
-        img = img.resize((img_size, img_size))
-        
-        # 正規化
-        img_array = np.array(img, dtype='float32') / 255.0
-        img_batch = np.expand_dims(img_array, axis=0)
-        
-        # 予測実行
-        model = inference_models[part_name]
-        predictions = model.predict(img_batch, verbose=0)
-        
-        # 結果を取得
-        confidence = float(np.max(predictions[0]))
-        predicted_class_index = int(np.argmax(predictions[0]))
-        predicted_class = MODELS_CONFIG[part_name]['classes'][predicted_class_index]
-        
-        # すべてのクラスの信頼度
-        all_confidences = {
-            MODELS_CONFIG[part_name]['classes'][i]: float(predictions[0][i])
-            for i in range(len(MODELS_CONFIG[part_name]['classes']))
-        }
-        
-        sys.stderr.write(f"✓ {part_name} 予測: {predicted_class} ({confidence:.4f})\n")
-        sys.stderr.flush()
-        
-        return predicted_class, confidence, all_confidences
+    Returns:
+        {part_name: (predicted_class, confidence, all_confidences)}
+    """
+    digest = digest or image_digest(image_binary)
+    results = {}
+    fingerprints = {}
     
-    except Exception as e:
-        sys.stderr.write(f"✗ {part_name} 予測エラー: {e}\n")
-        sys.stderr.flush()
-        return None, None, None
+    for name in part_names:
+        if name not in MODELS_CONFIG:
+            results[name] = (None, None, None)
+            continue
+        fingerprints[name] = model_registry.fingerprint(name)
+        cached = result_cache.get(digest, name, fingerprints[name])
+        if cached is not None:
+            results[name] = cached
+    
+    missing = [name for name in part_names if name not in results]
+    if not missing:
+        return results
+    
+    for name, result in run_inference(image_binary, missing, digest).items():
+        if result[0] is not None:
+            result_cache.put(digest, name, fingerprints[name], result)
+        results[name] = result
+    
+    return results
+
+
+def run_inference(image_binary, part_names, digest):
+    """INFERENCE_MODE に応じて、このプロセス内か推論サーバーで推論する"""
+    if inference_client is not None:
+        try:
+            return inference_client.predict_parts(image_binary, part_names, digest)
+        except InferenceBusy:
+            raise
+        except Exception as e:
+            sys.stderr.write(f"✗ 推論サーバーエラー: {e}\n")
+            sys.stderr.flush()
+            return {name: (None, None, None) for name in part_names}
+    
+    return predict_with_registry(
+        model_registry,
+        preprocess_cache,
+        image_binary,
+        part_names,
+        digest=digest,
+        timeout=INFERENCE_TIMEOUT_SEC
+    )
+
+
+def inference_busy_response(error):
+    """推論キューが満杯のときの 503 レスポンス"""
+    sys.stderr.write(f"⚠ 推論受付停止: {error}\n")
+    sys.stderr.flush()
+    response = jsonify({
+        'success': False,
+        'error': '推論サーバーが混雑しています。しばらくしてから再送してください',
+        'detail': str(error)
+    })
+    response.headers['Retry-After'] = str(INFERENCE_RETRY_AFTER_SEC)
+    return response, 503
 
 def class_to_condition(predicted_class):
     """
@@ -463,10 +779,18 @@ def upload_photo(inspection_id):
     """
     写真アップロード + AI判定結果保存（4パーツ対応版）
     
-    Request JSON:
+    Request multipart/form-data（推奨）:
+        パーツ名をフィールド名にした画像ファイル（chain / joint / pole / seat）、
+        任意で async=1
+    
+    Request image/*（画像1枚をそのままボディに入れる）:
+        ?part=chain&part=seat で対象パーツを指定（同じ画像を複数パーツで判定）
+    
+    Request JSON（互換用）:
     {
         "photo_data": "<base64_image>",
         "filename": "inspection_001.jpg",
+        "async": false,
         "parts": {
             "chain": {"image_data": "<base64>"},
             "joint": {"image_data": "<base64>"},
@@ -474,132 +798,81 @@ def upload_photo(inspection_id):
             "seat": {"image_data": "<base64>"}
         }
     }
+    
+    "async": true（または ?async=1）の場合は写真を保存した時点で 202 とジョブIDを返し、
+    推論と InspectionDetail の更新はバックグラウンドで行う。
+    結果は /api/jobs/<job_id>（または /api/jobs/<job_id>/events）で取得する。
+    
+    client_upload_id（クライアントが撮影時に生成した UUID。フォーム・クエリ・JSON のいずれか）を
+    付けた場合は /api/bulk_upload と同じ UploadReceipt で受付を記録し、
+    同じ ID の再送には写真を重複登録せず初回の結果を返す（パーツ画像は1枚のみ）
     """
     
     try:
-        data = request.json
-        
         # 1. 点検レコードを取得
         inspection = Inspection.query.get_or_404(inspection_id)
         
-        # 2. 各パーツについて推論と結果保存
-        part_results = {}
-        worst_grade = GradeEnum.A
-        
-        if 'parts' in data:
-            for part_name, part_data in data['parts'].items():
-                if not part_data or 'image_data' not in part_data:
-                    continue
-                
-                try:
-                    # Base64デコード
-                    image_base64 = part_data['image_data']
-                    if ',' in image_base64:
-                        image_base64 = image_base64.split(',')[1]
-                    
-                    image_binary = base64.b64decode(image_base64)
-                    
-                    # 推論実行
-                    predicted_class, confidence, all_confidences = predict_equipment_part(
-                        image_binary, 
-                        part_name
-                    )
-                    
-                    if predicted_class is None:
-                        part_results[part_name] = {
-                            'error': 'Model not loaded or prediction failed'
-                        }
-                        continue
-                    
-                    # Condition と Grade に変換
-                    condition = class_to_condition(predicted_class)
-                    grade = class_to_grade(predicted_class)
-                    part_enum = part_name_to_enum(part_name)
-                    
-                    # 3. InspectionDetail レコードを取得または作成
-                    detail = InspectionDetail.query.filter_by(
-                        inspection_id=inspection_id,
-                        part=part_enum
-                    ).first()
-                    
-                    if detail:
-                        detail.condition = condition
-                        detail.grade = grade
-                        detail.confidence = confidence
-                        detail.is_ai_predicted = True
-                        detail.updated_at = datetime.utcnow()
-                    else:
-                        detail = InspectionDetail(
-                            inspection_id=inspection_id,
-                            part=part_enum,
-                            condition=condition,
-                            grade=grade,
-                            confidence=confidence,
-                            is_ai_predicted=True,
-                            ai_raw_result=json.dumps({
-                                'part': part_name,
-                                'predicted_class': predicted_class,
-                                'confidence': confidence,
-                                'all_confidences': all_confidences,
-                                'timestamp': datetime.utcnow().isoformat()
-                            })
-                        )
-                        db.session.add(detail)
-                    
-                    db.session.flush()
-                    
-                    # 4. Photo レコード作成
-                    photo = InspectionPhoto(
-                        inspection_id=inspection_id,
-                        detail_id=detail.detail_id,
-                        photo_data=image_binary,
-                        file_size=len(image_binary),
-                        uploaded_by=session.get('user_id')
-                    )
-                    db.session.add(photo)
-                    db.session.flush()
-                    
-                    # 5. 結果を保存
-                    part_results[part_name] = {
-                        'success': True,
-                        'detail_id': detail.detail_id,
-                        'photo_id': photo.photo_id,
-                        'predicted_class': predicted_class,
-                        'confidence': float(confidence),
-                        'grade': grade.value,
-                        'condition': condition.value
-                    }
-                    
-                    # 最悪グレードを更新
-                    grade_order = {'A': 0, 'B': 1, 'C': 2, 'D': 3}
-                    if grade_order.get(grade.value, 0) > grade_order.get(worst_grade.value, 0):
-                        worst_grade = grade
-                    
-                except Exception as part_error:
-                    sys.stderr.write(f"❌ {part_name} 処理エラー: {str(part_error)}\n")
-                    sys.stderr.flush()
-                    part_results[part_name] = {'error': str(part_error)}
+        # 2. 各パーツの画像を取り出す（multipart / image/* はそのまま、JSON は Base64 をデコード）
+        if request.mimetype == 'multipart/form-data':
+            part_images, part_errors = read_multipart_part_images()
+            data = request.form
+        elif request.mimetype.startswith('image/'):
+            image_binary = read_raw_image()
+            if not image_binary:
+                return jsonify({'error': '画像データが空です'}), 400
+            part_images = {part_name: image_binary for part_name in request.args.getlist('part')}
+            part_errors = {}
+            data = None
+        else:
+            data = request.json
+            part_images, part_errors = decode_part_images(data.get('parts') or {})
         
-        # 6. Inspection テーブルを更新
-        inspection.photography_at = datetime.utcnow()
-        inspection.photographer_id = session.get('user_id')
-        inspection.overall_grade = worst_grade
+        if not part_images and not part_errors:
+            return jsonify({'error': 'パーツ画像がありません'}), 400
         
-        # 7. コミット
-        db.session.commit()
+        # 再送の確認（受付済みなら初回の結果を返す）
+        client_upload_id = read_client_upload_id(data)
+        receipt_ids = None
+        if client_upload_id is not None:
+            if not is_uuid(client_upload_id):
+                return jsonify({'error': 'client_upload_id が UUID ではありません'}), 400
+            if len(part_images) != 1 or part_errors:
+                return jsonify({'error': 'client_upload_id を付ける場合はパーツ画像を1枚にしてください'}), 400
+            receipt = UploadReceipt.query.get(client_upload_id)
+            if receipt is not None:
+                return duplicate_upload_response(receipt)
+            receipt_ids = {part_name: client_upload_id for part_name in part_images}
         
-        sys.stderr.write(f"✓ 点検ID {inspection_id} の処理完了\n")
-        sys.stderr.flush()
+        if is_async_request(data):
+            return start_async_upload(inspection.inspection_id, part_images, part_errors, receipt_ids)
+        
+        # 3. 推論と結果保存
+        try:
+            result = process_inspection_upload(
+                inspection,
+                part_images,
+                session.get('user_id'),
+                part_errors=part_errors,
+                receipt_ids=receipt_ids
+            )
+        except IntegrityError:
+            # 同じ ID が並行して登録された（先に登録された方の結果を返す）
+            db.session.rollback()
+            receipt = UploadReceipt.query.get(client_upload_id) if client_upload_id else None
+            if receipt is None:
+                raise
+            return duplicate_upload_response(receipt)
         
         # 8. レスポンス
-        return jsonify({
-            'success': True,
-            'inspection_id': inspection_id,
-            'overall_grade': worst_grade.value,
-            'parts': part_results,
-            'timestamp': datetime.utcnow().isoformat()
-        }), 200
+        return jsonify(result), 200
         
+    except InferenceBusy as e:
+        db.session.rollback()
+        return inference_busy_response(e)
+    except RequestEntityTooLarge:
+        # UPLOAD_MAX_MB を超えたリクエストは 500 にせず 413 のまま返す
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         sys.stderr.write(f"❌ エラー: {str(e)}\n")
@@ -609,67 +882,1188 @@ def upload_photo(inspection_id):
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/inspection/<int:inspection_id>/results', methods=['GET'])
-def get_inspection_results(inspection_id):
-    """点検結果を取得（既存コード）"""
+def is_async_request(data):
+    """?async=1、フォームの async=1 または JSON の "async": true で非同期モード"""
+    if request.args.get('async') in ('1', 'true'):
+        return True
+    if data is request.form:
+        return data.get('async') in ('1', 'true')
+    return bool(data and data.get('async'))
+
+
+def read_client_upload_id(data):
+    """client_upload_id をクエリ・フォーム・JSON のいずれかから取り出す（無ければ None）"""
+    client_upload_id = request.args.get('client_upload_id')
+    if client_upload_id is None and data is not None:
+        client_upload_id = data.get('client_upload_id')
+    return str(client_upload_id) if client_upload_id is not None else None
+
+
+def is_uuid(value):
     try:
-        from models import Inspection, InspectionDetail
-        
-        inspection = Inspection.query.get_or_404(inspection_id)
-        details = InspectionDetail.query.filter_by(inspection_id=inspection_id).all()
-        
-        results = {
-            'inspection_id': inspection_id,
-            'overall_grade': inspection.overall_grade.value if inspection.overall_grade else None,
-            'parts': []
-        }
-        
-        for detail in details:
-            results['parts'].append({
-                'part': detail.part.value,
-                'condition': detail.condition.value if detail.condition else None,
-                'grade': detail.grade.value if detail.grade else None,
-                'confidence': detail.confidence,
-                'is_ai_predicted': detail.is_ai_predicted
-            })
-        
-        return jsonify(results)
-        
-    except Exception as e:
-        sys.stderr.write(f"❌ エラー: {str(e)}\n")
-        sys.stderr.flush()
-        return jsonify({'error': str(e)}), 500
-@app.route('/api/analyze_photo', methods=['POST'])
-def analyze_photo():
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+def duplicate_upload_response(receipt):
+    """受付済みの client_upload_id への再送（写真は登録せず、初回の結果を返す）"""
+    part_result = json.loads(receipt.result_json or '{}')
+    part_name = receipt.part.value
+    body = {
+        'success': True,
+        'duplicate': True,
+        'inspection_id': receipt.inspection_id,
+        'photo_ids': {part_name: receipt.photo_id},
+        'parts': {part_name: part_result}
+    }
+    job_id = part_result.get('job_id')
+    if job_id and not part_result.get('success'):
+        # 非同期モードで推論がまだ終わっていない（初回と同じジョブを待ってもらう）
+        body.update({
+            'job_id': job_id,
+            'status_url': url_for('get_job', job_id=job_id),
+            'events_url': url_for('job_events', job_id=job_id)
+        })
+        return jsonify(body), 202
+    return jsonify(body), 200
+
+
+def read_multipart_part_images():
     """
-    写真を受け取り、AI判定を実行
-    compare_all=true で全モデル比較モード
+    multipart/form-data のファイルフィールド（フィールド名 = パーツ名）を読み込む
+    
+    ファイル部分は Werkzeug が一時ファイルに退避しているので、
+    Base64 文字列としてメモリに展開されることはない
+    
+    Returns:
+        (part_images, part_errors)
     """
-    try:
-        data = request.get_json()
-        
-        part = data.get('part')
-        item = data.get('item')
-        image_data = data.get('image_data')
-        compare_all = data.get('compare_all', False)
-        
-        if not image_data:
-            return jsonify({'error': 'image_data は必須です'}), 400
+    part_images = {}
+    part_errors = {}
+    for part_name, file_storage in request.files.items():
+        image_binary = file_storage.read()
+        if image_binary:
+            part_images[part_name] = image_binary
+        else:
+            part_errors[part_name] = {'error': '画像ファイルが空です'}
+    return part_images, part_errors
+
+
+def read_raw_image():
+    """
+    image/* のリクエストボディをそのまま読み込む（空なら b''。呼び出し側で 400 を返す）
+    
+    Content-Length が MAX_CONTENT_LENGTH を超える場合は RequestEntityTooLarge（413）を送出する
+    """
+    return request.stream.read()
+
+
+def decode_part_images(parts):
+    """
+    {"chain": {"image_data": "<base64>"}, ...} をデコード（パーツごとに並列）
+    
+    Returns:
+        (part_images, part_errors)
+        part_images: {part_name: image_binary}
+        part_errors: {part_name: {'error': ...}}（デコードに失敗したパーツ）
+    """
+    part_images = {}
+    part_errors = {}
+    
+    targets = [
+        (part_name, part_data['image_data'])
+        for part_name, part_data in parts.items()
+        if part_data and 'image_data' in part_data
+    ]
+    futures = [
+        (part_name, part_executor.submit(decode_base64_image, image_base64))
+        for part_name, image_base64 in targets
+    ]
+    
+    for part_name, future in futures:
+        try:
+            part_images[part_name] = future.result()
+        except Exception as part_error:
+            sys.stderr.write(f"❌ {part_name} 処理エラー: {str(part_error)}\n")
+            sys.stderr.flush()
+            part_errors[part_name] = {'error': str(part_error)}
+    
+    return part_images, part_errors
+
+
+def decode_base64_image(image_base64):
+    """data URL または素の Base64 文字列をバイナリに変換"""
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]
+    return base64.b64decode(image_base64)
+
+
+def predict_part_images(part_images):
+    """
+    パーツ画像をまとめて推論（画像ごとに並列、同じ画像のパーツはマルチヘッドで1回）
+    
+    Returns:
+        {part_name: (predicted_class, confidence, all_confidences)}
+    """
+    return predict_image_sets([part_images])[0]
+
+
+def predict_image_sets(image_sets):
+    """
+    複数の点検のパーツ画像をまとめて推論
+    
+    すべての画像を同時に投入するので、同じモデルへの推論はマイクロバッチで1回の predict にまとまる
+    
+    Args:
+        image_sets: [{part_name: image_binary}, ...]
+    
+    Returns:
+        [{part_name: (predicted_class, confidence, all_confidences)}, ...]（image_sets と同じ順）
+    """
+    futures = []
+    for index, part_images in enumerate(image_sets):
+        parts_by_image = {}
+        for part_name, image_binary in part_images.items():
+            parts_by_image.setdefault(image_binary, []).append(part_name)
         
-        # Base64デコード
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+        for image_binary, part_names in parts_by_image.items():
+            futures.append((index, part_executor.submit(predict_parts, image_binary, part_names)))
+    
+    predictions = [{} for _ in image_sets]
+    for index, future in futures:
+        predictions[index].update(future.result())  # InferenceBusy はそのまま送出
+    return predictions
+
+
+def process_inspection_upload(inspection, part_images, user_id, part_errors=None, photos=None,
+                              receipt_ids=None):
+    """
+    パーツ画像を推論し、InspectionDetail / InspectionPhoto / Inspection を更新してコミット
+    
+    推論はパーツごとに並列で行い、DB への書き込みはすべての推論が終わってから
+    まとめて行う（1回のコミット）。パーツごとの書き込みはセーブポイントで区切るので、
+    1つのパーツの書き込みに失敗してもそのパーツのエラーを記録して他のパーツは保存する
+    
+    Args:
+        inspection: Inspection
+        part_images: {part_name: image_binary}
+        user_id: アップロードしたユーザーの employee_id
+        part_errors: デコード等で既に失敗したパーツの結果
+        photos: {part_name: InspectionPhoto} 保存済みの写真（非同期モード）。
+                指定したパーツは新しい写真を作らず detail_id を紐付ける
+        receipt_ids: {part_name: client_upload_id} 一括アップロードの受付ID。
+                成功したパーツの UploadReceipt を同じコミットで記録する
+    
+    Returns:
+        upload_photo のレスポンス本文（dict）
+    """
+    part_results = dict(part_errors or {})
+    
+    # 推論実行（パーツごとに並列）
+    predictions = predict_part_images(part_images)
+    
+    # 3. 既存の InspectionDetail を1回のクエリで取得
+    existing_details = load_existing_details([inspection.inspection_id])
+    
+    # 推論結果を InspectionDetail に反映し、Photo レコードを作成（非同期モードでは保存済みの写真に紐付け）
+    evaluated, part_photos = write_part_results(
+        inspection, part_images, predictions, existing_details, part_results, user_id, photos
+    )
+    
+    # 5〜6. 結果をまとめ、Inspection テーブルを更新
+    result = finish_inspection_upload(
+        inspection, evaluated, part_photos, part_results, user_id, existing_details, receipt_ids
+    )
+    
+    # 7. コミット（遊具の最新判定はコミット時に同じトランザクションで更新される）
+    db.session.commit()
+    
+    sys.stderr.write(f"✓ 点検ID {inspection.inspection_id} の処理完了\n")
+    sys.stderr.flush()
+    
+    return result
+
+
+def write_part_results(inspection, part_images, predictions, existing_details, part_results, user_id, photos=None):
+    """
+    パーツごとに InspectionDetail と InspectionPhoto を書き込む（パーツごとのセーブポイント）
+    
+    書き込みに失敗したパーツはセーブポイントまで戻し、part_results にエラーを記録する
+    
+    Returns:
+        (evaluated, part_photos)
+    """
+    evaluated = {}
+    part_photos = {}
+    for part_name in part_images:
+        try:
+            with db.session.begin_nested():
+                part_evaluated = apply_part_predictions(
+                    inspection, {part_name: part_images[part_name]}, predictions, existing_details, part_results
+                )
+                db.session.flush()
+                photos_for_part = attach_part_photos(inspection, part_evaluated, part_images, user_id, photos)
+                db.session.flush()
+        except Exception as part_error:
+            sys.stderr.write(f"❌ {part_name} 書き込みエラー: {str(part_error)}\n")
+            sys.stderr.flush()
+            part_results[part_name] = {'error': str(part_error)}
+            # 取り消された新しい行は外す（既存の行はセーブポイント前の判定のまま残る）
+            key = (inspection.inspection_id, part_name_to_enum(part_name))
+            detail = existing_details.get(key)
+            if detail is not None and not db.inspect(detail).persistent:
+                del existing_details[key]
+            continue
+        evaluated.update(part_evaluated)
+        part_photos.update(photos_for_part)
+    return evaluated, part_photos
+
+
+def load_existing_details(inspection_ids):
+    """{(inspection_id, InspectionPartEnum): InspectionDetail} を1回のクエリで取得"""
+    details = InspectionDetail.query.filter(InspectionDetail.inspection_id.in_(inspection_ids)).all()
+    return {(detail.inspection_id, detail.part): detail for detail in details}
+
+
+def apply_part_predictions(inspection, part_images, predictions, existing_details, part_results):
+    """
+    推論結果を InspectionDetail に反映（新しい行はセッションに追加するだけで flush しない）
+    
+    Returns:
+        {part_name: (detail, predicted_class, confidence, condition, grade)}
+        失敗したパーツは part_results にエラーを書き込む
+    """
+    inspection_id = inspection.inspection_id
+    evaluated = {}
+    for part_name in part_images:
+        try:
+            predicted_class, confidence, all_confidences = predictions[part_name]
+            
+            if predicted_class is None:
+                part_results[part_name] = {
+                    'error': 'Model not loaded or prediction failed'
+                }
+                continue
+            
+            # Condition と Grade に変換
+            condition = class_to_condition(predicted_class)
+            grade = class_to_grade(predicted_class)
+            part_enum = part_name_to_enum(part_name)
+            
+            detail = existing_details.get((inspection_id, part_enum))
+            if detail:
+                detail.condition = condition
+                detail.grade = grade
+                detail.confidence = confidence
+                detail.is_ai_predicted = True
+                detail.updated_at = datetime.utcnow()
+            else:
+                detail = InspectionDetail(
+                    inspection_id=inspection_id,
+                    part=part_enum,
+                    condition=condition,
+                    grade=grade,
+                    confidence=confidence,
+                    is_ai_predicted=True,
+                    ai_json_detail_data=json.dumps({
+                        'part': part_name,
+                        'predicted_class': predicted_class,
+                        'confidence': confidence,
+                        'all_confidences': all_confidences,
+                        'timestamp': datetime.utcnow().isoformat()
+                    })
+                )
+                db.session.add(detail)
+                existing_details[(inspection_id, part_enum)] = detail
+            
+            evaluated[part_name] = (detail, predicted_class, confidence, condition, grade)
+            
+        except Exception as part_error:
+            sys.stderr.write(f"❌ {part_name} 処理エラー: {str(part_error)}\n")
+            sys.stderr.flush()
+            part_results[part_name] = {'error': str(part_error)}
+    
+    return evaluated
+
+
+def attach_part_photos(inspection, evaluated, part_images, user_id, photos=None):
+    """
+    判定できたパーツの写真を InspectionDetail に紐付ける（detail_id が確定してから呼ぶ）
+    
+    Returns:
+        {part_name: InspectionPhoto}
+    """
+    photos = photos or {}
+    part_photos = {}
+    for part_name, (detail, _, _, _, _) in evaluated.items():
+        photo = photos.get(part_name)
+        if photo is not None:
+            photo.detail_id = detail.detail_id
+        else:
+            stored = store_photo(part_images[part_name])
+            photo = InspectionPhoto(
+                inspection_id=inspection.inspection_id,
+                detail_id=detail.detail_id,
+                uploaded_by=user_id,
+                **stored.as_columns()
+            )
+            db.session.add(photo)
+        part_photos[part_name] = photo
+    return part_photos
+
+
+def finish_inspection_upload(inspection, evaluated, part_photos, part_results, user_id, existing_details,
+                             receipt_ids=None):
+    """
+    パーツごとの結果と総合判定をまとめ、Inspection を更新（photo_id が確定してから呼ぶ）
+    
+    総合判定は、今回のパーツだけでなく existing_details にあるこの点検の全部位のうち
+    最も悪い判定（grades.latest_grades_query と同じ規則）
+    
+    Returns:
+        upload_photo のレスポンス本文（dict）
+    """
+    inspection_id = inspection.inspection_id
+    
+    # 5. 結果を保存
+    for part_name, (detail, predicted_class, confidence, condition, grade) in evaluated.items():
+        part_results[part_name] = {
+            'success': True,
+            'detail_id': detail.detail_id,
+            'photo_id': part_photos[part_name].photo_id,
+            'predicted_class': predicted_class,
+            'confidence': float(confidence),
+            'grade': grade.value,
+            'condition': condition.value
+        }
+    
+    # 受付記録（再送時はこの結果を返し、写真を重複登録しない）
+    # 非同期モードでは写真の保存時に記録済みなので、判定結果で上書きする
+    for part_name, client_upload_id in (receipt_ids or {}).items():
+        if part_name not in evaluated:
+            continue
+        result_json = json.dumps(part_results[part_name], ensure_ascii=False)
+        receipt = db.session.get(UploadReceipt, client_upload_id)
+        if receipt is not None:
+            receipt.photo_id = part_photos[part_name].photo_id
+            receipt.result_json = result_json
+        else:
+            db.session.add(UploadReceipt(
+                client_upload_id=client_upload_id,
+                inspection_id=inspection_id,
+                photo_id=part_photos[part_name].photo_id,
+                part=part_name_to_enum(part_name),
+                result_json=result_json,
+                created_by=user_id
+            ))
+    
+    # 6. Inspection テーブルを更新
+    overall_grade = worst_grade(
+        detail.grade for (detail_inspection_id, _), detail in existing_details.items()
+        if detail_inspection_id == inspection_id
+    )
+    inspection.photography_at = datetime.utcnow()
+    inspection.photographer_id = user_id
+    inspection.overall_grade = overall_grade
+    
+    return {
+        'success': True,
+        'inspection_id': inspection_id,
+        'overall_grade': overall_grade.value if overall_grade else None,
+        'parts': part_results,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+
+# ============================================================
+# オフラインキューからの一括アップロード（クライアント生成の UUID で冪等）
+# ============================================================
+
+@app.route('/api/bulk_upload', methods=['POST'])
+def bulk_upload():
+    """
+    TakePhoto.html のオフラインキュー（IndexedDB）に溜まった写真をまとめて受け付ける
+    
+    Request multipart/form-data:
+        manifest: [{"client_upload_id": "<uuid>", "inspection_id": 1, "part": "chain"}, ...]
+        <client_upload_id>: 画像ファイル（manifest の各項目に1つ）
+    
+    Response:
+        {"items": [{"client_upload_id", "status", ...}]}
+        status: stored（今回登録）/ duplicate（登録済み。初回の結果を返す）/
+                rejected（再送しても成功しない）/ retry（他の登録との競合などで後で再送）
+        推論待ちが満杯の項目は retry_after（秒）付きの retry になり、以降の項目もすべて retry になる
+    
+    同じ client_upload_id が再送されても InspectionPhoto は1件しか作られない
+    ログインしていない場合は何も処理せずに 401 を返す（クライアントはキューに残したままログインし直す）
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    
+    try:
+        manifest = json.loads(request.form.get('manifest') or '[]')
+    except ValueError:
+        return jsonify({'error': 'manifest が JSON ではありません'}), 400
+    
+    if not isinstance(manifest, list) or not manifest:
+        return jsonify({'error': 'manifest は必須です'}), 400
+    if len(manifest) > BULK_UPLOAD_MAX_ITEMS:
+        return jsonify({'error': f'1回に送れるのは {BULK_UPLOAD_MAX_ITEMS} 件までです'}), 413
+    
+    # 登録済みの受付IDを1回のクエリで取得
+    upload_ids = [str(entry.get('client_upload_id', '')) for entry in manifest]
+    receipts = {
+        receipt.client_upload_id: receipt
+        for receipt in UploadReceipt.query.filter(UploadReceipt.client_upload_id.in_(upload_ids)).all()
+    }
+    
+    items = []
+    for entry, client_upload_id in zip(manifest, upload_ids):
+        if client_upload_id in receipts:
+            items.append(duplicate_receipt_item(receipts[client_upload_id]))
+            continue
+        
+        item = ingest_queued_upload(entry, client_upload_id, user_id)
+        items.append(item)
+        if 'retry_after' in item:
+            # 推論が混み合っている間は残りも後で再送してもらう（他の retry はその1件だけ）
+            for rest_id in upload_ids[len(items):]:
+                items.append({'client_upload_id': rest_id, 'status': 'retry'})
+            break
+    
+    return jsonify({'items': items})
+
+
+def ingest_queued_upload(entry, client_upload_id, user_id):
+    """キューの1件を推論して登録（受付記録と写真は同じコミット）"""
+    if not is_uuid(client_upload_id):
+        return {'client_upload_id': client_upload_id, 'status': 'rejected', 'error': 'client_upload_id が UUID ではありません'}
+    
+    part_name = entry.get('part')
+    if part_name not in MODELS_CONFIG:
+        return {'client_upload_id': client_upload_id, 'status': 'rejected', 'error': f'不明なパーツ: {part_name}'}
+    
+    inspection = Inspection.query.get(entry.get('inspection_id'))
+    if inspection is None:
+        return {'client_upload_id': client_upload_id, 'status': 'rejected', 'error': '点検が見つかりません'}
+    
+    image_file = request.files.get(client_upload_id)
+    image_binary = image_file.read() if image_file else None
+    if not image_binary:
+        return {'client_upload_id': client_upload_id, 'status': 'rejected', 'error': '画像ファイルがありません'}
+    
+    try:
+        result = process_inspection_upload(
+            inspection,
+            {part_name: image_binary},
+            user_id,
+            receipt_ids={part_name: client_upload_id}
+        )
+    except InferenceBusy as e:
+        db.session.rollback()
+        return {'client_upload_id': client_upload_id, 'status': 'retry', 'error': str(e),
+                'retry_after': INFERENCE_RETRY_AFTER_SEC}
+    except IntegrityError as e:
+        # 同じ ID が並行して登録された（先に登録された方の結果を返す）
+        db.session.rollback()
+        receipt = UploadReceipt.query.get(client_upload_id)
+        if receipt is not None:
+            return duplicate_receipt_item(receipt)
+        # 部位の判定が並行して作られた（unique_inspection_part）など。
+        # この1件だけ後で再送してもらい、バッチ全体は失敗にしない
+        sys.stderr.write(f"⚠ 一括アップロード {client_upload_id} 制約違反: {str(e.orig)}\n")
+        sys.stderr.flush()
+        return {'client_upload_id': client_upload_id, 'status': 'retry', 'error': '他の登録と競合しました'}
+    except Exception as e:
+        db.session.rollback()
+        sys.stderr.write(f"❌ 一括アップロード {client_upload_id} エラー: {str(e)}\n")
+        sys.stderr.flush()
+        return {'client_upload_id': client_upload_id, 'status': 'retry', 'error': str(e)}
+    
+    part_result = result['parts'][part_name]
+    if not part_result.get('success'):
+        return {'client_upload_id': client_upload_id, 'status': 'retry', **part_result}
+    return {'client_upload_id': client_upload_id, 'status': 'stored', **part_result}
+
+
+def duplicate_receipt_item(receipt):
+    return {
+        'client_upload_id': receipt.client_upload_id,
+        'status': 'duplicate',
+        **json.loads(receipt.result_json or '{}')
+    }
+
+
+@app.route('/sw.js')
+def service_worker():
+    """オフラインキューの Service Worker（スコープを / にするためルート直下で配信）"""
+    response = send_from_directory(os.path.join(BASE_DIR, 'static', 'JS'), 'sw.js', mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# ============================================================
+# 公園単位の一括取り込み（複数の点検をチャンクごとにまとめて推論・書き込み）
+# ============================================================
+
+@app.route('/api/inspections/bulk_ingest', methods=['POST'])
+def bulk_ingest_inspections():
+    """
+    多数の点検のパーツ写真を1リクエストで取り込む
+    
+    Request multipart/form-data（ファイル部分は Werkzeug が一時ファイルに退避）:
+        manifest: [{"inspection_id": 1, "parts": {"chain": "<ファイルのフィールド名>", ...}}, ...]
+        <フィールド名>: 画像ファイル
+    
+    Response:
+        {
+            "items": [{"index": 0, "inspection_id": 1, "success": true, "overall_grade": ..., "parts": {...}}, ...],
+            "summary": {"total": n, "succeeded": n, "failed": n}
+        }
+    
+    BULK_INGEST_CHUNK_SIZE 件ごとに全画像の推論をまとめて行い、
+    InspectionDetail / InspectionPhoto の追加と Inspection の更新を1トランザクションで書き込む。
+    チャンクの書き込みに失敗した場合はそのチャンクの項目だけが失敗になる。
+    
+    リクエストサイズの上限は UPLOAD_MAX_MB ではなく BULK_INGEST_MAX_MB。
+    項目数が BULK_INGEST_MAX_ITEMS 以内でも上限を超える場合は 413 になるので、クライアント側で分割して送る。
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    
+    # 公園単位の写真をまとめて受け取るので、このエンドポイントだけ上限を引き上げる（フォームの読み込み前に設定）
+    request.max_content_length = BULK_INGEST_MAX_MB * 1024 * 1024
+    try:
+        manifest = json.loads(request.form.get('manifest') or '[]')
+    except ValueError:
+        return jsonify({'error': 'manifest が JSON ではありません'}), 400
+    
+    if not isinstance(manifest, list) or not manifest:
+        return jsonify({'error': 'manifest は必須です'}), 400
+    if len(manifest) > BULK_INGEST_MAX_ITEMS:
+        return jsonify({'error': f'1回に取り込めるのは {BULK_INGEST_MAX_ITEMS} 件までです'}), 413
+    
+    indexed = list(enumerate(manifest))
+    items = []
+    for chunk_start in range(0, len(indexed), BULK_INGEST_CHUNK_SIZE):
+        chunk = indexed[chunk_start:chunk_start + BULK_INGEST_CHUNK_SIZE]
+        items.extend(ingest_inspection_chunk(chunk, user_id))
+    
+    succeeded = sum(1 for item in items if item.get('success'))
+    return jsonify({
+        'items': items,
+        'summary': {'total': len(items), 'succeeded': succeeded, 'failed': len(items) - succeeded}
+    })
+
+
+def ingest_inspection_chunk(chunk, user_id):
+    """
+    manifest の1チャンク分を推論して書き込む（1回のコミット）
+    
+    Args:
+        chunk: [(index, entry), ...]
+    
+    Returns:
+        index 順の項目結果のリスト
+    """
+    items = {}
+    
+    # 形式が不正な項目はその項目だけ失敗にする
+    valid = []
+    for index, entry in chunk:
+        error = manifest_entry_error(entry)
+        if error is not None:
+            inspection_id = entry.get('inspection_id') if isinstance(entry, dict) else None
+            items[index] = {'index': index, 'inspection_id': inspection_id, 'success': False, 'error': error}
+        else:
+            valid.append((index, entry))
+    
+    # 点検レコードを1回のクエリで取得
+    inspection_ids = [entry['inspection_id'] for _, entry in valid]
+    inspections = {
+        inspection.inspection_id: inspection
+        for inspection in Inspection.query.filter(Inspection.inspection_id.in_(inspection_ids)).all()
+    } if inspection_ids else {}
+    
+    prepared = []
+    for index, entry in valid:
+        inspection_id = entry['inspection_id']
+        inspection = inspections.get(inspection_id)
+        if inspection is None:
+            items[index] = {'index': index, 'inspection_id': inspection_id, 'success': False, 'error': '点検が見つかりません'}
+            continue
+        part_images, part_results = read_manifest_part_images(entry.get('parts') or {})
+        prepared.append((index, inspection, part_images, part_results))
+    
+    try:
+        # チャンク内の全画像をまとめて推論
+        predictions = predict_image_sets([part_images for _, _, part_images, _ in prepared])
+        
+        existing_details = load_existing_details([inspection.inspection_id for _, inspection, _, _ in prepared])
+        evaluated = [
+            apply_part_predictions(inspection, part_images, part_predictions, existing_details, part_results)
+            for (_, inspection, part_images, part_results), part_predictions in zip(prepared, predictions)
+        ]
+        db.session.flush()  # InspectionDetail をまとめて INSERT
+        
+        part_photos = [
+            attach_part_photos(inspection, part_evaluated, part_images, user_id)
+            for (_, inspection, part_images, _), part_evaluated in zip(prepared, evaluated)
+        ]
+        db.session.flush()  # InspectionPhoto をまとめて INSERT
+        
+        for (index, inspection, _, part_results), part_evaluated, photos in zip(prepared, evaluated, part_photos):
+            items[index] = {
+                'index': index,
+                **finish_inspection_upload(inspection, part_evaluated, photos, part_results, user_id, existing_details)
+            }
+        
+        db.session.commit()
         
-        image_binary = base64.b64decode(image_data)
+    except Exception as e:
+        db.session.rollback()
+        busy = isinstance(e, InferenceBusy)
+        sys.stderr.write(f"❌ 一括取り込みチャンクエラー: {str(e)}\n")
+        sys.stderr.flush()
+        if not busy:
+            import traceback
+            traceback.print_exc()
+        # SQL やパラメータを含む例外メッセージはログにだけ出す
+        error = str(e) if busy else '書き込みに失敗しました（詳細はサーバーのログを確認してください）'
+        for index, inspection, _, _ in prepared:
+            items[index] = {
+                'index': index,
+                'inspection_id': inspection.inspection_id,
+                'success': False,
+                'retry': busy,
+                'error': error
+            }
+    
+    sys.stderr.write(f"✓ 一括取り込み: {len(prepared)} 件の点検を処理\n")
+    sys.stderr.flush()
+    
+    return [items[index] for index, _ in chunk]
+
+
+def manifest_entry_error(entry):
+    """manifest の1項目の形式を確認（問題なければ None、あればエラーメッセージ）"""
+    if not isinstance(entry, dict):
+        return '項目はオブジェクトで指定してください'
+    inspection_id = entry.get('inspection_id')
+    if not isinstance(inspection_id, int) or isinstance(inspection_id, bool):
+        return 'inspection_id は整数で指定してください'
+    parts = entry.get('parts')
+    if parts is not None and not isinstance(parts, dict):
+        return 'parts は {"パーツ名": "ファイルのフィールド名"} の形式で指定してください'
+    if parts and not all(isinstance(field_name, str) for field_name in parts.values()):
+        return 'parts のファイルのフィールド名は文字列で指定してください'
+    return None
+
+
+def read_manifest_part_images(parts):
+    """
+    manifest の {"chain": "<フィールド名>", ...} から画像を読み込む
+    
+    Returns:
+        (part_images, part_errors)
+    """
+    part_images = {}
+    part_errors = {}
+    for part_name, field_name in parts.items():
+        if part_name not in MODELS_CONFIG:
+            part_errors[part_name] = {'error': f'不明なパーツ: {part_name}'}
+            continue
+        image_file = request.files.get(field_name)
+        image_binary = None
+        if image_file:
+            image_file.stream.seek(0)  # 同じファイルを複数の項目から参照できるように
+            image_binary = image_file.read()
+        if image_binary:
+            part_images[part_name] = image_binary
+        else:
+            part_errors[part_name] = {'error': f'画像ファイル {field_name} がありません'}
+    return part_images, part_errors
+
+
+# ============================================================
+# 非同期アップロード（ジョブID を返してバックグラウンドで推論）
+# ============================================================
+
+def start_async_upload(inspection_id, part_images, part_errors, receipt_ids=None):
+    """
+    写真だけ先に保存してコミットし、推論ジョブを投入して 202 を返す
+    
+    receipt_ids を指定した場合は UploadReceipt を写真と同じコミットで記録する
+    （レスポンスが届かずに再送されても写真は1件のまま）
+    """
+    user_id = session.get('user_id')
+    
+    photos = {}
+    for part_name, image_binary in part_images.items():
+        stored = store_photo(image_binary)
+        photo = InspectionPhoto(
+            inspection_id=inspection_id,
+            uploaded_by=user_id,
+            **stored.as_columns()
+        )
+        db.session.add(photo)
+        photos[part_name] = photo
+    db.session.flush()
+    
+    for part_name, client_upload_id in (receipt_ids or {}).items():
+        db.session.add(UploadReceipt(
+            client_upload_id=client_upload_id,
+            inspection_id=inspection_id,
+            photo_id=photos[part_name].photo_id,
+            part=part_name_to_enum(part_name),
+            created_by=user_id
+        ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 同じ ID が並行して登録された（先に登録された方の結果を返す）
+        db.session.rollback()
+        receipt = UploadReceipt.query.get(next(iter(receipt_ids.values()))) if receipt_ids else None
+        if receipt is None:
+            raise
+        return duplicate_upload_response(receipt)
+    
+    photo_ids = {part_name: photo.photo_id for part_name, photo in photos.items()}
+    job = job_runner.submit(
+        'upload_photo',
+        inspection_id, photo_ids, user_id, part_errors, receipt_ids,
+        ref=f'inspection:{inspection_id}'
+    )
+    
+    # 再送されたときに同じジョブを待ってもらえるようにジョブIDを記録
+    # （ジョブが先に判定結果を書き込んでいたら上書きしない）
+    for part_name, client_upload_id in (receipt_ids or {}).items():
+        UploadReceipt.query.filter(
+            UploadReceipt.client_upload_id == client_upload_id,
+            UploadReceipt.result_json.is_(None)
+        ).update({
+            'result_json': json.dumps({'photo_id': photo_ids[part_name], 'job_id': job['job_id']}, ensure_ascii=False)
+        }, synchronize_session=False)
+    if receipt_ids:
+        db.session.commit()
+    
+    sys.stderr.write(f"✓ 点検ID {inspection_id} の写真を保存、ジョブ {job['job_id']} を投入\n")
+    sys.stderr.flush()
+    
+    return jsonify({
+        'success': True,
+        'inspection_id': inspection_id,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'photo_ids': photo_ids,
+        'status_url': url_for('get_job', job_id=job['job_id']),
+        'events_url': url_for('job_events', job_id=job['job_id'])
+    }), 202
+
+
+@job_runner.handler('upload_photo')
+def run_upload_job(report_progress, inspection_id, photo_ids, user_id, part_errors, receipt_ids=None):
+    """バックグラウンドで推論し、保存済みの写真を InspectionDetail に紐付ける（受付記録があれば結果を書き込む）"""
+    with app.app_context():
+        inspection = Inspection.query.get(inspection_id)
+        if inspection is None:
+            raise ValueError(f"点検ID {inspection_id} が見つかりません")
+        
+        photos = {
+            part_name: InspectionPhoto.query.get(photo_id)
+            for part_name, photo_id in photo_ids.items()
+        }
+        part_images = {part_name: photo.read_bytes() for part_name, photo in photos.items()}
+        report_progress(0.1)
+        
+        # 推論キューが満杯なら少し待って再試行
+        for attempt in range(UPLOAD_JOB_BUSY_RETRIES + 1):
+            try:
+                return process_inspection_upload(
+                    inspection, part_images, user_id,
+                    part_errors=part_errors, photos=photos, receipt_ids=receipt_ids
+                )
+            except InferenceBusy:
+                db.session.rollback()
+                if attempt == UPLOAD_JOB_BUSY_RETRIES:
+                    raise
+                time.sleep(INFERENCE_RETRY_AFTER_SEC)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """ジョブの状態と結果を取得（TakePhoto.html からポーリング）"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(public_job(job))
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """ジョブの状態変化を Server-Sent Events で通知（完了または失敗で終了）"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    
+    def stream(job):
+        yield f"data: {json.dumps(public_job(job), ensure_ascii=False)}\n\n"
+        while job is not None and job['status'] not in FINISHED_STATES:
+            changed = job_store.wait_for_change(job_id, job['version'], timeout=15)
+            if changed is None or changed['version'] == job['version']:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(public_job(changed), ensure_ascii=False)}\n\n"
+            job = changed
+    
+    return app.response_class(
+        stream(job),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# ============================================================
+# 写真の配信（<img src> でそのまま使える。ETag・Range 対応）
+# ============================================================
+
+@app.route('/api/photos/<int:photo_id>', methods=['GET'])
+def get_inspection_photo(photo_id):
+    """点検写真を返す（?size=thumb / medium で縮小版）"""
+    photo = InspectionPhoto.query.get_or_404(photo_id)
+    return send_stored_photo(photo)
+
+
+@app.route('/api/daily_report_photos/<int:photo_id>', methods=['GET'])
+def get_daily_report_photo(photo_id):
+    """日報写真を返す（?size=thumb / medium で縮小版）"""
+    photo = DailyReportPhoto.query.get_or_404(photo_id)
+    return send_stored_photo(photo)
+
+
+@app.route('/api/inspection/<int:inspection_id>/photos', methods=['GET'])
+def list_inspection_photos(inspection_id):
+    """点検の写真一覧（写真本体は含めず、サイズ別の URL を返す）"""
+    Inspection.query.get_or_404(inspection_id)
+    
+    rows = db.session.query(InspectionPhoto, InspectionDetail.part).outerjoin(
+        InspectionDetail, InspectionPhoto.detail_id == InspectionDetail.detail_id
+    ).filter(
+        InspectionPhoto.inspection_id == inspection_id
+    ).order_by(InspectionPhoto.photo_id).all()
+    
+    photos = []
+    for photo, part in rows:
+        url = url_for('get_inspection_photo', photo_id=photo.photo_id)
+        photos.append({
+            'photo_id': photo.photo_id,
+            'detail_id': photo.detail_id,
+            'part': part.value if part else None,
+            'mime_type': photo.mime_type,
+            'file_size': photo.file_size,
+            'uploaded_at': photo.uploaded_at.isoformat() if photo.uploaded_at else None,
+            'url': url,
+            'thumbnail_url': f'{url}?size=thumb',
+            'medium_url': f'{url}?size=medium',
+            'archive_url': f'{url}?size=archive' if photo.archive_storage_key else None
+        })
+    
+    return jsonify({'inspection_id': inspection_id, 'photos': photos})
+
+
+@app.route('/api/photos/<int:photo_id>/archive', methods=['POST', 'PUT'])
+def upload_photo_archive(photo_id):
+    """
+    保存用の高画質画像を後からアップロード（判定用の縮小画像はそのまま）
+    
+    multipart/form-data の image フィールド、または image/* のボディで受け付ける
+    """
+    photo = InspectionPhoto.query.get_or_404(photo_id)
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            image_file = request.files.get('image')
+            image_binary = image_file.read() if image_file else None
+        else:
+            image_binary = read_raw_image()
+        
+        if not image_binary:
+            return jsonify({'error': '画像データは必須です'}), 400
+        
+        stored = get_photo_storage().put(image_binary)
+        photo.archive_storage_key = stored.key
+        photo.archive_file_size = stored.size
+        photo.archive_mime_type = stored.mime_type
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'photo_id': photo.photo_id,
+            'archive_url': url_for('get_inspection_photo', photo_id=photo.photo_id, size='archive'),
+            'file_size': stored.size
+        })
+        
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        sys.stderr.write(f"❌ 保存用画像のアップロードエラー: {str(e)}\n")
+        sys.stderr.flush()
+        return jsonify({'error': str(e)}), 500
+
+
+def store_photo(image_binary):
+    """写真を保存先に置き、縮小版の作成をバックグラウンドで始める"""
+    storage = get_photo_storage()
+    stored = storage.put(image_binary)
+    part_executor.submit(build_photo_derivatives, storage, stored.key, image_binary)
+    return stored
+
+
+def build_photo_derivatives(storage, key, image_binary):
+    try:
+        store_derivatives(storage, key, image_binary)
+    except Exception as e:
+        # 失敗しても配信時に改めて作成する
+        sys.stderr.write(f"⚠ 縮小版の作成失敗 ({key}): {e}\n")
+        sys.stderr.flush()
+
+
+def send_stored_photo(photo):
+    """
+    保存先の写真をストリーミングで返す
+
+    ETag は写真の sha256（縮小版は sha256 にサイズ名を付けたもの）。
+    If-None-Match が一致すれば 304、Range 指定があれば 206 で該当部分だけを返す。
+    縮小版を作れない写真（PIL で開けない形式など）は元の写真を返す。
+    """
+    if not photo.storage_key:
+        return jsonify({'error': '写真データがありません'}), 404
+    
+    size_name = request.args.get('size', 'original')
+    if size_name not in ('original', 'archive') and size_name not in DERIVATIVE_SIZES:
+        return jsonify({
+            'error': f'size は original / archive / {" / ".join(DERIVATIVE_SIZES)} のいずれかです'
+        }), 400
+    
+    storage = get_photo_storage()
+    
+    if size_name in DERIVATIVE_SIZES:
+        try:
+            key = ensure_derivative(storage, photo.storage_key, size_name)
+        except FileNotFoundError:
+            return jsonify({'error': '写真ファイルが見つかりません'}), 404
+        except (OSError, Image.DecompressionBombError) as e:
+            # PIL で縮小できない写真（未対応の形式・壊れたファイル）は元の写真を返す
+            sys.stderr.write(f"⚠ 写真 {photo.storage_key} の縮小版を作れないため元の写真を返します: {e}\n")
+            sys.stderr.flush()
+            size_name = 'original'
+    
+    if size_name == 'original':
+        key = photo.storage_key
+        mimetype = photo.mime_type or 'application/octet-stream'
+        etag = photo.digest
+        length = photo.file_size
+    elif size_name == 'archive':
+        # 保存用の高画質画像（未アップロードなら 404。日報写真には無い）
+        key = getattr(photo, 'archive_storage_key', None)
+        if not key:
+            return jsonify({'error': '保存用の画像はアップロードされていません'}), 404
+        mimetype = photo.archive_mime_type or 'application/octet-stream'
+        etag = key.rsplit('/', 1)[-1]  # 保存キーの末尾は sha256
+        length = photo.archive_file_size
+    else:
+        mimetype = DERIVATIVE_MIME_TYPE
+        etag = f'{photo.digest}-{size_name}' if photo.digest else None
+        length = None
+    
+    # ローカル保存なら send_file に任せる（条件付きリクエスト・Range は Werkzeug が処理）
+    path = storage.local_path(key)
+    if path is not None:
+        if not os.path.exists(path):
+            return jsonify({'error': '写真ファイルが見つかりません'}), 404
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            etag=etag or True,
+            conditional=True,
+            max_age=PHOTO_CACHE_MAX_AGE_SEC
+        )
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+    
+    if length is None:
+        length = storage.size(key)
+    return stream_remote_photo(storage, key, mimetype, etag, length)
+
+
+def stream_remote_photo(storage, key, mimetype, etag, size):
+    """ローカルパスのない保存先（S3 など）から必要な範囲だけを取得して返す"""
+    
+    def finish(response):
+        if etag:
+            response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = PHOTO_CACHE_MAX_AGE_SEC
+        response.accept_ranges = 'bytes'
+        return response
+    
+    if etag and request.if_none_match.contains(etag):
+        return finish(app.response_class(status=304))
+    
+    # Range は単一範囲のみ対応（複数範囲や If-Range 不一致なら全体を返す）
+    byte_range = None
+    if_range = request.if_range
+    range_applies = (
+        request.range is not None
+        and len(request.range.ranges) == 1
+        and (if_range.etag is None and if_range.date is None or if_range.etag == etag)
+    )
+    if range_applies:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response = app.response_class(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return finish(response)
+    
+    start, stop = byte_range or (0, size)
+    response = app.response_class(
+        storage.iter_range(key, start, stop),
+        status=206 if byte_range else 200,
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    response.content_length = stop - start
+    if byte_range:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    return finish(response)
+
+
+@app.route('/api/inspection/<int:inspection_id>/results', methods=['GET'])
+def get_inspection_results(inspection_id):
+    """点検結果を取得（既存コード）"""
+    try:
+        from models import Inspection, InspectionDetail
+        
+        inspection = Inspection.query.get_or_404(inspection_id)
+        details = InspectionDetail.query.filter_by(inspection_id=inspection_id).all()
+        
+        results = {
+            'inspection_id': inspection_id,
+            'overall_grade': inspection.overall_grade.value if inspection.overall_grade else None,
+            'parts': []
+        }
+        
+        for detail in details:
+            results['parts'].append({
+                'part': detail.part.value,
+                'condition': detail.condition.value if detail.condition else None,
+                'grade': detail.grade.value if detail.grade else None,
+                'confidence': detail.confidence,
+                'is_ai_predicted': detail.is_ai_predicted
+            })
+        
+        return jsonify(results)
+        
+    except Exception as e:
+        sys.stderr.write(f"❌ エラー: {str(e)}\n")
+        sys.stderr.flush()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/parks/<int:park_id>/equipment_grades', methods=['GET'])
+def get_park_equipment_grades(park_id):
+    """公園の全遊具と最新判定（Equipment.latest_grade を1回のクエリで取得）"""
+    Park.query.get_or_404(park_id)
+    
+    equipments = Equipment.query.filter_by(park_id=park_id).order_by(Equipment.equipment_id).all()
+    grades = {equipment.equipment_id: equipment.latest_grade for equipment in equipments}
+    return equipment_grades_response(park_id, equipments, grades)
+
+
+@app.route('/api/parks/<int:park_id>/equipment_grades/recompute', methods=['POST'])
+def recompute_park_equipment_grades(park_id):
+    """
+    公園の全遊具の最新判定を点検結果から計算し直して保存する（管理者のみ）
+    
+    通常はコミット時に自動で更新されるので、保存値を直接書き換えた後などの修復用。
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'ログインが必要です'}), 401
+    user = user_role_cache.get(user_id)
+    if user is None or user[1] != RoleEnum.MANAGER:
+        return jsonify({'error': '管理者のみ実行できます'}), 403
+    
+    Park.query.get_or_404(park_id)
+    
+    equipments = Equipment.query.filter_by(park_id=park_id).order_by(Equipment.equipment_id).all()
+    grades = refresh_latest_grades([equipment.equipment_id for equipment in equipments])
+    db.session.commit()
+    
+    sys.stderr.write(f"↻ 公園ID {park_id} の遊具 {len(equipments)} 件の最新判定を計算し直しました\n")
+    sys.stderr.flush()
+    return equipment_grades_response(park_id, equipments, grades)
+
+
+def equipment_grades_response(park_id, equipments, grades):
+    return jsonify({
+        'park_id': park_id,
+        'equipments': [
+            {
+                'equipment_id': equipment.equipment_id,
+                'equipment_name': equipment.equipment_name,
+                'status': equipment.status.value if equipment.status else None,
+                'latest_grade': grades[equipment.equipment_id].value if grades.get(equipment.equipment_id) else None
+            }
+            for equipment in equipments
+        ]
+    })
+
+
+@app.route('/api/analyze_photo', methods=['POST'])
+def analyze_photo():
+    """
+    写真を受け取り、AI判定を実行
+    compare_all=true で全モデル比較モード
+    
+    画像は multipart/form-data の image フィールド（part / item / compare_all はフォーム値）、
+    image/* のボディ（part / item / compare_all はクエリ）、
+    または JSON の image_data（Base64、互換用）で受け付ける
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data = request.form
+            image_file = request.files.get('image')
+            image_binary = image_file.read() if image_file else None
+            compare_all = data.get('compare_all') in ('1', 'true')
+        elif request.mimetype.startswith('image/'):
+            data = request.args
+            image_binary = read_raw_image()
+            compare_all = data.get('compare_all') in ('1', 'true')
+        else:
+            data = request.get_json()
+            image_data = data.get('image_data')
+            image_binary = decode_base64_image(image_data) if image_data else None
+            compare_all = data.get('compare_all', False)
+        
+        part = data.get('part')
+        item = data.get('item')
+        
+        if not image_binary:
+            return jsonify({'error': '画像データは必須です'}), 400
         
         # === 全モデル比較モード ===
         if compare_all:
             all_results = {}
-            for model_name in ['pole', 'chain', 'joint', 'seat']:
-                predicted_class, confidence, all_confidences = predict_equipment_part(
-                    image_binary, 
-                    model_name
-                )
+            predictions = predict_parts(image_binary, ['pole', 'chain', 'joint', 'seat'])
+            for model_name, (predicted_class, confidence, all_confidences) in predictions.items():
                 if predicted_class:
                     if 'normal' in predicted_class.lower():
                         grade = 'A'
@@ -737,11 +2131,53 @@ def analyze_photo():
             'all_confidences': all_confidences
         })
         
+    except InferenceBusy as e:
+        return inference_busy_response(e)
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+# ============================================================
+# 撮影設定（TakePhoto.html が撮影画像のサイズと形式を決めるのに使う）
+# ============================================================
+
+@app.route('/api/inference_config', methods=['GET'])
+def inference_config():
+    """
+    モデルの入力サイズと撮影画像の送り方を返す
+    
+    判定用の画像は短辺を capture.min_side（パーツごとの値は parts.<part>.capture_min_side）
+    まで縮小した JPEG で送れば十分（サーバー側でモデルの入力サイズにリサイズする）
+    """
+    parts = {}
+    for part_name, config in MODELS_CONFIG.items():
+        parts[part_name] = {
+            'input_size': config['size'],
+            'classes': config['classes'],
+            'capture_min_side': CAPTURE_MIN_SIDE or config['size']
+        }
+    
+    response = jsonify({
+        'parts': parts,
+        'capture': {
+            'min_side': CAPTURE_MIN_SIDE or max(config['size'] for config in MODELS_CONFIG.values()),
+            'mime_type': 'image/jpeg',
+            'quality': CAPTURE_JPEG_QUALITY
+        },
+        'archive': {
+            'enabled': ARCHIVE_UPLOAD_ENABLED,
+            'max_side': ARCHIVE_MAX_SIDE,
+            'mime_type': 'image/jpeg',
+            'quality': ARCHIVE_JPEG_QUALITY
+        }
+    })
+    response.cache_control.max_age = 300
+    return response
+
+
 # ============================================================
 # ヘルスチェック（新規追加：モデル状態確認用）
 # ============================================================
@@ -750,18 +2186,46 @@ def analyze_photo():
 def health():
     """推論エンジンのステータス確認"""
     
-    models_status = {}
-    for part_name in MODELS_CONFIG.keys():
-        if inference_models.get(part_name) is not None:
-            models_status[part_name] = 'loaded'
-        else:
-            models_status[part_name] = 'not_loaded'
+    if inference_client is not None:
+        # 推論は inference_server.py 側で実行
+        try:
+            server_status = inference_client.status()
+            status = 'ok'
+        except Exception as e:
+            server_status = {'error': str(e)}
+            status = 'unavailable'
+        
+        return jsonify({
+            'status': status,
+            'mode': 'remote',
+            'inference_server': server_status,
+            'caches': {
+                'result': result_cache.stats(),
+                'preprocess': preprocess_cache.stats()
+            },
+            'timestamp': datetime.utcnow().isoformat()
+        }), 200
     
-    all_loaded = all(v == 'loaded' for v in models_status.values())
+    registry_status = model_registry.status()
+    states = [m['state'] for m in registry_status['models'].values()]
+    
+    if all(state == 'ready' for state in states):
+        status = 'ok'
+    elif any(state == 'loading' for state in states):
+        status = 'loading'
+    else:
+        status = 'partial'
     
     return jsonify({
-        'status': 'ok' if all_loaded else 'partial',
-        'models': models_status,
+        'status': status,
+        'mode': 'local',
+        'backend': registry_status['backend'],
+        'models': registry_status['models'],
+        'multi_head': registry_status['multi_head'],
+        'caches': {
+            'result': result_cache.stats(),
+            'preprocess': preprocess_cache.stats()
+        },
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
@@ -796,6 +2260,247 @@ def health():
 
 
 
+# ============================================================
+# 一覧 API（キーセットページネーション）
+# ============================================================
+# 並び順のキー（日時, ID）をカーソルにして「前のページの最後より後ろ」を検索する。
+# OFFSET を使わないので、何ページ目でもインデックスを1回たどるだけで済む。
+
+class ListParamError(ValueError):
+    pass
+
+
+def encode_cursor(*values):
+    """並び順のキーをカーソル文字列にする"""
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """encode_cursor の逆（types で datetime / int に戻す）"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(values) != len(types):
+            raise ValueError
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types)]
+    except (ValueError, TypeError):
+        raise ListParamError('cursor が不正です')
+
+
+def list_page_params():
+    """?limit=（LIST_PAGE_MAX_SIZE で頭打ち）と ?date_from= / ?date_to=（YYYY-MM-DD、両端を含む）"""
+    limit = request.args.get('limit', LIST_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, LIST_PAGE_MAX_SIZE))
+    try:
+        date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d') if request.args.get('date_from') else None
+        date_to = datetime.strptime(request.args['date_to'], '%Y-%m-%d') if request.args.get('date_to') else None
+    except ValueError:
+        raise ListParamError('日付は YYYY-MM-DD 形式で指定してください')
+    return limit, date_from, date_to
+
+
+def grade_param():
+    """?grade=A〜D（または「健全」などの表示名）"""
+    grade = request.args.get('grade')
+    if not grade:
+        return None
+    for member in GradeEnum:
+        if grade in (member.name, member.value):
+            return member
+    raise ListParamError(f'不明な判定: {grade}')
+
+
+def keyset_after(date_column, id_column, cursor):
+    """新しい順の (date_column, id_column) で cursor より後ろ"""
+    last_date, last_id = decode_cursor(cursor, datetime, int)
+    return or_(date_column < last_date, and_(date_column == last_date, id_column < last_id))
+
+
+def list_page_response(rows, limit, to_item, cursor_of):
+    """limit + 1 件取得した rows から1ページ分の JSON を作る"""
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        'items': [to_item(row) for row in rows],
+        'limit': limit,
+        'next_cursor': cursor_of(rows[-1]) if has_next else None
+    })
+
+
+def list_error_response(error):
+    return jsonify({'error': str(error)}), 400
+
+
+@app.route('/api/inspections', methods=['GET'])
+def list_inspections():
+    """
+    点検の一覧（点検日の新しい順）
+    
+    Query:
+        park_id, equipment_id, inspector_id, grade（総合判定 A〜D）, date_from, date_to（YYYY-MM-DD）,
+        limit（既定 LIST_PAGE_SIZE、上限 LIST_PAGE_MAX_SIZE）, cursor（前のレスポンスの next_cursor）
+    """
+    try:
+        limit, date_from, date_to = list_page_params()
+        grade = grade_param()
+        
+        query = db.session.query(
+            Inspection.inspection_id, Inspection.inspection_date, Inspection.inspector_id,
+            Inspection.overall_grade, Equipment.equipment_id, Equipment.equipment_name, Equipment.park_id
+        ).join(Equipment, Inspection.equipment_id == Equipment.equipment_id)
+        
+        if request.args.get('park_id'):
+            query = query.filter(Equipment.park_id == request.args.get('park_id', type=int))
+        if request.args.get('equipment_id'):
+            query = query.filter(Inspection.equipment_id == request.args.get('equipment_id', type=int))
+        if request.args.get('inspector_id'):
+            query = query.filter(Inspection.inspector_id == request.args.get('inspector_id', type=int))
+        if grade:
+            query = query.filter(Inspection.overall_grade == grade)
+        if date_from:
+            query = query.filter(Inspection.inspection_date >= date_from)
+        if date_to:
+            query = query.filter(Inspection.inspection_date < date_to + timedelta(days=1))
+        if request.args.get('cursor'):
+            query = query.filter(keyset_after(Inspection.inspection_date, Inspection.inspection_id, request.args['cursor']))
+        
+        rows = query.order_by(
+            Inspection.inspection_date.desc(), Inspection.inspection_id.desc()
+        ).limit(limit + 1).all()
+    except ListParamError as e:
+        return list_error_response(e)
+    
+    return list_page_response(
+        rows, limit,
+        lambda row: {
+            'inspection_id': row.inspection_id,
+            'inspection_date': row.inspection_date.isoformat(),
+            'inspector_id': row.inspector_id,
+            'overall_grade': row.overall_grade.value if row.overall_grade else None,
+            'equipment_id': row.equipment_id,
+            'equipment_name': row.equipment_name,
+            'park_id': row.park_id,
+            'results_url': url_for('get_inspection_results', inspection_id=row.inspection_id),
+            'photos_url': url_for('list_inspection_photos', inspection_id=row.inspection_id)
+        },
+        lambda row: encode_cursor(row.inspection_date, row.inspection_id)
+    )
+
+
+@app.route('/api/daily_reports', methods=['GET'])
+def list_daily_reports():
+    """
+    日報の一覧（報告日時の新しい順）
+    
+    Query:
+        park_id, equipment_id（その遊具の異常記録を含む日報）, employee_id, date_from, date_to,
+        limit, cursor
+    """
+    try:
+        limit, date_from, date_to = list_page_params()
+        
+        query = db.session.query(
+            DailyReport.daily_report_id, DailyReport.report_date, DailyReport.park_id, DailyReport.employee_id
+        )
+        if request.args.get('park_id'):
+            query = query.filter(DailyReport.park_id == request.args.get('park_id', type=int))
+        if request.args.get('employee_id'):
+            query = query.filter(DailyReport.employee_id == request.args.get('employee_id', type=int))
+        if request.args.get('equipment_id'):
+            query = query.filter(db.session.query(DailyReportDetail.detail_id).filter(
+                DailyReportDetail.daily_report_id == DailyReport.daily_report_id,
+                DailyReportDetail.equipment_id == request.args.get('equipment_id', type=int)
+            ).exists())
+        if date_from:
+            query = query.filter(DailyReport.report_date >= date_from)
+        if date_to:
+            query = query.filter(DailyReport.report_date < date_to + timedelta(days=1))
+        if request.args.get('cursor'):
+            query = query.filter(keyset_after(DailyReport.report_date, DailyReport.daily_report_id, request.args['cursor']))
+        
+        rows = query.order_by(
+            DailyReport.report_date.desc(), DailyReport.daily_report_id.desc()
+        ).limit(limit + 1).all()
+    except ListParamError as e:
+        return list_error_response(e)
+    
+    return list_page_response(
+        rows, limit,
+        lambda row: {
+            'daily_report_id': row.daily_report_id,
+            'report_date': row.report_date.isoformat(),
+            'park_id': row.park_id,
+            'employee_id': row.employee_id
+        },
+        lambda row: encode_cursor(row.report_date, row.daily_report_id)
+    )
+
+
+@app.route('/api/photos', methods=['GET'])
+def list_photos():
+    """
+    点検写真の一覧（新しい順、写真本体は含めず URL を返す）
+    
+    Query:
+        inspection_id, park_id, equipment_id, grade（部位の判定 A〜D）, uploaded_by,
+        date_from, date_to（アップロード日）, limit, cursor
+    """
+    try:
+        limit, date_from, date_to = list_page_params()
+        grade = grade_param()
+        
+        query = db.session.query(
+            InspectionPhoto.photo_id, InspectionPhoto.inspection_id, InspectionPhoto.detail_id,
+            InspectionPhoto.mime_type, InspectionPhoto.file_size, InspectionPhoto.uploaded_at,
+            InspectionPhoto.archive_storage_key, InspectionDetail.part, InspectionDetail.grade
+        ).outerjoin(InspectionDetail, InspectionPhoto.detail_id == InspectionDetail.detail_id)
+        
+        if request.args.get('inspection_id'):
+            query = query.filter(InspectionPhoto.inspection_id == request.args.get('inspection_id', type=int))
+        if request.args.get('uploaded_by'):
+            query = query.filter(InspectionPhoto.uploaded_by == request.args.get('uploaded_by', type=int))
+        if request.args.get('park_id') or request.args.get('equipment_id'):
+            query = query.join(Inspection, InspectionPhoto.inspection_id == Inspection.inspection_id)
+            if request.args.get('equipment_id'):
+                query = query.filter(Inspection.equipment_id == request.args.get('equipment_id', type=int))
+            if request.args.get('park_id'):
+                query = query.join(Equipment, Inspection.equipment_id == Equipment.equipment_id).filter(
+                    Equipment.park_id == request.args.get('park_id', type=int)
+                )
+        if grade:
+            query = query.filter(InspectionDetail.grade == grade)
+        if date_from:
+            query = query.filter(InspectionPhoto.uploaded_at >= date_from)
+        if date_to:
+            query = query.filter(InspectionPhoto.uploaded_at < date_to + timedelta(days=1))
+        if request.args.get('cursor'):
+            last_id, = decode_cursor(request.args['cursor'], int)
+            query = query.filter(InspectionPhoto.photo_id < last_id)
+        
+        rows = query.order_by(InspectionPhoto.photo_id.desc()).limit(limit + 1).all()
+    except ListParamError as e:
+        return list_error_response(e)
+    
+    def to_item(row):
+        url = url_for('get_inspection_photo', photo_id=row.photo_id)
+        return {
+            'photo_id': row.photo_id,
+            'inspection_id': row.inspection_id,
+            'detail_id': row.detail_id,
+            'part': row.part.value if row.part else None,
+            'grade': row.grade.value if row.grade else None,
+            'mime_type': row.mime_type,
+            'file_size': row.file_size,
+            'uploaded_at': row.uploaded_at.isoformat() if row.uploaded_at else None,
+            'url': url,
+            'thumbnail_url': f'{url}?size=thumb',
+            'archive_url': f'{url}?size=archive' if row.archive_storage_key else None
+        }
+    
+    return list_page_response(rows, limit, to_item, lambda row: encode_cursor(row.photo_id))
+
+
 
 
 # ============================================================
@@ -0,0 +1,174 @@
+# check_query_plans.py - 主要なクエリの実行計画を確認する
+#
+# 履歴ページ・一覧・一括出力で使うクエリに EXPLAIN を実行し、
+# テーブルの全件走査になっているものがあれば終了コード 1 で終わる。
+#
+# 使い方:
+#   python check_query_plans.py                         # config.DATABASE_URL（MySQL）
+#   python check_query_plans.py --database-url sqlite:///local.db
+#   python check_query_plans.py --min-rows 0            # 行数に関係なく全件走査を失敗にする
+import argparse
+import re
+import sys
+from datetime import datetime
+
+from sqlalchemy import and_, create_engine, or_, select, text
+
+from config import DATABASE_URL
+from grades import latest_grades_query
+from models import (
+    db, DailyReport, DailyReportPhoto, Inspection, InspectionDetail, InspectionPhoto
+)
+
+PERIOD_FROM = datetime(2026, 4, 1)
+PERIOD_TO = datetime(2026, 7, 1)
+
+
+# ============================================================
+# 確認するクエリ（名前, SELECT）
+# ============================================================
+
+def key_queries():
+    return [
+        ("遊具の最新の点検",
+         select(Inspection.inspection_id)
+         .where(Inspection.equipment_id == 1)
+         .order_by(Inspection.inspection_date.desc(), Inspection.inspection_id.desc())
+         .limit(1)),
+
+        ("遊具ごとの最新判定（grades.latest_grades）",
+         latest_grades_query(equipment_ids=[1, 2, 3])),
+
+        ("点検者の期間内の点検",
+         select(Inspection.inspection_id, Inspection.inspection_date)
+         .where(Inspection.inspector_id == 1)
+         .where(Inspection.inspection_date >= PERIOD_FROM, Inspection.inspection_date < PERIOD_TO)
+         .order_by(Inspection.inspection_date)),
+
+        ("期間内の点検（点検日・点検ID 順）",
+         select(Inspection.inspection_id)
+         .where(Inspection.inspection_date >= PERIOD_FROM, Inspection.inspection_date < PERIOD_TO)
+         .order_by(Inspection.inspection_date, Inspection.inspection_id)
+         .limit(50)),
+
+        ("点検の一覧の2ページ目以降（キーセット、/api/inspections）",
+         select(Inspection.inspection_id)
+         .where(or_(Inspection.inspection_date < PERIOD_TO,
+                    and_(Inspection.inspection_date == PERIOD_TO, Inspection.inspection_id < 100)))
+         .order_by(Inspection.inspection_date.desc(), Inspection.inspection_id.desc())
+         .limit(51)),
+
+        ("日報の一覧の2ページ目以降（キーセット、/api/daily_reports）",
+         select(DailyReport.daily_report_id)
+         .where(DailyReport.park_id == 1)
+         .where(or_(DailyReport.report_date < PERIOD_TO,
+                    and_(DailyReport.report_date == PERIOD_TO, DailyReport.daily_report_id < 100)))
+         .order_by(DailyReport.report_date.desc(), DailyReport.daily_report_id.desc())
+         .limit(51)),
+
+        ("点検の部位判定（IN）",
+         select(InspectionDetail.inspection_id, InspectionDetail.part, InspectionDetail.grade)
+         .where(InspectionDetail.inspection_id.in_([1, 2, 3]))),
+
+        ("公園の期間内の日報",
+         select(DailyReport.daily_report_id, DailyReport.report_date)
+         .where(DailyReport.park_id == 1)
+         .where(DailyReport.report_date >= PERIOD_FROM, DailyReport.report_date < PERIOD_TO)
+         .order_by(DailyReport.report_date, DailyReport.daily_report_id)),
+
+        ("点検の写真一覧",
+         select(InspectionPhoto.photo_id, InspectionPhoto.storage_key)
+         .where(InspectionPhoto.inspection_id == 1)
+         .order_by(InspectionPhoto.photo_id)),
+
+        ("日報の写真一覧",
+         select(DailyReportPhoto.photo_id, DailyReportPhoto.storage_key)
+         .where(DailyReportPhoto.daily_report_id == 1)
+         .order_by(DailyReportPhoto.photo_id)),
+    ]
+
+
+# ============================================================
+# 実行計画の確認（全件走査を探す）
+# ============================================================
+
+TABLE_NAMES = set(db.metadata.tables)
+
+
+def explain_mysql(conn, sql, min_rows):
+    """EXPLAIN の type=ALL（派生テーブル <derivedN> は除く）を全件走査とみなす"""
+    failures, warnings = [], []
+    for row in conn.execute(text("EXPLAIN " + sql)).mappings():
+        table = row.get('table') or ''
+        if table.startswith('<'):
+            continue
+        estimated = row.get('rows') or 0
+        if row.get('type') == 'ALL':
+            message = f"{table}: 全件走査（推定 {estimated} 行）"
+            (failures if estimated >= min_rows else warnings).append(message)
+        elif row.get('type') == 'index':
+            warnings.append(f"{table}: インデックス全体の走査（{row.get('key')}）")
+    return failures, warnings
+
+
+def explain_sqlite(conn, sql, min_rows):
+    """EXPLAIN QUERY PLAN の「SCAN <テーブル>」（インデックスを使わないもの）を全件走査とみなす"""
+    failures, warnings = [], []
+    for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)):
+        detail = row[-1]
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+        if match and match.group(1) in TABLE_NAMES:
+            if 'USING' in detail:
+                warnings.append(f"{detail}")
+            else:
+                failures.append(f"{match.group(1)}: 全件走査（{detail}）")
+        elif 'TEMP B-TREE' in detail:
+            warnings.append(detail)
+    return failures, warnings
+
+
+EXPLAINERS = {
+    'mysql': explain_mysql,
+    'sqlite': explain_sqlite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="主要なクエリが全件走査になっていないか確認する")
+    parser.add_argument('--database-url', default=DATABASE_URL)
+    parser.add_argument(
+        '--min-rows', type=int, default=1000,
+        help="MySQL で推定行数がこれ未満の全件走査は警告に留める（小さなテーブルではインデックスを使わない方が速いため）"
+    )
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    explain = EXPLAINERS.get(engine.dialect.name)
+    if explain is None:
+        sys.stderr.write(f"❌ 未対応のデータベース: {engine.dialect.name}\n")
+        return 2
+
+    failed = 0
+    with engine.connect() as conn:
+        for name, statement in key_queries():
+            sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+            failures, warnings = explain(conn, sql, args.min_rows)
+            if failures:
+                failed += 1
+                print(f"❌ {name}")
+            else:
+                print(f"✓ {name}")
+            for message in failures:
+                print(f"    {message}")
+            for message in warnings:
+                print(f"    ⚠ {message}")
+
+    if failed:
+        print(f"\n❌ {failed} 件のクエリが全件走査になっています")
+        return 1
+    print("\n✓ すべてのクエリがインデックスを使っています")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,131 @@ DB_NAME = os.getenv("DB_NAME")
 # データベース接続URLを生成
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
 
+# 推論設定（マイクロバッチ）
+# 1回の predict にまとめる最大枚数と、先頭の画像を待たせる最大時間(ms)
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+INFERENCE_TIMEOUT_SEC = float(os.getenv("INFERENCE_TIMEOUT_SEC", "30"))
+
+# 前処理済み画像キャッシュ（224x224 の float32 画像1枚で約0.6MB）
+PREPROCESS_CACHE_MAX_ENTRIES = int(os.getenv("PREPROCESS_CACHE_MAX_ENTRIES", "256"))
+PREPROCESS_CACHE_MAX_MB = int(os.getenv("PREPROCESS_CACHE_MAX_MB", "128"))
+
+# 推論結果キャッシュ（モデルファイルの更新は MODEL_CHECK_INTERVAL_SEC ごとに確認）
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "4096"))
+RESULT_CACHE_TTL_SEC = float(os.getenv("RESULT_CACHE_TTL_SEC", "3600"))
+MODEL_CHECK_INTERVAL_SEC = float(os.getenv("MODEL_CHECK_INTERVAL_SEC", "2"))
+
+# 推論バックエンド: keras / tflite / onnx
+# tflite・onnx は export_models.py で ./models/ に書き出したファイルを使う
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+
+# upload_photo 内でパーツごとのデコード・推論を並列に行うスレッド数
+PART_INFERENCE_WORKERS = int(os.getenv("PART_INFERENCE_WORKERS", "8"))
+
+# 推論の実行場所: local（Web プロセス内）/ remote（inference_server.py のワーカー）
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+INFERENCE_SERVER_ADDRESS = os.getenv("INFERENCE_SERVER_ADDRESS", "/tmp/park_inference.sock")
+# 推論サーバーとの接続の認証キー（既定値なし。remote モードと inference_server.py では必須）
+INFERENCE_SERVER_AUTHKEY = os.getenv("INFERENCE_SERVER_AUTHKEY", "")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+
+# 推論待ちの上限。超えたら 503 を返す（Retry-After 秒後に再送してもらう）
+INFERENCE_QUEUE_DEPTH = int(os.getenv("INFERENCE_QUEUE_DEPTH", "64"))
+INFERENCE_RETRY_AFTER_SEC = int(os.getenv("INFERENCE_RETRY_AFTER_SEC", "5"))
+
+# 最初のリクエスト受付後にバックグラウンドで全モデルを読み込むか（0 なら初回利用時のみ）
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+
+# バックグラウンドジョブ（非同期アップロード・報告書の生成）
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL_SEC = int(os.getenv("JOB_TTL_SEC", "3600"))
+# 実行中のジョブの生存確認（JOB_LEASE_SEC 秒ハートビートが無いジョブは、プロセスが停止したものとして失敗にする）
+JOB_HEARTBEAT_SEC = int(os.getenv("JOB_HEARTBEAT_SEC", "15"))
+JOB_LEASE_SEC = int(os.getenv("JOB_LEASE_SEC", "60"))
+# ジョブの実行方法: thread（投入した Web プロセスのスレッドで実行）/ worker（jobs_worker.py が
+# JOB_STORE_BACKEND=sqlite のストアから取り出して実行。lease が切れたジョブは JOB_MAX_ATTEMPTS 回まで取り出し直す）
+JOB_EXECUTION = os.getenv("JOB_EXECUTION", "thread")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_WORKER_POLL_SEC = float(os.getenv("JOB_WORKER_POLL_SEC", "1"))
+UPLOAD_JOB_BUSY_RETRIES = int(os.getenv("UPLOAD_JOB_BUSY_RETRIES", "3"))
+
+# ユーザーの役割のキャッシュ期間（点検者・公園担当者のバリデーション用。ユーザーの更新時はすぐに破棄）
+USER_ROLE_CACHE_TTL_SEC = int(os.getenv("USER_ROLE_CACHE_TTL_SEC", "300"))
+
+# ジョブの状態の保存先: sqlite（JOB_STORE_PATH、複数プロセスで共有・再起動後も残る）/ memory（プロセス内）
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite")
+JOB_STORE_PATH = os.getenv(
+    "JOB_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "jobs.sqlite3")
+)
+
+# 生成した報告書ファイルの保存先
+REPORT_STORAGE_ROOT = os.getenv(
+    "REPORT_STORAGE_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "reports")
+)
+
+# 写真の保存先: local（PHOTO_STORAGE_ROOT 以下）/ s3（S3 互換ストレージ。boto3 が必要）
+# DB には保存キー・サイズ・MIME タイプ・ダイジェストだけを保存する
+PHOTO_STORAGE_BACKEND = os.getenv("PHOTO_STORAGE_BACKEND", "local")
+PHOTO_STORAGE_ROOT = os.getenv(
+    "PHOTO_STORAGE_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "photos")
+)
+PHOTO_S3_BUCKET = os.getenv("PHOTO_S3_BUCKET")
+PHOTO_S3_PREFIX = os.getenv("PHOTO_S3_PREFIX", "photos")
+PHOTO_S3_ENDPOINT_URL = os.getenv("PHOTO_S3_ENDPOINT_URL")  # MinIO などを使う場合
+
+# 写真配信時のブラウザキャッシュ期間（ETag で再検証する）
+PHOTO_CACHE_MAX_AGE_SEC = int(os.getenv("PHOTO_CACHE_MAX_AGE_SEC", "86400"))
+
+# 写真の縮小版（一覧用サムネイル・閲覧用の中サイズ）。長辺のピクセル数と形式: webp / jpeg
+PHOTO_THUMBNAIL_SIZE = int(os.getenv("PHOTO_THUMBNAIL_SIZE", "320"))
+PHOTO_MEDIUM_SIZE = int(os.getenv("PHOTO_MEDIUM_SIZE", "1024"))
+PHOTO_DERIVATIVE_FORMAT = os.getenv("PHOTO_DERIVATIVE_FORMAT", "webp")
+PHOTO_DERIVATIVE_QUALITY = int(os.getenv("PHOTO_DERIVATIVE_QUALITY", "80"))
+
+# アップロードの上限（multipart / image/* / JSON 共通）
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "32"))
+
+# TakePhoto での撮影画像（/api/inference_config で配布）
+# 短辺を CAPTURE_MIN_SIDE（0 ならモデルの入力サイズ）まで縮小した JPEG を判定用に送る
+CAPTURE_MIN_SIDE = int(os.getenv("CAPTURE_MIN_SIDE", "0"))
+CAPTURE_JPEG_QUALITY = float(os.getenv("CAPTURE_JPEG_QUALITY", "0.85"))
+
+# 保存用の高画質画像を判定後に別途アップロードするか（長辺 ARCHIVE_MAX_SIDE、0 なら撮影サイズのまま）
+ARCHIVE_UPLOAD_ENABLED = os.getenv("ARCHIVE_UPLOAD_ENABLED", "0") == "1"
+ARCHIVE_MAX_SIDE = int(os.getenv("ARCHIVE_MAX_SIDE", "1920"))
+ARCHIVE_JPEG_QUALITY = float(os.getenv("ARCHIVE_JPEG_QUALITY", "0.92"))
+
+# オフラインキューからの一括アップロード（1リクエストあたりの最大件数）
+BULK_UPLOAD_MAX_ITEMS = int(os.getenv("BULK_UPLOAD_MAX_ITEMS", "20"))
+
+# 公園単位の一括取り込み（/api/inspections/bulk_ingest）
+# BULK_INGEST_CHUNK_SIZE 件の点検ごとに推論をまとめて行い、1トランザクションで書き込む
+BULK_INGEST_CHUNK_SIZE = int(os.getenv("BULK_INGEST_CHUNK_SIZE", "16"))
+BULK_INGEST_MAX_ITEMS = int(os.getenv("BULK_INGEST_MAX_ITEMS", "500"))
+# 一括取り込みのリクエストサイズの上限（UPLOAD_MAX_MB の代わりにこのエンドポイントだけに適用）
+# 既定値は 500 件 × 4 パーツ × 約 250KB の写真が収まる大きさ。これを超える場合はクライアント側で分割して送る
+BULK_INGEST_MAX_MB = int(os.getenv("BULK_INGEST_MAX_MB", "512"))
+
+# 一覧 API（/api/inspections など）の1ページの件数（?limit= の既定値と上限）
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "50"))
+LIST_PAGE_MAX_SIZE = int(os.getenv("LIST_PAGE_MAX_SIZE", "200"))
+
+# チェックシートの一括出力（/api/checksheets/export）
+# CHECKSHEET_EXPORT_WORKERS 個のプロセスで点検ごとに生成する（0 なら Web プロセス内で生成）
+CHECKSHEET_EXPORT_WORKERS = int(os.getenv("CHECKSHEET_EXPORT_WORKERS", "2"))
+CHECKSHEET_EXPORT_MAX_ITEMS = int(os.getenv("CHECKSHEET_EXPORT_MAX_ITEMS", "300"))
+
+# 生成済みチェックシートのキャッシュ（/api/generate_excel、0 なら無効）
+CHECKSHEET_CACHE_ROOT = os.getenv(
+    "CHECKSHEET_CACHE_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "checksheets")
+)
+CHECKSHEET_CACHE_MAX_MB = int(os.getenv("CHECKSHEET_CACHE_MAX_MB", "200"))
+
 # Flask-SQLAlchemy用の設定クラス
 class Config:
     """データベース設定"""
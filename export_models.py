@@ -0,0 +1,165 @@
+# export_models.py - ./models/ の Keras モデルを TFLite / ONNX に変換し、推論結果の一致を確認する
+#
+# 使い方:
+#   python export_models.py --format tflite                  # float32 の TFLite
+#   python export_models.py --format tflite --quantize int8  # int8 量子化
+#   python export_models.py --format onnx --parts chain seat
+#   python export_models.py --format tflite --check-only     # 書き出し済みファイルの一致確認だけ
+#
+# 書き出したファイルは INFERENCE_BACKEND=tflite / onnx で app.py から使われる
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from inference import MODELS_CONFIG, backend_model_path, load_backend_model
+from train_models import PARTS_CONFIG, export_onnx, export_tflite
+
+# ============================================================
+# パラメータ
+# ============================================================
+
+# 一致確認の合格基準
+min_top1_agreement = 0.99   # Keras とのトップ1クラス一致率
+max_confidence_diff = 0.05  # 確信度の最大差（int8 量子化時は --max-diff で緩める）
+
+parity_batch_size = 32
+calibration_samples = 200   # int8 量子化のキャリブレーションに使う訓練画像の枚数（export_tflite の上限と同じ）
+
+
+# ============================================================
+# 関数定義
+# ============================================================
+
+def load_test_images(part_name):
+    """
+    パーツの .npz を読み込み、モデルの入力サイズにリサイズ
+
+    Returns:
+        (x_test, x_calibration)
+        x_calibration: int8 量子化用の訓練画像（先頭 calibration_samples 枚。x_test と同じ前処理）
+    """
+    import tensorflow as tf
+
+    npz_file = PARTS_CONFIG[part_name]['npz_file']
+    if not os.path.exists(npz_file):
+        print(f"⚠ {part_name}: テストデータが見つかりません: {npz_file}")
+        return None, None
+
+    data = np.load(npz_file)
+    size = MODELS_CONFIG[part_name]['size']
+    x_test = tf.image.resize(data['x_test'], (size, size)).numpy().astype('float32')
+    x_calibration = tf.image.resize(
+        data['x_train'][:calibration_samples], (size, size)
+    ).numpy().astype('float32')
+    return x_test, x_calibration
+
+
+def predict_in_batches(model, images):
+    outputs = [
+        np.asarray(model.predict_on_batch(images[i:i + parity_batch_size]))
+        for i in range(0, len(images), parity_batch_size)
+    ]
+    return np.concatenate(outputs, axis=0)
+
+
+def check_parity(part_name, keras_model, backend_model, x_test, max_diff):
+    """
+    Keras モデルと変換後モデルの出力を比較
+
+    Returns:
+        (passed, {'top1_agreement', 'max_confidence_diff', 'mean_confidence_diff', 'samples'})
+    """
+    expected = predict_in_batches(keras_model, x_test)
+    actual = predict_in_batches(backend_model, x_test)
+
+    diff = np.abs(expected - actual)
+    report = {
+        'top1_agreement': float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1))),
+        'max_confidence_diff': float(np.max(diff)),
+        'mean_confidence_diff': float(np.mean(diff)),
+        'samples': int(len(x_test))
+    }
+    passed = (
+        report['top1_agreement'] >= min_top1_agreement
+        and report['max_confidence_diff'] <= max_diff
+    )
+    return passed, report
+
+
+def process_part(part_name, backend, quantize, check_only, max_diff):
+    """1つのパーツの変換と一致確認"""
+    from keras.models import load_model
+
+    keras_path = MODELS_CONFIG[part_name]['path']
+    output_path = backend_model_path(keras_path, backend)
+
+    print(f"\n=== {part_name.upper()} ({backend}) ===")
+
+    if not os.path.exists(keras_path):
+        print(f"❌ Keras モデルが見つかりません: {keras_path}")
+        return False
+
+    keras_model = load_model(keras_path)
+    x_test, x_calibration = load_test_images(part_name)
+
+    if not check_only:
+        model_name = os.path.splitext(keras_path)[0]
+        if backend == 'tflite':
+            export_tflite(keras_model, model_name, quantize=quantize, representative_data=x_calibration)
+        else:
+            export_onnx(keras_model, model_name)
+
+    if x_test is None:
+        print(f"⚠ {part_name}: 一致確認をスキップしました")
+        return True
+
+    backend_model = load_backend_model(output_path, backend)
+    passed, report = check_parity(part_name, keras_model, backend_model, x_test, max_diff)
+
+    status = "✓" if passed else "✗"
+    print(
+        f"{status} {part_name}: top1一致率 {report['top1_agreement'] * 100:.2f}% / "
+        f"確信度の最大差 {report['max_confidence_diff']:.4f} / "
+        f"平均差 {report['mean_confidence_diff']:.5f} ({report['samples']} samples)"
+    )
+    return passed
+
+
+# ============================================================
+# エントリーポイント
+# ============================================================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='パーツモデルを TFLite / ONNX に変換して一致確認する')
+    parser.add_argument('--format', choices=['tflite', 'onnx'], default='tflite')
+    parser.add_argument('--quantize', choices=['float16', 'int8'], default=None,
+                        help='TFLite の量子化方式（onnx では無視）')
+    parser.add_argument('--parts', nargs='+', choices=list(MODELS_CONFIG.keys()),
+                        default=list(MODELS_CONFIG.keys()))
+    parser.add_argument('--check-only', action='store_true',
+                        help='変換せず、書き出し済みファイルの一致確認だけ行う')
+    parser.add_argument('--max-diff', type=float, default=max_confidence_diff,
+                        help='確信度の最大差の許容値')
+    args = parser.parse_args()
+
+    results = {}
+    for part_name in args.parts:
+        try:
+            results[part_name] = process_part(
+                part_name, args.format, args.quantize, args.check_only, args.max_diff
+            )
+        except Exception as e:
+            print(f"\n❌ Error with {part_name}: {e}")
+            import traceback
+            traceback.print_exc()
+            results[part_name] = False
+
+    print(f"\n{'='*70}")
+    print("SUMMARY")
+    print(f"{'='*70}")
+    for part_name, success in results.items():
+        print(f"{'✓' if success else '✗'} {part_name}")
+
+    sys.exit(0 if all(results.values()) else 1)
@@ -0,0 +1,92 @@
+# grades.py - 遊具ごとの最新判定（直近の点検の部位判定のうち最も悪いもの）をまとめて計算する
+#
+# 遊具ごとに直近の点検を ROW_NUMBER() で選び、その部位の判定の最大（重さ順）を
+# GROUP BY で求める。何台分でも1回のクエリで済む。
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm.util import identity_key
+
+from models import db, Equipment, Inspection, InspectionDetail, GradeEnum
+
+# 判定の重さ（大きいほど悪い）
+GRADE_SEVERITY = {
+    GradeEnum.A: 1,
+    GradeEnum.B: 2,
+    GradeEnum.C: 3,
+    GradeEnum.D: 4
+}
+SEVERITY_GRADE = {severity: grade for grade, severity in GRADE_SEVERITY.items()}
+
+
+def worst_grade(grades):
+    """判定のうち最も悪いもの（latest_grades_query と同じ重さ順。判定が1つも無ければ None）"""
+    severities = [GRADE_SEVERITY[grade] for grade in grades if grade is not None]
+    return SEVERITY_GRADE[max(severities)] if severities else None
+
+
+def latest_grades_query(equipment_ids=None, park_id=None):
+    """
+    (equipment_id, 最悪の判定の重さ) を返す SELECT
+
+    直近の点検に判定済みの部位が無い遊具は重さが NULL になる。点検の無い遊具は結果に含まれない。
+    """
+    ranked = select(
+        Inspection.inspection_id,
+        Inspection.equipment_id,
+        func.row_number().over(
+            partition_by=Inspection.equipment_id,
+            order_by=(Inspection.inspection_date.desc(), Inspection.inspection_id.desc())
+        ).label('rn')
+    )
+    if equipment_ids is not None:
+        ranked = ranked.where(Inspection.equipment_id.in_(equipment_ids))
+    if park_id is not None:
+        ranked = ranked.join(Equipment, Inspection.equipment_id == Equipment.equipment_id).where(
+            Equipment.park_id == park_id
+        )
+    ranked = ranked.subquery()
+
+    severity = case(
+        *[(InspectionDetail.grade == grade, value) for grade, value in GRADE_SEVERITY.items()],
+        else_=None
+    )
+
+    return (
+        select(ranked.c.equipment_id, func.max(severity).label('severity'))
+        .select_from(ranked)
+        .outerjoin(InspectionDetail, InspectionDetail.inspection_id == ranked.c.inspection_id)
+        .where(ranked.c.rn == 1)
+        .group_by(ranked.c.equipment_id)
+    )
+
+
+def latest_grades(equipment_ids=None, park_id=None, session=None):
+    """{equipment_id: GradeEnum または None}（点検の無い遊具は含まれない）"""
+    if equipment_ids is not None and not equipment_ids:
+        return {}
+    session = session or db.session
+    rows = session.execute(latest_grades_query(equipment_ids, park_id)).all()
+    return {equipment_id: SEVERITY_GRADE.get(severity) for equipment_id, severity in rows}
+
+
+def refresh_latest_grades(equipment_ids, session=None):
+    """
+    Equipment.latest_grade を計算し直して書き込む（コミットは呼び出し側）
+
+    点検・部位の判定を変更したトランザクションでは、コミットの直前に models のイベントから
+    自動で呼ばれる。保存値が壊れたときに計算し直す場合は直接呼ぶ。
+    """
+    session = session or db.session
+    equipment_ids = list(set(equipment_ids))
+    grades = latest_grades(equipment_ids, session=session)
+    if equipment_ids:
+        # 主キー指定の一括 UPDATE（executemany）
+        session.execute(update(Equipment), [
+            {'equipment_id': equipment_id, 'latest_grade': grades.get(equipment_id)}
+            for equipment_id in equipment_ids
+        ])
+        # 一括 UPDATE は読み込み済みのオブジェクトに反映されないので、次に読むときに取り直す
+        for equipment_id in equipment_ids:
+            equipment = session.identity_map.get(identity_key(Equipment, equipment_id))
+            if equipment is not None:
+                session.expire(equipment, ['latest_grade'])
+    return grades
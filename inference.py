@@ -0,0 +1,964 @@
+# inference.py - 推論まわりの共通処理
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+
+# ============================================================
+# モデル設定（4つのパーツ対応）
+# ============================================================
+
+MODELS_CONFIG = {
+    'chain': {
+        'path': './models/chain.keras',  
+        'size': 224,
+        'classes': ['normal', 'rust_B', 'rust_C']
+    },
+    'joint': {
+        'path': './models/joint.keras',  
+        'size': 224,
+        'classes': ['normal', 'rust_B', 'rust_C']
+    },
+    'pole': {
+        'path': './models/pole.keras', 
+        'size': 224,
+        'classes': ['normal', 'rust_B', 'rust_C']
+    },
+    'seat': {
+        'path': './models/seat.keras', 
+        'size': 224,
+        'classes': ['normal', 'rust_B', 'rust_C', 'crack_B', 'crack_C']
+    }
+}
+
+
+class InferenceBusy(Exception):
+    """推論キューが上限に達している、または推論サーバーに接続できない（HTTP 503 で返す）"""
+
+
+# ============================================================
+# 画像の前処理とキャッシュ
+# ============================================================
+
+def image_digest(image_binary):
+    """画像バイト列の内容ハッシュ（SHA-256 の16進文字列）"""
+    return hashlib.sha256(image_binary).hexdigest()
+
+
+def load_image_array(image_binary, img_size):
+    """バイナリ画像を (img_size, img_size, 3) の正規化済み float32 配列に変換"""
+    # 画像をPIL Imageに変換
+    img = Image.open(io.BytesIO(image_binary))
+    
+    # RGB に変換
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    # モデルに合わせてリサイズ
+    img = img.resize((img_size, img_size))
+    
+    # 正規化
+    return np.array(img, dtype='float32') / 255.0
+
+
+class LRUCache:
+    """
+    件数とバイト数の上限を持つスレッドセーフな LRU キャッシュ
+
+    - max_entries: 最大件数
+    - max_bytes: 値の合計サイズの上限（sizeof で計測、None なら無制限）
+    - ttl: 有効期限（秒、None なら無期限）
+    - 上限を超えたら最も古く使われたものから捨てる
+    """
+
+    def __init__(self, max_entries=256, max_bytes=None, sizeof=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.ttl = ttl
+
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def purge(self, predicate):
+        """predicate(key) が True のエントリをすべて削除し、削除件数を返す"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+
+class PreprocessCache:
+    """
+    前処理済み画像テンソルのキャッシュ（画像の内容ハッシュ + サイズがキー）
+
+    同じ写真を複数パーツで推論する場合や、通信エラーで同じ写真が
+    再送された場合に、デコード・リサイズ・正規化をやり直さない。
+    返す配列は読み取り専用（呼び出し元で書き換えない）。
+    """
+
+    def __init__(self, max_entries=256, max_bytes=128 * 1024 * 1024):
+        self._cache = LRUCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            sizeof=lambda array: array.nbytes
+        )
+
+    def get_array(self, image_binary, img_size, digest=None):
+        key = (digest or image_digest(image_binary), img_size)
+
+        array = self._cache.get(key)
+        if array is None:
+            array = load_image_array(image_binary, img_size)
+            array.flags.writeable = False
+            self._cache.put(key, array)
+        return array
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# ============================================================
+# 推論結果キャッシュ
+# ============================================================
+
+def model_fingerprint(path):
+    """モデルファイルの更新時刻とサイズから作るフィンガープリント（ファイルが無ければ None）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+class ResultCache:
+    """
+    推論結果のキャッシュ（画像ダイジェスト, パーツ, モデルのフィンガープリント）がキー
+
+    モデルファイルが差し替わるとフィンガープリントが変わるため、
+    古いモデルの結果が返ることはない。
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, digest, part_name, fingerprint):
+        result = self._cache.get((digest, part_name, fingerprint))
+        if result is None:
+            return None
+        predicted_class, confidence, all_confidences = result
+        return predicted_class, confidence, dict(all_confidences)
+
+    def put(self, digest, part_name, fingerprint, result):
+        self._cache.put((digest, part_name, fingerprint), result)
+
+    def invalidate_part(self, part_name):
+        """指定パーツの結果をすべて破棄"""
+        return self._cache.purge(lambda key: key[1] == part_name)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# ============================================================
+# マイクロバッチ推論
+# ============================================================
+
+class MicroBatcher:
+    """
+    複数リクエストの画像を1つのバッチにまとめて推論する
+
+    - submit() で前処理済みの画像配列 (H, W, 3) をキューに積む
+    - max_batch_size 件たまるか、先頭の画像から max_wait_ms 経過したら flush
+    - predict_fn には (N, H, W, 3) の NumPy バッチを1回だけ渡す
+    - 各呼び出し元には自分の行の予測結果だけを返す
+    - 待ち行列が max_pending 件に達していたら InferenceBusy を送出（None なら無制限）
+    """
+
+    def __init__(self, name, predict_fn, max_batch_size=16, max_wait_ms=10, max_pending=None):
+        self.name = name
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_pending = max_pending
+
+        self._pending = []  # [(array, Future), ...]
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"micro-batcher-{name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, array):
+        """画像1枚をキューに追加し、結果を受け取る Future を返す"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} のバッチャーは停止しています")
+            if self.max_pending is not None and len(self._pending) >= self.max_pending:
+                raise InferenceBusy(f"{self.name} の推論待ちが上限 ({self.max_pending}) に達しています")
+            self._pending.append((array, future))
+            self._cond.notify()
+        return future
+
+    def predict(self, array, timeout=None):
+        """画像1枚を推論し、その画像の予測結果（1行分）を返す"""
+        return self.submit(array).result(timeout=timeout)
+
+    def close(self):
+        """新規受付を止め、キューに残った画像を処理してからスレッドを終了する"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _take_batch(self):
+        """flush 条件（件数 or 期限）を満たすまで待ってバッチを取り出す"""
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+
+            if not self._pending:
+                return []
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+
+            futures = [future for _, future in batch]
+            try:
+                outputs = self.predict_fn(np.stack([array for array, _ in batch]))
+            except Exception as e:
+                sys.stderr.write(f"✗ {self.name} バッチ推論エラー (n={len(batch)}): {e}\n")
+                sys.stderr.flush()
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for i, future in enumerate(futures):
+                future.set_result(_take_row(outputs, i))
+
+
+def _take_row(outputs, i):
+    """バッチ出力から i 行目を取り出す（マルチヘッドの場合はヘッドごとのリスト）"""
+    if isinstance(outputs, (list, tuple)):
+        return [output[i] for output in outputs]
+    return outputs[i]
+
+
+# ============================================================
+# マルチヘッド推論（バックボーン共有）
+# ============================================================
+
+def build_multi_head_model(models):
+    """
+    パーツごとのモデルを1つの推論グラフにまとめる
+
+    train_models.build_model の構成（MobileNetV2 + 分類ヘッドの Sequential）を前提に、
+    全モデルで重みが一致している MobileNetV2 の先頭部分を1回だけ計算し、
+    そこから各パーツの残りの層と分類ヘッドへ分岐させる。
+    fine-tuning で末尾の層は各モデルで異なるため、共有するのは一致部分のみ。
+
+    Args:
+        models: {part_name: keras.Model} （順序が出力の順序になる）
+
+    Returns:
+        (combined_model, shared_layer_count)
+        combined_model.predict の出力は models と同じ順序のリスト
+    """
+    import keras
+
+    part_names = list(models.keys())
+    bases = [models[name].layers[0] for name in part_names]
+    reference = bases[0]
+
+    # 全モデルで名前と重みが一致する先頭レイヤー数
+    shared_count = 0
+    for i, layer in enumerate(reference.layers):
+        if any(len(base.layers) <= i or base.layers[i].name != layer.name for base in bases[1:]):
+            break
+        reference_weights = layer.get_weights()
+        if any(not _same_weights(reference_weights, base.layers[i].get_weights()) for base in bases[1:]):
+            break
+        shared_count = i + 1
+
+    cut = _find_cut_point(reference, shared_count)
+
+    inputs = keras.Input(shape=tuple(reference.input.shape[1:]))
+    outputs = []
+
+    if cut > 0:
+        trunk = keras.Model(reference.input, reference.layers[cut].output, name='shared_trunk')
+        shared_features = trunk(inputs)
+
+    for name, base in zip(part_names, bases):
+        if cut > 0:
+            tail = keras.Model(base.layers[cut].output, base.output, name=f'{name}_tail')
+            x = tail(shared_features)
+        else:
+            x = base(inputs)
+
+        for layer in models[name].layers[1:]:
+            x = layer(x)
+        outputs.append(x)
+
+    combined = keras.Model(inputs, outputs, name='multi_head')
+    return combined, (cut + 1 if cut > 0 else 0)
+
+
+def _same_weights(weights_a, weights_b):
+    if len(weights_a) != len(weights_b):
+        return False
+    return all(
+        a.shape == b.shape and np.array_equal(a, b)
+        for a, b in zip(weights_a, weights_b)
+    )
+
+
+def _find_cut_point(model, limit):
+    """
+    model.layers[:limit] の範囲で、出力テンソルが後続に渡る唯一のテンソルになる
+    （残差接続をまたがない）最後のレイヤー位置を返す。見つからなければ 0
+    """
+    import keras
+
+    producer = {}
+    for i, layer in enumerate(model.layers):
+        producer[id(layer.output)] = i
+
+    # 各レイヤーが入力として使う、最も古いレイヤー位置
+    earliest_input = []
+    for i, layer in enumerate(model.layers):
+        if i == 0:
+            earliest_input.append(0)
+            continue
+        sources = [producer.get(id(t), 0) for t in keras.tree.flatten(layer.input)]
+        earliest_input.append(min(sources) if sources else 0)
+
+    cut = 0
+    for c in range(1, min(limit, len(model.layers) - 1)):
+        if all(earliest_input[j] >= c for j in range(c + 1, len(model.layers))):
+            cut = c
+    return cut
+
+
+# ============================================================
+# 推論バックエンド（Keras / TFLite / ONNX）
+# ============================================================
+
+BACKEND_SUFFIXES = {
+    'keras': '.keras',
+    'tflite': '.tflite',
+    'onnx': '.onnx'
+}
+
+
+def backend_model_path(path, backend):
+    """MODELS_CONFIG の .keras パスを、バックエンドに応じた成果物のパスに置き換える"""
+    if backend not in BACKEND_SUFFIXES:
+        raise ValueError(f"未対応の推論バックエンド: {backend}")
+    root, _ = os.path.splitext(path)
+    return root + BACKEND_SUFFIXES[backend]
+
+
+def load_backend_model(path, backend='keras'):
+    """
+    指定バックエンドでモデルを読み込む
+
+    どのバックエンドでも predict_on_batch(batch) -> (N, num_classes) の確率を返す
+    """
+    if backend == 'keras':
+        from keras.models import load_model
+        return load_model(path)
+    if backend == 'tflite':
+        return TFLiteModel(path)
+    if backend == 'onnx':
+        return OnnxModel(path)
+    raise ValueError(f"未対応の推論バックエンド: {backend}")
+
+
+def _tflite_interpreter_class():
+    """軽量な LiteRT / tflite_runtime があれば優先し、無ければ TensorFlow 同梱のものを使う"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteModel:
+    """
+    TFLite モデルを Keras モデルと同じ predict_on_batch で呼べるようにするラッパー
+
+    Interpreter はスレッドセーフではないため、MicroBatcher のスレッドからだけ呼ぶ。
+    int8 量子化モデルの場合は入力の量子化・出力の逆量子化もここで行う。
+    """
+
+    def __init__(self, path):
+        interpreter_class = _tflite_interpreter_class()
+        self.interpreter = interpreter_class(model_path=path, num_threads=os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._batch_size = None
+        self._refresh_details()
+
+    def _refresh_details(self):
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+
+    def predict_on_batch(self, batch):
+        interpreter = self.interpreter
+        if batch.shape[0] != self._batch_size:
+            interpreter.resize_tensor_input(self._input['index'], list(batch.shape))
+            interpreter.allocate_tensors()
+            self._refresh_details()
+            self._batch_size = batch.shape[0]
+
+        interpreter.set_tensor(self._input['index'], _quantize(batch, self._input))
+        interpreter.invoke()
+        return _dequantize(interpreter.get_tensor(self._output['index']), self._output)
+
+
+def _quantize(batch, detail):
+    dtype = detail['dtype']
+    if dtype not in (np.int8, np.uint8):
+        return batch.astype(dtype, copy=False)
+    scale, zero_point = detail['quantization']
+    info = np.iinfo(dtype)
+    return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def _dequantize(output, detail):
+    if detail['dtype'] not in (np.int8, np.uint8):
+        return output.astype('float32', copy=False)
+    scale, zero_point = detail['quantization']
+    return (output.astype('float32') - zero_point) * scale
+
+
+class OnnxModel:
+    """ONNX Runtime のセッションを Keras モデルと同じ predict_on_batch で呼べるようにするラッパー"""
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict_on_batch(self, batch):
+        return self.session.run(None, {self._input_name: batch.astype('float32', copy=False)})[0]
+
+
+# ============================================================
+# モデルレジストリ（遅延読み込み）
+# ============================================================
+
+MODEL_NOT_LOADED = 'not_loaded'
+MODEL_LOADING = 'loading'
+MODEL_READY = 'ready'
+MODEL_FAILED = 'failed'
+
+
+class ModelRegistry:
+    """
+    パーツモデルを初回利用時（またはウォームアップスレッド）に読み込んで管理する
+
+    - TensorFlow / Keras は最初にモデルを読み込むときまで import しない
+      （flask db migrate などの推論を使わないコマンドでは読み込まれない）
+    - パーツごとの状態: not_loaded / loading / ready / failed
+    - モデルファイルが差し替えられたら再読み込みし、on_reload(part_name) を呼ぶ
+    - backend: 'keras' / 'tflite' / 'onnx'（export_models.py で書き出した成果物を使う）
+    """
+
+    def __init__(self, models_config, max_batch_size=16, max_wait_ms=10,
+                 check_interval=2.0, on_reload=None, backend='keras', max_pending=None):
+        self.models_config = models_config
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_pending = max_pending
+        self.check_interval = check_interval
+        self.on_reload = on_reload
+
+        self._entries = {
+            name: {
+                'state': MODEL_NOT_LOADED,
+                'batcher': None,
+                'model': None,
+                'fingerprint': None,
+                'error': None,
+                'checked_at': 0.0,
+                'lock': threading.Lock()
+            }
+            for name in models_config
+        }
+        self._multi_head = {'state': MODEL_NOT_LOADED, 'parts': [], 'batcher': None, 'error': None}
+        self._multi_head_lock = threading.Lock()
+        self._warmup_thread = None
+        self._warmup_lock = threading.Lock()
+
+    # ---------------------------
+    # パーツ別モデル
+    # ---------------------------
+    def fingerprint(self, part_name):
+        """
+        モデルファイルの現在のフィンガープリント（推論結果キャッシュのキー用）
+
+        読み込み済みのモデルとファイルが食い違っていれば、ここで再読み込みする
+        """
+        entry = self._entries[part_name]
+        now = time.monotonic()
+        if now - entry['checked_at'] < self.check_interval:
+            return entry['fingerprint']
+
+        current = model_fingerprint(self.model_path(part_name))
+        if entry['state'] == MODEL_NOT_LOADED:
+            entry['fingerprint'] = current
+            entry['checked_at'] = now
+            return current
+
+        with entry['lock']:
+            entry['checked_at'] = now
+            if entry['state'] in (MODEL_READY, MODEL_FAILED) and current != entry['fingerprint']:
+                print(f"↻ {part_name} モデルファイルの更新を検出、再読み込みします")
+                self._load(part_name)
+                self._reset_multi_head()
+                if self.on_reload:
+                    self.on_reload(part_name)
+        return entry['fingerprint']
+
+    def model_path(self, part_name):
+        """バックエンドに応じたモデルファイルのパス"""
+        return backend_model_path(self.models_config[part_name]['path'], self.backend)
+
+    def batcher(self, part_name):
+        """パーツのバッチャーを返す（未読み込みならここで読み込む。失敗時は None）"""
+        entry = self._entries.get(part_name)
+        if entry is None:
+            return None
+
+        if entry['state'] not in (MODEL_READY, MODEL_FAILED):
+            with entry['lock']:
+                if entry['state'] not in (MODEL_READY, MODEL_FAILED):
+                    self._load(part_name)
+        return entry['batcher']
+
+    def _load(self, part_name):
+        """モデルを読み込み、バッチャーを差し替える（entry['lock'] を保持して呼ぶ）"""
+        entry = self._entries[part_name]
+        path = self.model_path(part_name)
+        entry['state'] = MODEL_LOADING
+        entry['fingerprint'] = model_fingerprint(path)
+        entry['checked_at'] = time.monotonic()
+
+        old_batcher = entry['batcher']
+        try:
+            started = time.monotonic()
+            model = load_backend_model(path, self.backend)
+            entry['model'] = model
+            entry['batcher'] = MicroBatcher(
+                part_name,
+                model.predict_on_batch,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+                max_pending=self.max_pending
+            )
+            entry['error'] = None
+            entry['state'] = MODEL_READY
+            print(f"✓ {part_name} モデル読み込み成功: {path} ({time.monotonic() - started:.1f}s)")
+        except Exception as e:
+            entry['model'] = None
+            entry['batcher'] = None
+            entry['error'] = str(e)
+            entry['state'] = MODEL_FAILED
+            print(f"⚠ {part_name} モデル読み込み失敗: {e}")
+
+        if old_batcher is not None:
+            old_batcher.close()
+
+    # ---------------------------
+    # マルチヘッドモデル
+    # ---------------------------
+    def multi_head(self):
+        """
+        (出力順のパーツ名リスト, バッチャー) を返す。使えない場合は ([], None)
+
+        未構築なら全パーツを読み込んでから組み立てる
+        """
+        if self._multi_head['state'] not in (MODEL_READY, MODEL_FAILED):
+            for name in self.models_config:
+                self.batcher(name)
+            with self._multi_head_lock:
+                if self._multi_head['state'] not in (MODEL_READY, MODEL_FAILED):
+                    self._build_multi_head()
+
+        head = self._multi_head
+        return head['parts'], head['batcher']
+
+    def _build_multi_head(self):
+        head = self._multi_head
+        head['state'] = MODEL_LOADING
+
+        if self.backend != 'keras':
+            head['parts'], head['batcher'] = [], None
+            head['error'] = 'マルチヘッドモデルは keras バックエンドのみ対応しています'
+            head['state'] = MODEL_FAILED
+            return
+
+        loaded = {
+            name: entry['model']
+            for name, entry in self._entries.items()
+            if entry['model'] is not None
+        }
+        sizes = {self.models_config[name]['size'] for name in loaded}
+        if len(loaded) < 2 or len(sizes) != 1:
+            head['parts'], head['batcher'] = [], None
+            head['error'] = '2つ以上の同じ入力サイズのモデルが必要です'
+            head['state'] = MODEL_FAILED
+            return
+
+        try:
+            combined, shared_layers = build_multi_head_model(loaded)
+            head['batcher'] = MicroBatcher(
+                'multi_head',
+                combined.predict_on_batch,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+                max_pending=self.max_pending
+            )
+            head['parts'] = list(loaded.keys())
+            head['error'] = None
+            head['state'] = MODEL_READY
+            print(f"✓ マルチヘッドモデル構築成功: {head['parts']} (共有レイヤー数: {shared_layers})")
+        except Exception as e:
+            head['parts'], head['batcher'] = [], None
+            head['error'] = str(e)
+            head['state'] = MODEL_FAILED
+            print(f"⚠ マルチヘッドモデル構築失敗（パーツ別推論を使用）: {e}")
+
+    def disable_multi_head(self, batcher, error):
+        """
+        推論に失敗したマルチヘッドを使わないようにする（以降はパーツ別のバッチャーで推論）
+
+        パーツモデルが差し替えられたら _reset_multi_head で組み直す。
+        """
+        with self._multi_head_lock:
+            head = self._multi_head
+            if head['batcher'] is not batcher:
+                return  # 他のリクエストが無効化・組み直し済み
+            head.update(state=MODEL_FAILED, parts=[], batcher=None, error=str(error))
+        print(f"⚠ マルチヘッドモデルの推論に失敗したため無効化（パーツ別推論を使用）: {error}")
+        batcher.close()
+
+    def _reset_multi_head(self):
+        """パーツモデルの差し替え後、次回利用時にマルチヘッドを組み直す"""
+        with self._multi_head_lock:
+            head = self._multi_head
+            old_batcher = head['batcher']
+            head.update(state=MODEL_NOT_LOADED, parts=[], batcher=None, error=None)
+        if old_batcher is not None:
+            old_batcher.close()
+
+    # ---------------------------
+    # ウォームアップと状態
+    # ---------------------------
+    def start_warmup(self):
+        """バックグラウンドで全モデルを読み込み、ダミー画像で1回推論しておく（2回目以降は何もしない）"""
+        with self._warmup_lock:
+            if self._warmup_thread is not None:
+                return
+            self._warmup_thread = threading.Thread(
+                target=self._warmup,
+                name='model-warmup',
+                daemon=True
+            )
+            self._warmup_thread.start()
+
+    def _warmup(self):
+        started = time.monotonic()
+        for name, config in self.models_config.items():
+            batcher = self.batcher(name)
+            if batcher is not None:
+                try:
+                    size = config['size']
+                    batcher.predict(np.zeros((size, size, 3), dtype='float32'))
+                except Exception as e:
+                    print(f"⚠ {name} ウォームアップ推論失敗: {e}")
+        self.multi_head()
+        print(f"✓ モデルのウォームアップ完了 ({time.monotonic() - started:.1f}s)")
+
+    def state(self, part_name):
+        return self._entries[part_name]['state']
+
+    def status(self):
+        """/api/health 用のモデル状態"""
+        models = {}
+        for name, entry in self._entries.items():
+            models[name] = {'state': entry['state']}
+            if entry['error']:
+                models[name]['error'] = entry['error']
+        return {
+            'backend': self.backend,
+            'models': models,
+            'multi_head': {
+                'state': self._multi_head['state'],
+                'parts': self._multi_head['parts'],
+                'error': self._multi_head['error']
+            }
+        }
+
+
+# ============================================================
+# 推論の実行（Web プロセス内・推論サーバーのワーカー共通）
+# ============================================================
+
+def decode_prediction(part_name, prediction, models_config=MODELS_CONFIG):
+    """モデル出力1行分を (predicted_class, confidence, all_confidences) に変換"""
+    classes = models_config[part_name]['classes']
+    
+    # 結果を取得
+    confidence = float(np.max(prediction))
+    predicted_class_index = int(np.argmax(prediction))
+    predicted_class = classes[predicted_class_index]
+    
+    # すべてのクラスの信頼度
+    all_confidences = {
+        classes[i]: float(prediction[i])
+        for i in range(len(classes))
+    }
+    
+    sys.stderr.write(f"✓ {part_name} 予測: {predicted_class} ({confidence:.4f})\n")
+    sys.stderr.flush()
+    
+    return predicted_class, confidence, all_confidences
+
+
+def predict_with_registry(registry, preprocess_cache, image_binary, part_names,
+                          digest=None, timeout=None):
+    """
+    同じ画像を指定パーツのモデルで推論する
+
+    複数パーツでマルチヘッドモデルが使える場合はバックボーンを1回だけ計算し、
+    使えない場合はパーツごとのバッチャーに投げる。マルチヘッドの推論が例外で失敗したら
+    マルチヘッドを無効化して、パーツごとのバッチャーで推論し直す（タイムアウトは除く）。
+    失敗したパーツは (None, None, None)。キューが満杯なら InferenceBusy を送出。
+
+    Returns:
+        {part_name: (predicted_class, confidence, all_confidences)}
+    """
+    models_config = registry.models_config
+    digest = digest or image_digest(image_binary)
+    part_names = [name for name in part_names if name in models_config]
+    results = {}
+
+    head_parts, head_batcher = registry.multi_head() if len(part_names) >= 2 else ([], None)
+    if head_batcher is not None and all(name in head_parts for name in part_names):
+        try:
+            size = models_config[part_names[0]]['size']
+            img_array = preprocess_cache.get_array(image_binary, size, digest)
+            outputs = head_batcher.predict(img_array, timeout=timeout)
+            for name in part_names:
+                results[name] = decode_prediction(name, outputs[head_parts.index(name)], models_config)
+            return results
+        except InferenceBusy:
+            raise
+        except TimeoutError as e:
+            # 待ち時間を使い切っているので、パーツごとに推論し直さない
+            sys.stderr.write(f"✗ マルチヘッド予測タイムアウト: {e}\n")
+            sys.stderr.flush()
+            return {name: (None, None, None) for name in part_names}
+        except Exception as e:
+            sys.stderr.write(f"✗ マルチヘッド予測エラー（パーツ別に推論し直します）: {e}\n")
+            sys.stderr.flush()
+            registry.disable_multi_head(head_batcher, e)
+
+    # パーツごとに投げてから待つ（別モデル同士は並行して推論される）
+    futures = {}
+    for name in part_names:
+        batcher = registry.batcher(name)
+        if batcher is None:
+            results[name] = (None, None, None)
+            continue
+        try:
+            img_array = preprocess_cache.get_array(image_binary, models_config[name]['size'], digest)
+            futures[name] = batcher.submit(img_array)
+        except InferenceBusy:
+            raise
+        except Exception as e:
+            sys.stderr.write(f"✗ {name} 予測エラー: {e}\n")
+            sys.stderr.flush()
+            results[name] = (None, None, None)
+
+    for name, future in futures.items():
+        try:
+            results[name] = decode_prediction(name, future.result(timeout=timeout), models_config)
+        except Exception as e:
+            sys.stderr.write(f"✗ {name} 予測エラー: {e}\n")
+            sys.stderr.flush()
+            results[name] = (None, None, None)
+
+    return results
+
+
+# ============================================================
+# 推論サーバーのクライアント（inference_server.py と通信）
+# ============================================================
+
+def parse_server_address(address):
+    """'host:port' なら TCP、それ以外は Unix ドメインソケットのパスとして扱う"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+class InferenceClient:
+    """
+    別プロセスの推論サーバーに推論を依頼するクライアント
+
+    接続はスレッドごとに1本を使い回し、切れていたら1回だけ張り直す。
+    サーバーが満杯・接続不可・タイムアウトの場合は InferenceBusy を送出する。
+    """
+
+    def __init__(self, address, authkey, timeout=30.0):
+        if not authkey:
+            raise ValueError("INFERENCE_MODE=remote では INFERENCE_SERVER_AUTHKEY の設定が必要です")
+        self.address = parse_server_address(address)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def predict_parts(self, image_binary, part_names, digest=None):
+        reply = self._request({
+            'op': 'predict',
+            'image': image_binary,
+            'parts': list(part_names),
+            'digest': digest
+        })
+        return {name: tuple(result) for name, result in reply['results'].items()}
+
+    def status(self):
+        return self._request({'op': 'status'})
+
+    def _request(self, message):
+        from multiprocessing.connection import Client
+
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = Client(self.address, authkey=self.authkey)
+                    self._local.conn = conn
+                conn.send(message)
+                if not conn.poll(self.timeout):
+                    self._close()
+                    raise InferenceBusy(f"推論サーバーが {self.timeout:.0f} 秒以内に応答しませんでした")
+                reply = conn.recv()
+                break
+            except (EOFError, OSError) as e:
+                self._close()
+                if attempt == 1:
+                    raise InferenceBusy(f"推論サーバーに接続できません: {e}")
+
+        if reply.get('busy'):
+            raise InferenceBusy(reply.get('error', '推論サーバーが混雑しています'))
+        if not reply.get('ok'):
+            raise RuntimeError(reply.get('error', '推論サーバーでエラーが発生しました'))
+        return reply
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
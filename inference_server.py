@@ -0,0 +1,306 @@
+# inference_server.py - 推論専用サーバー（Flask の Web ワーカーとは別プロセスで起動）
+#
+# 使い方:
+#   python inference_server.py                       # INFERENCE_SERVER_ADDRESS で待ち受け
+#   python inference_server.py --workers 2
+#   python inference_server.py --address 127.0.0.1:6001
+#
+# Web 側は INFERENCE_MODE=remote で起動すると、このサーバーに推論を依頼する。
+# モデルはワーカープロセスごとに1組だけ読み込まれ、Web ワーカー数とは独立に増減できる。
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Listener
+
+from config import (
+    INFERENCE_BACKEND, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS,
+    INFERENCE_QUEUE_DEPTH, INFERENCE_SERVER_ADDRESS, INFERENCE_SERVER_AUTHKEY,
+    INFERENCE_TIMEOUT_SEC, INFERENCE_WORKERS, MODEL_CHECK_INTERVAL_SEC,
+    PREPROCESS_CACHE_MAX_ENTRIES, PREPROCESS_CACHE_MAX_MB
+)
+from inference import (
+    MODELS_CONFIG, InferenceBusy, ModelRegistry, PreprocessCache,
+    parse_server_address, predict_with_registry
+)
+
+# ワーカープロセス内で同時に処理するジョブ数（マイクロバッチにまとまる単位）
+THREADS_PER_WORKER = 8
+
+# ワーカープロセスの生存確認の間隔（秒）
+WORKER_CHECK_INTERVAL_SEC = 1.0
+
+
+# ============================================================
+# ワーカープロセス
+# ============================================================
+
+def worker_main(worker_id, job_queue, result_queue):
+    """
+    モデルを読み込み、ジョブキューから推論依頼を取り出して処理する
+
+    result_queue には ('claim', job_id, worker_id)（取り出した時点）と
+    ('result', job_id, results, error)（処理後）を送る。
+    期限（deadline）を過ぎたジョブは推論せずに expired として返す
+    """
+    registry = ModelRegistry(
+        MODELS_CONFIG,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        check_interval=MODEL_CHECK_INTERVAL_SEC,
+        backend=INFERENCE_BACKEND
+    )
+    preprocess_cache = PreprocessCache(
+        max_entries=PREPROCESS_CACHE_MAX_ENTRIES,
+        max_bytes=PREPROCESS_CACHE_MAX_MB * 1024 * 1024
+    )
+    registry.start_warmup()
+    print(f"✓ 推論ワーカー {worker_id} 起動 (pid={os.getpid()}, backend={INFERENCE_BACKEND})")
+
+    def consume():
+        while True:
+            job = job_queue.get()
+            if job is None:
+                job_queue.put(None)  # 他のスレッドにも終了を伝える
+                return
+
+            job_id, image_binary, part_names, digest, deadline = job
+            result_queue.put(('claim', job_id, worker_id))
+            if time.time() > deadline:
+                # 呼び出し側は既にタイムアウトしている（古い依頼で推論を詰まらせない）
+                result_queue.put(('result', job_id, None, ('expired', '推論の期限を過ぎました')))
+                continue
+            try:
+                for name in part_names:
+                    registry.fingerprint(name)  # モデルファイルの差し替えを検出
+                results = predict_with_registry(
+                    registry, preprocess_cache, image_binary, part_names,
+                    digest=digest, timeout=INFERENCE_TIMEOUT_SEC
+                )
+                result_queue.put(('result', job_id, results, None))
+            except InferenceBusy as e:
+                result_queue.put(('result', job_id, None, ('busy', str(e))))
+            except Exception as e:
+                result_queue.put(('result', job_id, None, ('error', str(e))))
+
+    threads = [
+        threading.Thread(target=consume, name=f'inference-consumer-{i}', daemon=True)
+        for i in range(THREADS_PER_WORKER)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# ============================================================
+# サーバー本体（接続受付・ジョブ振り分け）
+# ============================================================
+
+class InferenceServer:
+    """
+    ローカルソケットで推論依頼を受け付け、ワーカープロセスに振り分ける
+
+    処理待ち（投入済みでワーカーの結果が未着）のジョブが queue_depth 件に達していたら
+    キューに積まずに busy を返す（Web 側は 503 を返す）。呼び出し側がタイムアウトしたジョブも
+    ワーカーの結果が届くまで件数に含める（ワーカーは期限切れのジョブを推論せずに返す）。
+
+    停止したワーカーは作り直し、そのワーカーが処理中だったジョブはすぐに失敗を返す。
+    """
+
+    def __init__(self, address, authkey, workers=1, queue_depth=64):
+        if not authkey:
+            raise ValueError("INFERENCE_SERVER_AUTHKEY が設定されていません")
+        self.address = parse_server_address(address)
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.workers = workers
+        self.queue_depth = queue_depth
+
+        self._job_queue = multiprocessing.Queue()
+        self._result_queue = multiprocessing.Queue()
+        self._processes = []
+        self._pending = {}   # job_id -> Future（呼び出し側がタイムアウトしたものは None）
+        self._claimed = {}   # job_id -> 取り出したワーカーの番号
+        self._pending_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self.rejected = 0
+        self.restarts = 0
+
+    def _start_worker(self, worker_id):
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(worker_id, self._job_queue, self._result_queue),
+            name=f'inference-worker-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def serve_forever(self):
+        self._processes = [self._start_worker(worker_id) for worker_id in range(self.workers)]
+
+        threading.Thread(target=self._dispatch_results, name='result-dispatcher', daemon=True).start()
+        threading.Thread(target=self._supervise_workers, name='worker-supervisor', daemon=True).start()
+
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)  # 前回のソケットファイルが残っている場合
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"✓ 推論サーバー待ち受け開始: {self.address} (workers={self.workers}, queue_depth={self.queue_depth})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    sys.stderr.write(f"⚠ 接続受付エラー: {e}\n")
+                    sys.stderr.flush()
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def shutdown(self):
+        self._job_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+
+    def _submit(self, image_binary, part_names, digest):
+        with self._pending_lock:
+            if len(self._pending) >= self.queue_depth:
+                self.rejected += 1
+                raise InferenceBusy(f"推論待ちが上限 ({self.queue_depth}) に達しています")
+            job_id = next(self._job_ids)
+            future = Future()
+            self._pending[job_id] = future
+
+        deadline = time.time() + INFERENCE_TIMEOUT_SEC
+        self._job_queue.put((job_id, image_binary, part_names, digest, deadline))
+        return job_id, future
+
+    def _abandon(self, job_id):
+        """呼び出し側がタイムアウトしたジョブ（結果が届くまで件数には残す）"""
+        with self._pending_lock:
+            if job_id in self._pending:
+                self._pending[job_id] = None
+
+    def _dispatch_results(self):
+        while True:
+            message = self._result_queue.get()
+            if message[0] == 'claim':
+                _, job_id, worker_id = message
+                with self._pending_lock:
+                    if job_id in self._pending:
+                        self._claimed[job_id] = worker_id
+                continue
+
+            _, job_id, results, error = message
+            with self._pending_lock:
+                future = self._pending.pop(job_id, None)
+                self._claimed.pop(job_id, None)
+            if future is not None:
+                future.set_result((results, error))
+
+    def _supervise_workers(self):
+        """停止したワーカーの処理中ジョブを失敗にして、ワーカーを作り直す"""
+        while True:
+            time.sleep(WORKER_CHECK_INTERVAL_SEC)
+            for worker_id, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                with self._pending_lock:
+                    lost = [job_id for job_id, owner in self._claimed.items() if owner == worker_id]
+                    futures = []
+                    for job_id in lost:
+                        del self._claimed[job_id]
+                        futures.append(self._pending.pop(job_id, None))
+                for future in futures:
+                    if future is not None:
+                        future.set_result((None, ('error', '推論ワーカーが停止しました')))
+                sys.stderr.write(
+                    f"⚠ 推論ワーカー {worker_id} が停止しました (exitcode={process.exitcode}, "
+                    f"処理中 {len(lost)} 件を失敗にしました)。作り直します\n"
+                )
+                sys.stderr.flush()
+                self._processes[worker_id] = self._start_worker(worker_id)
+                self.restarts += 1
+
+    def _handle(self, conn):
+        """1つの Web ワーカースレッドからの接続を処理（切断されるまで繰り返し）"""
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    conn.send(self._reply(message))
+                except (EOFError, OSError):
+                    return
+
+    def _reply(self, message):
+        op = message.get('op')
+
+        if op == 'status':
+            with self._pending_lock:
+                pending = len(self._pending)
+            return {
+                'ok': True,
+                'backend': INFERENCE_BACKEND,
+                'workers': {
+                    process.name: process.is_alive() for process in self._processes
+                },
+                'pending': pending,
+                'queue_depth': self.queue_depth,
+                'rejected': self.rejected,
+                'restarts': self.restarts
+            }
+
+        if op == 'predict':
+            try:
+                job_id, future = self._submit(message['image'], message['parts'], message.get('digest'))
+            except InferenceBusy as e:
+                return {'ok': False, 'busy': True, 'error': str(e)}
+
+            try:
+                results, error = future.result(timeout=INFERENCE_TIMEOUT_SEC)
+            except Exception:
+                self._abandon(job_id)
+                return {'ok': False, 'busy': True, 'error': '推論がタイムアウトしました'}
+
+            if error is not None:
+                kind, detail = error
+                return {'ok': False, 'busy': kind == 'busy', 'error': detail}
+            return {'ok': True, 'results': results}
+
+        return {'ok': False, 'error': f'不明な操作: {op}'}
+
+
+# ============================================================
+# エントリーポイント
+# ============================================================
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='パーツモデルの推論サーバー')
+    parser.add_argument('--address', default=INFERENCE_SERVER_ADDRESS,
+                        help="Unix ソケットのパス、または host:port")
+    parser.add_argument('--workers', type=int, default=INFERENCE_WORKERS)
+    parser.add_argument('--queue-depth', type=int, default=INFERENCE_QUEUE_DEPTH)
+    args = parser.parse_args()
+
+    if not INFERENCE_SERVER_AUTHKEY:
+        sys.stderr.write("❌ INFERENCE_SERVER_AUTHKEY を設定してください（Web 側と同じ値）\n")
+        sys.exit(2)
+
+    server = InferenceServer(
+        args.address,
+        INFERENCE_SERVER_AUTHKEY,
+        workers=args.workers,
+        queue_depth=args.queue_depth
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n推論サーバーを停止します")
+        server.shutdown()
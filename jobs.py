@@ -0,0 +1,483 @@
+# jobs.py - バックグラウンドジョブの実行と状態管理
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+# ============================================================
+# ジョブの状態ストア（プロセス内メモリ）
+# ============================================================
+
+class JobStore:
+    """
+    ジョブの状態を保持する
+
+    job = {
+        'job_id', 'kind', 'ref', 'status', 'progress' (0.0~1.0),
+        'result', 'error', 'created_at', 'updated_at'
+    }
+    終了したジョブは ttl 秒後に削除する。
+    ジョブはこのプロセスの JobRunner が実行するので、引数（args）は保存せず claim も持たない。
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def create(self, kind, ref=None, args=None):
+        now = datetime.utcnow().isoformat()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'kind': kind,
+            'ref': ref,
+            'status': JOB_QUEUED,
+            'progress': 0.0,
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+            'version': 0
+        }
+        with self._cond:
+            self._purge_expired()
+            self._jobs[job['job_id']] = job
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            job['updated_at'] = datetime.utcnow().isoformat()
+            job['version'] += 1
+            if job['status'] in FINISHED_STATES:
+                job['expires_at'] = time.monotonic() + self.ttl
+            self._cond.notify_all()
+            return dict(job)
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    # プロセス内のジョブはプロセスと一緒に消えるので、生存確認は不要（SqliteJobStore と同じインターフェース）
+    def heartbeat(self, job_ids):
+        pass
+
+    def fail_stale_jobs(self):
+        return 0
+
+    def find(self, kind, ref):
+        """kind と ref が一致する最新のジョブ"""
+        with self._cond:
+            matches = [job for job in self._jobs.values() if job['kind'] == kind and job['ref'] == ref]
+            if not matches:
+                return None
+            return dict(max(matches, key=lambda job: job['created_at']))
+
+    def wait_for_change(self, job_id, version, timeout):
+        """ジョブの version が変わるか timeout 秒経つまで待ち、最新の状態を返す"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['version'] != version:
+                    return dict(job) if job else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.get('expires_at') is not None and job['expires_at'] <= now
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# ============================================================
+# ジョブの状態ストア（SQLite ファイル）
+# ============================================================
+
+class SqliteJobStore:
+    """
+    JobStore と同じインターフェースで、ジョブの状態を SQLite ファイルに保存する
+
+    同じファイルを参照する複数の Web プロセスから状態を取得でき、再起動後も残る。
+    result は JSON で保存する。他のプロセスでの更新は wait_for_change が poll_interval 秒ごとに確認する。
+
+    実行中・待機中のジョブは JobRunner が heartbeat で heartbeat_at を更新する。
+
+    - 引数（args）なしで作ったジョブは投入したプロセスのスレッドで実行されるので、lease 秒以上
+      heartbeat_at が更新されていなければ、実行していたプロセスが停止したものとして失敗にする
+    - 引数を JSON で保存したジョブ（JOB_EXECUTION=worker）は jobs_worker.py が claim で取り出す。
+      lease が切れた実行中のジョブは別のワーカーが取り出し直し、max_attempts 回取り出しても
+      終わらなかったジョブだけを失敗にする
+    """
+
+    def __init__(self, path, ttl=3600, poll_interval=0.5, lease=60, max_attempts=3):
+        self.path = path
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._last_stale_check = 0.0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, kind TEXT, ref TEXT, status TEXT, progress REAL,"
+                " result TEXT, error TEXT, created_at TEXT, updated_at TEXT,"
+                " version INTEGER, expires_at REAL)"
+            )
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'heartbeat_at' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            if 'args' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN args TEXT")
+            if 'attempts' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_expires_at ON jobs (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_heartbeat ON jobs (status, heartbeat_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """with ブロックの終わりでコミットして接続を閉じる（スレッドごとに接続を共有しない）"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        if job['expires_at'] is None:
+            del job['expires_at']
+        for name in ('heartbeat_at', 'args', 'attempts'):
+            job.pop(name, None)
+        return job
+
+    def create(self, kind, ref=None, args=None):
+        """args を渡すと JSON で保存し、jobs_worker.py が取り出して実行するジョブにする"""
+        now = datetime.utcnow().isoformat()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'kind': kind,
+            'ref': ref,
+            'status': JOB_QUEUED,
+            'progress': 0.0,
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+            'version': 0
+        }
+        with self._connect() as conn:
+            # 有効期限（time.time 基準）を過ぎた終了済みジョブを削除
+            conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, ref, status, progress, result, error,"
+                " created_at, updated_at, version, expires_at, heartbeat_at, args, attempts)"
+                " VALUES (:job_id, :kind, :ref, :status, :progress, NULL, NULL,"
+                " :created_at, :updated_at, :version, NULL, :heartbeat_at, :args, 0)",
+                {
+                    **job,
+                    'heartbeat_at': time.time(),
+                    'args': json.dumps(args, ensure_ascii=False) if args is not None else None
+                }
+            )
+        return job
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], ensure_ascii=False)
+        fields['updated_at'] = datetime.utcnow().isoformat()
+        if fields.get('status') in FINISHED_STATES:
+            fields['expires_at'] = time.time() + self.ttl
+
+        assignments = ", ".join(f"{name} = :{name}" for name in fields)
+        with self._cond:
+            with self._connect() as conn:
+                updated = conn.execute(
+                    f"UPDATE jobs SET {assignments}, version = version + 1 WHERE job_id = :job_id",
+                    {**fields, 'job_id': job_id}
+                ).rowcount
+                row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            self._cond.notify_all()
+        return self._to_job(row) if updated else None
+
+    def get(self, job_id):
+        self._fail_stale_jobs()
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_job(row)
+
+    def heartbeat(self, job_ids):
+        """実行中・待機中のジョブがまだ生きていることを記録する"""
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE job_id IN ({placeholders})"
+                " AND status IN (?, ?)",
+                (time.time(), *job_ids, JOB_QUEUED, JOB_RUNNING)
+            )
+
+    def fail_stale_jobs(self):
+        """
+        heartbeat が lease 秒以上途絶えたジョブを失敗にする。失敗にした件数を返す
+
+        対象は、投入したプロセスで実行する queued / running のジョブと、ワーカーが
+        max_attempts 回取り出しても終わらなかった running のジョブ（それ以外のワーカー用の
+        ジョブは claim で取り出し直す）
+        """
+        now = time.time()
+        with self._cond:
+            with self._connect() as conn:
+                failed = conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ?, expires_at = ?,"
+                    " version = version + 1"
+                    " WHERE status IN (?, ?) AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+                    " AND (args IS NULL OR (status = ? AND attempts >= ?))",
+                    (JOB_FAILED, 'ジョブを実行していたプロセスが停止したため中断されました',
+                     datetime.utcnow().isoformat(), now + self.ttl,
+                     JOB_QUEUED, JOB_RUNNING, now - self.lease,
+                     JOB_RUNNING, self.max_attempts)
+                ).rowcount
+            if failed:
+                self._cond.notify_all()
+        self._last_stale_check = time.monotonic()
+        if failed:
+            sys.stderr.write(f"⚠ 停止したプロセスのジョブ {failed} 件を失敗にしました\n")
+            sys.stderr.flush()
+        return failed
+
+    def _fail_stale_jobs(self):
+        # 状態の取得のたびに UPDATE しないよう、確認は lease の 1/4 ごとに1回
+        if time.monotonic() - self._last_stale_check >= self.lease / 4:
+            self.fail_stale_jobs()
+
+    def claim(self, kinds):
+        """
+        kinds のうち、待機中のジョブか lease が切れた実行中のジョブを1件取り出して running にする
+
+        Returns:
+            (job, args)。取り出せるジョブが無ければ None
+        """
+        if not kinds:
+            return None
+        self._fail_stale_jobs()
+        placeholders = ", ".join("?" for _ in kinds)
+        while True:
+            now = time.time()
+            with self._connect() as conn:
+                row = conn.execute(
+                    f"SELECT * FROM jobs WHERE args IS NOT NULL AND kind IN ({placeholders})"
+                    " AND (status = ? OR (status = ? AND heartbeat_at < ? AND attempts < ?))"
+                    " ORDER BY created_at LIMIT 1",
+                    (*kinds, JOB_QUEUED, JOB_RUNNING, now - self.lease, self.max_attempts)
+                ).fetchone()
+                if row is None:
+                    return None
+                # 他のワーカーが先に取り出していたら version が変わっているので、次の行を探し直す
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = ?, heartbeat_at = ?, attempts = attempts + 1,"
+                    " updated_at = ?, version = version + 1"
+                    " WHERE job_id = ? AND version = ?",
+                    (JOB_RUNNING, now, datetime.utcnow().isoformat(), row['job_id'], row['version'])
+                ).rowcount
+                if claimed:
+                    job = self._to_job(conn.execute(
+                        "SELECT * FROM jobs WHERE job_id = ?", (row['job_id'],)
+                    ).fetchone())
+            if claimed:
+                with self._cond:
+                    self._cond.notify_all()
+                if row['status'] == JOB_RUNNING:
+                    sys.stderr.write(f"↻ lease が切れたジョブ {row['job_id']} を取り出し直します（{row['attempts'] + 1} 回目）\n")
+                    sys.stderr.flush()
+                return job, json.loads(row['args'])
+
+    def find(self, kind, ref):
+        """kind と ref が一致する最新のジョブ"""
+        self._fail_stale_jobs()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE kind = ? AND ref = ? ORDER BY created_at DESC LIMIT 1",
+                (kind, ref)
+            ).fetchone()
+        return self._to_job(row)
+
+    def wait_for_change(self, job_id, version, timeout):
+        """ジョブの version が変わるか timeout 秒経つまで待ち、最新の状態を返す"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['version'] != version:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait(min(remaining, self.poll_interval))
+
+
+# ============================================================
+# ジョブの実行
+# ============================================================
+
+class JobRunner:
+    """
+    ジョブをスレッドプールで実行し、状態を JobStore に反映する
+
+    handler(kind) で登録した fn(report_progress, *args) を実行し、戻り値を result に保存する。
+    report_progress(progress) で進捗（0.0~1.0）を更新できる。
+
+    execution='thread' のときは submit したプロセスのスレッドで実行する。execution='worker' の
+    ときは submit では引数を JSON でストアに保存するだけで、serve を動かしているワーカープロセス
+    （jobs_worker.py）が取り出して実行する（SqliteJobStore が必要。引数は JSON にできる値に限る）。
+
+    待機中・実行中のジョブは heartbeat_interval 秒ごとに store.heartbeat で生存を記録する
+    （ハートビートのスレッドは最初の submit で起動するので、fork 後のワーカープロセスでも動く）。
+    起動時に、停止したプロセスが残したジョブを失敗にする。
+    """
+
+    def __init__(self, store, max_workers=4, heartbeat_interval=15, execution='thread'):
+        if execution not in ('thread', 'worker'):
+            raise ValueError(f"未対応のジョブの実行方法: {execution}")
+        if execution == 'worker' and not hasattr(store, 'claim'):
+            raise ValueError("JOB_EXECUTION=worker には JOB_STORE_BACKEND=sqlite が必要です")
+        self.store = store
+        self.max_workers = max_workers
+        self.heartbeat_interval = heartbeat_interval
+        self.execution = execution
+        self._handlers = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._active = set()
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+
+        store.fail_stale_jobs()
+
+    def handler(self, kind):
+        """kind のジョブを実行する関数を登録するデコレーター"""
+        def register(fn):
+            self._handlers[kind] = fn
+            return fn
+        return register
+
+    def submit(self, kind, *args, ref=None):
+        fn = self._handlers.get(kind)
+        if fn is None:
+            raise ValueError(f"未登録のジョブ: {kind}")
+        if self.execution == 'worker':
+            return self.store.create(kind, ref=ref, args=list(args))
+
+        job = self.store.create(kind, ref=ref)
+        self._start(job['job_id'], fn, args)
+        return job
+
+    def serve(self, poll_interval=1.0):
+        """ストアからジョブを取り出して実行し続ける（jobs_worker.py から呼ぶ。戻らない）"""
+        kinds = sorted(self._handlers)
+        sys.stderr.write(f"✓ ジョブワーカーを起動（{', '.join(kinds)}、並列数 {self.max_workers}）\n")
+        sys.stderr.flush()
+        while True:
+            with self._lock:
+                idle = len(self._active) < self.max_workers
+            claimed = self.store.claim(kinds) if idle else None
+            if claimed is None:
+                time.sleep(poll_interval)
+                continue
+            job, args = claimed
+            self._start(job['job_id'], self._handlers[job['kind']], args)
+
+    def _start(self, job_id, fn, args):
+        with self._lock:
+            self._active.add(job_id)
+            self._ensure_heartbeat()
+        self._executor.submit(self._run, job_id, fn, args)
+
+    def _run(self, job_id, fn, args):
+        self.store.update(job_id, status=JOB_RUNNING)
+
+        def report_progress(progress):
+            self.store.update(job_id, progress=float(progress))
+
+        try:
+            result = fn(report_progress, *args)
+            self.store.update(job_id, status=JOB_SUCCEEDED, progress=1.0, result=result)
+        except Exception as e:
+            traceback.print_exc()
+            sys.stderr.write(f"❌ ジョブ {job_id} 失敗: {e}\n")
+            sys.stderr.flush()
+            self.store.update(job_id, status=JOB_FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_thread = threading.Thread(
+                target=self._heartbeat_loop, name='job-heartbeat', daemon=True
+            )
+            self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                job_ids = list(self._active)
+            try:
+                self.store.heartbeat(job_ids)
+            except Exception as e:
+                sys.stderr.write(f"⚠ ジョブのハートビート更新に失敗: {e}\n")
+                sys.stderr.flush()
+
+
+def create_job_store(backend, ttl=3600, path=None, lease=60, max_attempts=3):
+    """JOB_STORE_BACKEND に応じたジョブの状態ストア（memory / sqlite）"""
+    if backend == 'memory':
+        return JobStore(ttl=ttl)
+    if backend == 'sqlite':
+        return SqliteJobStore(path, ttl=ttl, lease=lease, max_attempts=max_attempts)
+    raise ValueError(f"未対応のジョブストア: {backend}")
+
+
+def public_job(job):
+    """API レスポンス用に内部フィールドを除いたジョブ情報"""
+    return {
+        key: value for key, value in job.items()
+        if key not in ('version', 'expires_at')
+    }
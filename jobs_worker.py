@@ -0,0 +1,30 @@
+# jobs_worker.py - バックグラウンドジョブのワーカー
+#
+# JOB_EXECUTION=worker のとき、Web プロセスは SQLite のジョブストア（JOB_STORE_PATH）に
+# ジョブを投入するだけなので、このプロセスで取り出して実行する。
+# 待機中のジョブと、lease が切れた（実行していたワーカーが停止した）ジョブを取り出す。
+# 同時に実行するジョブ数は JOB_WORKERS。複数台起動してもよい（同じジョブは1つのワーカーだけが取り出す）。
+#
+#   JOB_EXECUTION=worker python jobs_worker.py
+#
+# Web プロセスと同じ DATABASE_URL・JOB_STORE_PATH・REPORT_STORAGE_ROOT・写真の保存先を参照すること。
+import argparse
+import sys
+
+from app import job_runner
+from config import JOB_WORKER_POLL_SEC, JOB_STORE_BACKEND
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='バックグラウンドジョブのワーカー')
+    parser.add_argument('--poll-interval', type=float, default=JOB_WORKER_POLL_SEC)
+    args = parser.parse_args()
+
+    if JOB_STORE_BACKEND != 'sqlite':
+        sys.stderr.write("❌ ジョブワーカーには JOB_STORE_BACKEND=sqlite が必要です\n")
+        sys.exit(2)
+
+    try:
+        job_runner.serve(poll_interval=args.poll_interval)
+    except KeyboardInterrupt:
+        print("\nジョブワーカーを停止します")
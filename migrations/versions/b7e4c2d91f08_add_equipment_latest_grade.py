@@ -0,0 +1,74 @@
+"""Add equipments.latest_grade (worst grade of each equipment's latest inspection)
+
+Revision ID: b7e4c2d91f08
+Revises: a41c6e93f2d7
+Create Date: 2026-10-17 21:05:12.518304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4c2d91f08'
+down_revision = 'a41c6e93f2d7'
+branch_labels = None
+depends_on = None
+
+GRADES = ('A', 'B', 'C', 'D')
+
+
+def upgrade():
+    with op.batch_alter_table('equipments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('latest_grade', sa.Enum(*GRADES, name='gradeenum'), nullable=True))
+
+    # 既存の点検結果から埋める（遊具ごとに直近の点検を選び、部位の判定のうち最も悪いもの）
+    inspection = sa.table(
+        'inspection',
+        sa.column('inspection_id', sa.Integer),
+        sa.column('equipment_id', sa.Integer),
+        sa.column('inspection_date', sa.DateTime)
+    )
+    detail = sa.table(
+        'inspection_detail',
+        sa.column('inspection_id', sa.Integer),
+        sa.column('grade', sa.String)
+    )
+    equipments = sa.table(
+        'equipments',
+        sa.column('equipment_id', sa.Integer),
+        sa.column('latest_grade', sa.String)
+    )
+
+    ranked = sa.select(
+        inspection.c.inspection_id,
+        inspection.c.equipment_id,
+        sa.func.row_number().over(
+            partition_by=inspection.c.equipment_id,
+            order_by=(inspection.c.inspection_date.desc(), inspection.c.inspection_id.desc())
+        ).label('rn')
+    ).subquery()
+    severity = sa.case(
+        *[(detail.c.grade == grade, index + 1) for index, grade in enumerate(GRADES)],
+        else_=None
+    )
+    rows = op.get_bind().execute(
+        sa.select(ranked.c.equipment_id, sa.func.max(severity))
+        .select_from(ranked)
+        .outerjoin(detail, detail.c.inspection_id == ranked.c.inspection_id)
+        .where(ranked.c.rn == 1)
+        .group_by(ranked.c.equipment_id)
+    ).fetchall()
+
+    for equipment_id, severity_value in rows:
+        if severity_value:
+            op.get_bind().execute(
+                equipments.update()
+                .where(equipments.c.equipment_id == equipment_id)
+                .values(latest_grade=GRADES[severity_value - 1])
+            )
+
+
+def downgrade():
+    with op.batch_alter_table('equipments', schema=None) as batch_op:
+        batch_op.drop_column('latest_grade')
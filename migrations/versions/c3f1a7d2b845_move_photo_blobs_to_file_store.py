@@ -0,0 +1,141 @@
+"""Move photo blobs out of the database into the photo file store
+
+Revision ID: c3f1a7d2b845
+Revises: 9a367de1026e
+Create Date: 2026-10-17 10:12:41.204118
+
+"""
+import hashlib
+import sys
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+from photo_storage import get_photo_storage
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a7d2b845'
+down_revision = '9a367de1026e'
+branch_labels = None
+depends_on = None
+
+PHOTO_TABLES = ('inspection_photos', 'daily_report_photos')
+
+# 1回の SELECT で取り出す写真の枚数（写真データをまとめてメモリに載せないため）
+BATCH_SIZE = 100
+
+
+def _existing_columns(table_name):
+    inspector = sa.inspect(op.get_bind())
+    return {column['name'] for column in inspector.get_columns(table_name)}
+
+
+def _photo_table(table_name, *columns):
+    return sa.table(table_name, sa.column('photo_id', sa.Integer), *columns)
+
+
+def upgrade():
+    storage = get_photo_storage()
+    bind = op.get_bind()
+
+    for table_name in PHOTO_TABLES:
+        existing = _existing_columns(table_name)
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            if 'storage_key' not in existing:
+                batch_op.add_column(sa.Column('storage_key', sa.String(length=100), nullable=True))
+            if 'mime_type' not in existing:
+                batch_op.add_column(sa.Column('mime_type', sa.String(length=50), nullable=True))
+            if 'digest' not in existing:
+                batch_op.add_column(sa.Column('digest', sa.String(length=64), nullable=True))
+                batch_op.create_index(batch_op.f(f'ix_{table_name}_digest'), ['digest'], unique=False)
+
+        if 'photo_data' not in existing:
+            continue
+
+        # 写真データを保存先へ移し、保存キーを書き込む（photo_id 順に BATCH_SIZE 件ずつ）
+        photos = _photo_table(
+            table_name,
+            sa.column('photo_data', sa.LargeBinary),
+            sa.column('storage_key', sa.String),
+            sa.column('mime_type', sa.String),
+            sa.column('digest', sa.String),
+            sa.column('file_size', sa.Integer)
+        )
+        last_id = 0
+        moved = 0
+        while True:
+            rows = bind.execute(
+                sa.select(photos.c.photo_id, photos.c.photo_data)
+                .where(photos.c.photo_id > last_id)
+                .where(photos.c.photo_data.isnot(None))
+                .order_by(photos.c.photo_id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+
+            for photo_id, photo_data in rows:
+                stored = storage.put(bytes(photo_data))
+                bind.execute(
+                    photos.update()
+                    .where(photos.c.photo_id == photo_id)
+                    .values(**stored.as_columns())
+                )
+                last_id = photo_id
+            moved += len(rows)
+            sys.stderr.write(f"↻ {table_name}: {moved} 枚を保存先へ移動\n")
+            sys.stderr.flush()
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('photo_data')
+
+
+def downgrade():
+    storage = get_photo_storage()
+    bind = op.get_bind()
+
+    for table_name in PHOTO_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column(
+                'photo_data',
+                sa.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'),
+                nullable=True
+            ))
+
+        # 保存先から写真データを DB に戻す（保存先のファイルは削除しない）
+        photos = _photo_table(
+            table_name,
+            sa.column('photo_data', sa.LargeBinary),
+            sa.column('storage_key', sa.String),
+            sa.column('digest', sa.String)
+        )
+        last_id = 0
+        while True:
+            rows = bind.execute(
+                sa.select(photos.c.photo_id, photos.c.storage_key, photos.c.digest)
+                .where(photos.c.photo_id > last_id)
+                .where(photos.c.storage_key.isnot(None))
+                .order_by(photos.c.photo_id)
+                .limit(BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+
+            for photo_id, storage_key, digest in rows:
+                photo_data = storage.read(storage_key)
+                if digest and hashlib.sha256(photo_data).hexdigest() != digest:
+                    raise RuntimeError(f"{table_name} photo_id={photo_id}: 写真データのダイジェストが一致しません")
+                bind.execute(
+                    photos.update()
+                    .where(photos.c.photo_id == photo_id)
+                    .values(photo_data=photo_data)
+                )
+                last_id = photo_id
+
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table_name}_digest'))
+            batch_op.drop_column('digest')
+            batch_op.drop_column('mime_type')
+            batch_op.drop_column('storage_key')
@@ -0,0 +1,65 @@
+"""Add composite indexes for inspection / daily report / photo history lookups
+
+Revision ID: e2c95a7b3d16
+Revises: b7e4c2d91f08
+Create Date: 2026-10-17 21:40:03.772915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c95a7b3d16'
+down_revision = 'b7e4c2d91f08'
+branch_labels = None
+depends_on = None
+
+# (テーブル, インデックス名, カラム)
+INDEXES = (
+    ('inspection', 'ix_inspection_equipment_date', ['equipment_id', 'inspection_date', 'inspection_id']),
+    ('inspection', 'ix_inspection_inspector_date', ['inspector_id', 'inspection_date']),
+    ('inspection', 'ix_inspection_date', ['inspection_date', 'inspection_id']),
+    ('daily_reports', 'ix_daily_reports_park_date', ['park_id', 'report_date', 'daily_report_id']),
+    ('daily_reports', 'ix_daily_reports_date', ['report_date', 'daily_report_id']),
+    ('inspection_photos', 'ix_inspection_photos_inspection_photo', ['inspection_id', 'photo_id']),
+    ('inspection_photos', 'ix_inspection_photos_uploader_photo', ['uploaded_by', 'photo_id']),
+    ('daily_report_photos', 'ix_daily_report_photos_report_photo', ['daily_report_id', 'photo_id']),
+    ('daily_report_photos', 'ix_daily_report_photos_uploader_photo', ['uploaded_by', 'photo_id']),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name, index_name, columns in INDEXES:
+        existing = {index['name'] for index in inspector.get_indexes(table_name)}
+        if index_name not in existing:
+            op.create_index(index_name, table_name, columns, unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for table_name, index_name, columns in reversed(INDEXES):
+        if bind.dialect.name == 'mysql':
+            keep_foreign_key_index(bind, table_name, index_name, columns[0])
+        op.drop_index(index_name, table_name=table_name)
+
+
+def keep_foreign_key_index(bind, table_name, index_name, column):
+    """
+    MySQL は外部キーのカラムを先頭に持つインデックスを必須とし、複合インデックスを作ると
+    自動で作った外部キー用のインデックスを削除してしまう（そのまま drop_index すると
+    エラー 1553 になる）。他に代わりのインデックスが無ければ単一カラムのインデックスを作り直す
+    """
+    inspector = sa.inspect(bind)  # 前のループで作ったインデックスも見えるよう毎回作り直す
+    foreign_key_columns = {
+        fk['constrained_columns'][0] for fk in inspector.get_foreign_keys(table_name)
+    }
+    if column not in foreign_key_columns:
+        return
+    covered = any(
+        index['name'] != index_name and index['column_names'][:1] == [column]
+        for index in inspector.get_indexes(table_name)
+    )
+    if not covered:
+        op.create_index(f'ix_{table_name}_{column}', table_name, [column], unique=False)
@@ -1,7 +1,14 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import enum
-from sqlalchemy.orm import validates
+import threading
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session, validates
+
+from config import USER_ROLE_CACHE_TTL_SEC
+from photo_storage import STREAM_CHUNK_SIZE, get_photo_storage
 
 db = SQLAlchemy()
 
@@ -65,7 +72,126 @@ class User(db.Model):
     created_reports = db.relationship('Report', backref='creator', lazy=True)
 
 
+# ユーザーの役割キャッシュ（バリデーションのたびに User を SELECT しないため）
+class UserRoleCache:
+    """
+    employee_id -> (name, role)
+
+    - 同じリクエスト（アプリケーションコンテキスト）内では flask.g に保持
+    - プロセス内では ttl 秒保持（User の追加・更新・削除で破棄）
+    キャッシュに無い ID はまとめて1回の IN クエリで取得する。
+    ID は int に揃えてから引く（フォームから来た '1' も 1 と同じユーザー。数字でなければ存在しない扱い）。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}             # employee_id -> (expires_at, (name, role))
+        self._lock = threading.Lock()
+
+    def _request_map(self):
+        if not has_app_context():
+            return {}
+        if 'user_roles' not in g:
+            g.user_roles = {}
+        return g.user_roles
+
+    @staticmethod
+    def _key(employee_id):
+        try:
+            return int(employee_id)
+        except (TypeError, ValueError):
+            return None
+
+    def get_many(self, employee_ids):
+        """{employee_id（渡された値のまま）: (name, role) または None（存在しない）}"""
+        keys = {employee_id: self._key(employee_id) for employee_id in set(employee_ids)}
+        by_key = self._get_many({key for key in keys.values() if key is not None})
+        return {employee_id: by_key.get(key) for employee_id, key in keys.items()}
+
+    def _get_many(self, employee_ids):
+        request_map = self._request_map()
+        now = time.monotonic()
+        result = {}
+        missing = []
+
+        with self._lock:
+            for employee_id in employee_ids:
+                if employee_id in request_map:
+                    result[employee_id] = request_map[employee_id]
+                    continue
+                entry = self._entries.get(employee_id)
+                if entry is not None and entry[0] > now:
+                    result[employee_id] = request_map[employee_id] = entry[1]
+                else:
+                    missing.append(employee_id)
+
+        if missing:
+            rows = db.session.query(User.employee_id, User.name, User.role).filter(
+                User.employee_id.in_(missing)
+            ).all()
+            found = {employee_id: (name, role) for employee_id, name, role in rows}
+            with self._lock:
+                for employee_id in missing:
+                    value = found.get(employee_id)
+                    result[employee_id] = request_map[employee_id] = value
+                    # 存在しない ID はこのリクエスト内だけ覚えておく（プロセス内には載せない）
+                    if value is not None:
+                        self._entries[employee_id] = (now + self.ttl, value)
+
+        return result
+
+    def get(self, employee_id):
+        return self.get_many([employee_id])[employee_id]
+
+    def invalidate(self, employee_id=None):
+        if employee_id is not None:
+            employee_id = self._key(employee_id)
+        with self._lock:
+            if employee_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(employee_id, None)
+        request_map = self._request_map()
+        if employee_id is None:
+            request_map.clear()
+        else:
+            request_map.pop(employee_id, None)
+
+
+user_role_cache = UserRoleCache(USER_ROLE_CACHE_TTL_SEC)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user_role(mapper, connection, target):
+    user_role_cache.invalidate(target.employee_id)
+
+
+def validate_user_roles(employee_ids, allowed_roles, field_name):
+    """
+    複数の employee_id の役割を1回の IN クエリで検証する（一括登録の前に呼ぶ）
+
+    結果はキャッシュに載るので、続けて行う各行の @validates は SELECT しない。
+    ValueError は最初に見つかった不正な ID について送出する。
+    """
+    employee_ids = [employee_id for employee_id in employee_ids if employee_id is not None]
+    users = user_role_cache.get_many(employee_ids)
+    for employee_id in employee_ids:
+        user = users[employee_id]
+        if user is None:
+            raise ValueError(f"Employee ID {employee_id} は存在しません")
+        name, role = user
+        if role not in allowed_roles:
+            raise ValueError(
+                f"{field_name} には {'・'.join(r.value for r in allowed_roles)} のみ設定可能です。"
+                f"ユーザー {name}: {role.value}"
+            )
+    return True
+
 # Park テーブル
+PARK_INSPECTOR_ROLES = (RoleEnum.STAFF, RoleEnum.INSPECTOR)
+
 class Park(db.Model):
     __tablename__ = 'parks'
     park_id = db.Column(db.Integer, primary_key=True)
@@ -85,18 +211,23 @@ class Park(db.Model):
         if inspector_id is None:
             return True  # NULL はOK
         
-        user = User.query.get(inspector_id)
+        user = user_role_cache.get(inspector_id)
         if not user:
             raise ValueError(f"ユーザーが見つかりません: {inspector_id}")
         
-        allowed_roles = [RoleEnum.STAFF, RoleEnum.INSPECTOR]
-        if user.role not in allowed_roles:
+        _, role = user
+        if role not in PARK_INSPECTOR_ROLES:
             raise ValueError(
                 f"Park の inspector_id には STAFF または INSPECTOR のみ設定可能です。"
-                f"入力: {user.role.value}"
+                f"入力: {role.value}"
             )
         return True
 
+    @staticmethod
+    def validate_inspectors(inspector_ids):
+        """一括登録用: 複数の inspector_id を1回のクエリで検証"""
+        return validate_user_roles(inspector_ids, PARK_INSPECTOR_ROLES, "Park の inspector_id")
+
 # Equipment テーブル（遊具情報）
 class Equipment(db.Model):
     __tablename__ = 'equipments'
@@ -104,6 +235,7 @@ class Equipment(db.Model):
     park_id = db.Column(db.Integer, db.ForeignKey('parks.park_id'), nullable=False)
     equipment_name = db.Column(db.String(200), nullable=False, default="ブランコ")
     status = db.Column(db.Enum(EquipmentStatusEnum), default=EquipmentStatusEnum.A)
+    latest_grade = db.Column(db.Enum(GradeEnum))  # 直近の点検の総合評価（コミット時に grades.py で更新）
 
     # リレーション
     inspections = db.relationship('Inspection', backref='equipment', lazy=True)
@@ -111,30 +243,16 @@ class Equipment(db.Model):
 
     def calculate_overall_grade(self):
         """
-        直近の点検から総合評価を計算
-        - 最新のInspectionを取得
-        - InspectionDetailの全パーツ(chain, joint, pole, seat)をチェック
-        - 1つでもCがあればC、その次がBならB、それ以外はA
+        直近の点検の総合評価（全パーツのうち最も悪い判定）
+        - latest_grade（点検・部位の判定を変更したコミットで自動的に計算し直す）があればそれを返す
+        - 未計算なら grades.latest_grades で1回のクエリで求める
+        - 複数の遊具をまとめて求める場合は grades.latest_grades を直接使う
         """
-        if not self.inspections:
-            return None
-        
-        # 最新の点検を取得
-        latest_inspection = max(self.inspections, key=lambda x: x.inspection_date)
-        
-        if not latest_inspection.details:
-            return None
-        
-        # 全部位の評価を取得
-        grades = [detail.grade for detail in latest_inspection.details]
-        
-        # 判定ロジック：最も悪い評価を総合評価とする
-        if GradeEnum.C in grades:
-            return GradeEnum.C
-        elif GradeEnum.B in grades:
-            return GradeEnum.B
-        else:
-            return GradeEnum.A
+        if self.latest_grade is not None:
+            return self.latest_grade
+
+        from grades import latest_grades
+        return latest_grades([self.equipment_id]).get(self.equipment_id)
 
 
 # Inspection テーブル（指定管理者点検用）
@@ -163,18 +281,34 @@ class Inspection(db.Model):
     photos = db.relationship('InspectionPhoto', backref='inspection', lazy=True, cascade='all, delete-orphan')
     report_links = db.relationship('InspectionReport', backref='inspection', lazy=True)
     
+    # 履歴の検索用インデックス
+    __table_args__ = (
+        # 遊具ごとの最新の点検（grades.py の ROW_NUMBER、遊具の点検履歴）
+        db.Index('ix_inspection_equipment_date', 'equipment_id', 'inspection_date', 'inspection_id'),
+        # 点検者ごと・期間ごとの点検
+        db.Index('ix_inspection_inspector_date', 'inspector_id', 'inspection_date'),
+        # 期間指定の一覧（点検日・点検ID 順）
+        db.Index('ix_inspection_date', 'inspection_date', 'inspection_id'),
+    )
+    
 # バリデーション employee_id が点検者かどうかのチェック
     @validates('inspector_id')
     def validate_conducted_by_id(self, key, value):
         """inspection_id が点検者（INSPECTOR）ユーザーのみであることを確認"""
         if value is not None:
-            user = User.query.get(value)
+            user = user_role_cache.get(value)
             if user is None:
                 raise ValueError(f"Employee ID {value} は存在しません")
-            if user.role != RoleEnum.INSPECTOR:
-                raise ValueError(f"ユーザー {user.name} は点検者ではありません。点検者のみ設定可能です。")
+            name, role = user
+            if role != RoleEnum.INSPECTOR:
+                raise ValueError(f"ユーザー {name} は点検者ではありません。点検者のみ設定可能です。")
         return value
 
+    @staticmethod
+    def validate_inspectors(inspector_ids):
+        """一括登録用: 複数の inspector_id を1回のクエリで検証（以降の各行の検証はキャッシュから）"""
+        return validate_user_roles(inspector_ids, (RoleEnum.INSPECTOR,), "Inspection の inspector_id")
+
 
 # InspectionDetail テーブル
 class InspectionDetail(db.Model):
@@ -212,11 +346,96 @@ class InspectionDetail(db.Model):
     )
 
 
+# ============================================================
+# Equipment.latest_grade の更新
+# ============================================================
+# 点検・部位の判定が変わったら影響する遊具をセッションに記録しておき、コミットの直前に
+# 同じトランザクションで grades.refresh_latest_grades を実行する（パーツごとのセーブポイントで
+# フラッシュのたびに計算しないように）。取り消されたセーブポイントの遊具も計算し直すだけなので、
+# 保存値は常にコミットする点検結果と一致する。
+
+def _mark_latest_grade_dirty(target, equipment_ids):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('latest_grade_equipment_ids', set()).update(
+            equipment_id for equipment_id in equipment_ids if equipment_id is not None
+        )
+
+
+def _history(target, name):
+    """属性の (変更があったか, 変更前の値のリスト)"""
+    history = inspect(target).attrs[name].history
+    return history.has_changes(), list(history.deleted)
+
+
+@event.listens_for(Inspection, 'after_insert')
+@event.listens_for(Inspection, 'after_delete')
+def mark_inspection_equipment(mapper, connection, target):
+    _mark_latest_grade_dirty(target, [target.equipment_id])
+
+
+@event.listens_for(Inspection, 'after_update')
+def mark_updated_inspection_equipment(mapper, connection, target):
+    # 遊具の付け替え・点検日の変更だけが「直近の点検」を変える
+    equipment_changed, old_equipment_ids = _history(target, 'equipment_id')
+    date_changed, _ = _history(target, 'inspection_date')
+    if equipment_changed or date_changed:
+        _mark_latest_grade_dirty(target, [target.equipment_id, *old_equipment_ids])
+
+
+def _mark_detail_equipment(connection, target, inspection_ids):
+    rows = connection.execute(
+        db.select(Inspection.equipment_id).where(Inspection.inspection_id.in_(inspection_ids))
+    )
+    _mark_latest_grade_dirty(target, [equipment_id for equipment_id, in rows])
 
 
+@event.listens_for(InspectionDetail, 'after_insert')
+@event.listens_for(InspectionDetail, 'after_delete')
+def mark_detail_equipment(mapper, connection, target):
+    # 点検と一緒に削除された部位は点検の行がもう無いが、遊具は点検の after_delete で記録済み
+    _mark_detail_equipment(connection, target, [target.inspection_id])
+
+
+@event.listens_for(InspectionDetail, 'after_update')
+def mark_updated_detail_equipment(mapper, connection, target):
+    grade_changed, _ = _history(target, 'grade')
+    inspection_changed, old_inspection_ids = _history(target, 'inspection_id')
+    if grade_changed or inspection_changed:
+        _mark_detail_equipment(connection, target, [target.inspection_id, *old_inspection_ids])
+
+
+@event.listens_for(db.session, 'before_commit')
+def refresh_dirty_latest_grades(session):
+    session.flush()
+    equipment_ids = session.info.pop('latest_grade_equipment_ids', None)
+    if equipment_ids:
+        from grades import refresh_latest_grades
+        refresh_latest_grades(equipment_ids, session=session)
+
+
+
+
+
+# 写真テーブル共通
+# 写真本体は DB に持たない（storage_key が photo_storage の保存キー）ので、
+# 写真の行を読み込んでもメタデータしか転送されない。本体は必要なときに保存先から読む。
+class StoredPhotoMixin:
+    def open_stream(self):
+        """写真本体を読むファイルオブジェクト（with で閉じる）"""
+        return get_photo_storage().open(self.storage_key)
+
+    def iter_bytes(self, chunk_size=STREAM_CHUNK_SIZE):
+        """写真本体を chunk_size ずつ返す（全体をメモリに載せない）"""
+        return get_photo_storage().iter_range(self.storage_key, chunk_size=chunk_size)
+
+    def read_bytes(self):
+        """写真本体を一度に読む（推論など全体が必要な場合のみ）"""
+        return get_photo_storage().read(self.storage_key)
+
 
 # InspectionPhoto テーブル（専門家点検用写真）
-class InspectionPhoto(db.Model):
+class InspectionPhoto(StoredPhotoMixin, db.Model):
     """専門家点検の写真管理"""
     __tablename__ = 'inspection_photos'
     
@@ -227,9 +446,16 @@ class InspectionPhoto(db.Model):
     inspection_id = db.Column(db.Integer, db.ForeignKey('inspection.inspection_id'), nullable=False)
     detail_id = db.Column(db.Integer, db.ForeignKey('inspection_detail.detail_id'), nullable=True)
     
-    # 写真情報
+    # 写真情報（本体は photo_storage の保存先、storage_key はその保存キー）
+    storage_key = db.Column(db.String(100))
     file_size = db.Column(db.Integer)
-    photo_data = db.Column(db.LargeBinary)
+    mime_type = db.Column(db.String(50))
+    digest = db.Column(db.String(64), index=True)  # 写真の sha256
+    
+    # 保存用の高画質画像（判定用の縮小画像とは別に後からアップロードされる）
+    archive_storage_key = db.Column(db.String(100))
+    archive_file_size = db.Column(db.Integer)
+    archive_mime_type = db.Column(db.String(50))
     
     # メタデータ
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -237,7 +463,25 @@ class InspectionPhoto(db.Model):
     
     # リレーション
     detail = db.relationship('InspectionDetail', foreign_keys=[detail_id], backref='inspection_photos')
-    uploader = db.relationship('User', foreign_keys=[uploaded_by], backref='uploaded_inspection_photos')
+    # 投稿者の写真は件数が増え続けるので、全件を読み込まずクエリとして返す
+    uploader = db.relationship('User', foreign_keys=[uploaded_by],
+                               backref=db.backref('uploaded_inspection_photos', lazy='dynamic'))
+
+    # 点検ごと・投稿者ごとの写真一覧（photo_id 順）
+    __table_args__ = (
+        db.Index('ix_inspection_photos_inspection_photo', 'inspection_id', 'photo_id'),
+        db.Index('ix_inspection_photos_uploader_photo', 'uploaded_by', 'photo_id'),
+    )
+
+    @classmethod
+    def for_inspection(cls, inspection_id):
+        """点検の写真（photo_id 順）"""
+        return cls.query.filter_by(inspection_id=inspection_id).order_by(cls.photo_id)
+
+    @classmethod
+    def for_uploader(cls, employee_id):
+        """投稿者の写真（新しい順）"""
+        return cls.query.filter_by(uploaded_by=employee_id).order_by(cls.photo_id.desc())
 
 
 # Report テーブル (通常点検の報告書)
@@ -288,6 +532,12 @@ class DailyReport(db.Model):
     details = db.relationship('DailyReportDetail', backref='daily_report', lazy=True, cascade='all, delete-orphan')
     photos = db.relationship('DailyReportPhoto', backref='daily_report', lazy=True, cascade='all, delete-orphan')
 
+    # 公園ごと・期間ごとの日報
+    __table_args__ = (
+        db.Index('ix_daily_reports_park_date', 'park_id', 'report_date', 'daily_report_id'),
+        db.Index('ix_daily_reports_date', 'report_date', 'daily_report_id'),
+    )
+
 
 
 # DailyReportDetail テーブル
@@ -317,7 +567,7 @@ class DailyReportDetail(db.Model):
 
 
 # DailyReportPhoto テーブル（日報用写真）
-class DailyReportPhoto(db.Model):
+class DailyReportPhoto(StoredPhotoMixin, db.Model):
     """日報の写真管理"""
     __tablename__ = 'daily_report_photos'
     
@@ -328,9 +578,11 @@ class DailyReportPhoto(db.Model):
     daily_report_id = db.Column(db.Integer, db.ForeignKey('daily_reports.daily_report_id'), nullable=False)
     daily_detail_id = db.Column(db.Integer, db.ForeignKey('daily_report_detail.detail_id'), nullable=True)
     
-    # 写真情報
+    # 写真情報（本体は photo_storage の保存先、storage_key はその保存キー）
+    storage_key = db.Column(db.String(100))
     file_size = db.Column(db.Integer)
-    photo_data = db.Column(db.LargeBinary)
+    mime_type = db.Column(db.String(50))
+    digest = db.Column(db.String(64), index=True)  # 写真の sha256
     
     # メタデータ
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -338,14 +590,42 @@ class DailyReportPhoto(db.Model):
     
     # リレーション
     daily_detail = db.relationship('DailyReportDetail', foreign_keys=[daily_detail_id], backref='daily_report_photos')
-    uploader = db.relationship('User', foreign_keys=[uploaded_by], backref='uploaded_daily_report_photos')
-
-
-
-
-
+    uploader = db.relationship('User', foreign_keys=[uploaded_by],
+                               backref=db.backref('uploaded_daily_report_photos', lazy='dynamic'))
 
+    # 日報ごと・投稿者ごとの写真一覧（photo_id 順）
+    __table_args__ = (
+        db.Index('ix_daily_report_photos_report_photo', 'daily_report_id', 'photo_id'),
+        db.Index('ix_daily_report_photos_uploader_photo', 'uploaded_by', 'photo_id'),
+    )
 
+    @classmethod
+    def for_daily_report(cls, daily_report_id):
+        """日報の写真（photo_id 順）"""
+        return cls.query.filter_by(daily_report_id=daily_report_id).order_by(cls.photo_id)
 
+    @classmethod
+    def for_uploader(cls, employee_id):
+        """投稿者の写真（新しい順）"""
+        return cls.query.filter_by(uploaded_by=employee_id).order_by(cls.photo_id.desc())
 
 
+# UploadReceipt テーブル（オフラインキューからの一括アップロードの受付記録）
+class UploadReceipt(db.Model):
+    """クライアントが生成したアップロードID ごとの処理結果（再送されても写真を重複登録しない）"""
+    __tablename__ = 'upload_receipts'
+    
+    # 主キー（クライアントが生成した UUID）
+    client_upload_id = db.Column(db.String(36), primary_key=True)
+    
+    # 外部キー
+    inspection_id = db.Column(db.Integer, db.ForeignKey('inspection.inspection_id'), nullable=False)
+    photo_id = db.Column(db.Integer, db.ForeignKey('inspection_photos.photo_id'), nullable=True)
+    
+    # 処理結果
+    part = db.Column(db.Enum(InspectionPartEnum), nullable=False)
+    result_json = db.Column(db.Text)  # 初回処理時のパーツ結果（JSON）
+    
+    # メタデータ
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.employee_id'))
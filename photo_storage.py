@@ -0,0 +1,307 @@
+# photo_storage.py - 写真ファイルの保存先（DB には保存キー・サイズ・MIME タイプ・ダイジェストだけを持つ）
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from config import (
+    PHOTO_STORAGE_BACKEND, PHOTO_STORAGE_ROOT,
+    PHOTO_S3_BUCKET, PHOTO_S3_ENDPOINT_URL, PHOTO_S3_PREFIX,
+    PHOTO_THUMBNAIL_SIZE, PHOTO_MEDIUM_SIZE, PHOTO_DERIVATIVE_FORMAT, PHOTO_DERIVATIVE_QUALITY
+)
+
+# 配信時に1回で読み出すサイズ
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# put() の戻り値。as_columns() で InspectionPhoto / DailyReportPhoto のカラムに展開できる
+class StoredPhoto(namedtuple('StoredPhoto', ['key', 'digest', 'size', 'mime_type'])):
+    def as_columns(self):
+        return {
+            'storage_key': self.key,
+            'digest': self.digest,
+            'file_size': self.size,
+            'mime_type': self.mime_type
+        }
+
+
+def detect_mime_type(data):
+    """先頭バイトから画像の MIME タイプを判定"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+
+def content_key(digest):
+    """ダイジェストから保存キーを作る（ab/cd/abcd... の2段シャーディング）"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+# ============================================================
+# 保存先の共通インターフェース
+# ============================================================
+
+class PhotoStorage(ABC):
+    """
+    写真の保存先（内容のハッシュをキーにするので、同じ写真は1つしか保存されない）
+
+    サブクラスは _write / open / exists / size / delete を実装する（未実装だと作成時に TypeError）
+    """
+
+    def put(self, data, mime_type=None):
+        """写真を保存して StoredPhoto を返す（同じ内容が保存済みなら書き込まない）"""
+        digest = hashlib.sha256(data).hexdigest()
+        key = content_key(digest)
+        mime_type = mime_type or detect_mime_type(data)
+
+        if not self.exists(key):
+            self._write(key, data, mime_type)
+
+        return StoredPhoto(key, digest, len(data), mime_type)
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def iter_range(self, key, start=0, stop=None, chunk_size=STREAM_CHUNK_SIZE):
+        """start バイト目から stop バイト目の手前までを chunk_size ずつ返す（全体をメモリに載せない）"""
+        with self.open(key) as f:
+            f.seek(start)
+            remaining = None if stop is None else stop - start
+            while remaining is None or remaining > 0:
+                size = chunk_size if remaining is None else min(chunk_size, remaining)
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def local_path(self, key):
+        """ローカルファイルとして読めるならそのパス（それ以外は None）"""
+        return None
+
+    @abstractmethod
+    def _write(self, key, data, mime_type):
+        """key に data を書き込む（同じ key は上書き）"""
+
+    def put_derived(self, key, data, mime_type):
+        """元写真から作ったファイル（縮小版など）を key に保存"""
+        self._write(key, data, mime_type)
+
+    @abstractmethod
+    def size(self, key):
+        """保存済みファイルのバイト数"""
+
+    @abstractmethod
+    def open(self, key):
+        """読み出し用のファイルオブジェクト（with で閉じる）"""
+
+    @abstractmethod
+    def exists(self, key):
+        """key が保存済みか"""
+
+    @abstractmethod
+    def delete(self, key):
+        """key のファイルを削除"""
+
+
+# ============================================================
+# ローカルファイルシステム
+# ============================================================
+
+class LocalPhotoStorage(PhotoStorage):
+    """root 以下に ab/cd/<sha256> の形で保存する"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def local_path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"不正な保存キーです: {key}")
+        return path
+
+    def _write(self, key, data, mime_type):
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 書きかけのファイルが読まれないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.local_path(key))
+
+    def delete(self, key):
+        path = self.local_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ============================================================
+# S3 互換ストレージ（MinIO などのローカル代替も endpoint_url で利用可）
+# ============================================================
+
+class S3PhotoStorage(PhotoStorage):
+    """bucket の prefix 以下に ab/cd/<sha256> の形で保存する（boto3 が必要）"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise ValueError(
+                "PHOTO_STORAGE_BACKEND=s3 には boto3 が必要です（pip install -r requirements.txt）"
+            ) from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _write(self, key, data, mime_type):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=data,
+            ContentType=mime_type
+        )
+
+    def open(self, key):
+        response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        return response['Body']
+
+    def iter_range(self, key, start=0, stop=None, chunk_size=STREAM_CHUNK_SIZE):
+        """必要な範囲だけを Range 指定で取得して返す"""
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if start or stop is not None:
+            params['Range'] = f"bytes={start}-{'' if stop is None else stop - 1}"
+        body = self.client.get_object(**params)['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def size(self, key):
+        response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        return response['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+# ============================================================
+# 縮小版（サムネイル・中サイズ）
+# ============================================================
+
+# サイズ名 -> 長辺のピクセル数
+DERIVATIVE_SIZES = {
+    'thumb': PHOTO_THUMBNAIL_SIZE,
+    'medium': PHOTO_MEDIUM_SIZE
+}
+
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg')
+}
+
+DERIVATIVE_MIME_TYPE = DERIVATIVE_FORMATS[PHOTO_DERIVATIVE_FORMAT][1]
+
+
+def derivative_key(key, size_name):
+    """元写真の保存キーの隣に置く縮小版のキー（例: ab/cd/<sha256>.thumb.webp）"""
+    return f"{key}.{size_name}.{PHOTO_DERIVATIVE_FORMAT}"
+
+
+def render_derivative(data, max_side):
+    """長辺が max_side 以下になるよう縮小し、PHOTO_DERIVATIVE_FORMAT で符号化"""
+    from PIL import Image, ImageOps
+
+    pil_format, _ = DERIVATIVE_FORMATS[PHOTO_DERIVATIVE_FORMAT]
+
+    img = Image.open(io.BytesIO(data))
+    img = ImageOps.exif_transpose(img)
+    img = img.convert('RGB')
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    output = io.BytesIO()
+    img.save(output, format=pil_format, quality=PHOTO_DERIVATIVE_QUALITY)
+    return output.getvalue()
+
+
+def store_derivatives(storage, key, data=None):
+    """全サイズの縮小版を作って保存（作成済みのものはスキップ）"""
+    for size_name in DERIVATIVE_SIZES:
+        ensure_derivative(storage, key, size_name, data)
+
+
+def ensure_derivative(storage, key, size_name, data=None):
+    """縮小版の保存キーを返す。まだ無ければ元写真から作る（移行前の写真にも対応）"""
+    dkey = derivative_key(key, size_name)
+    if not storage.exists(dkey):
+        if data is None:
+            data = storage.read(key)
+        storage.put_derived(dkey, render_derivative(data, DERIVATIVE_SIZES[size_name]), DERIVATIVE_MIME_TYPE)
+    return dkey
+
+
+# ============================================================
+# 設定に応じた保存先
+# ============================================================
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_photo_storage():
+    """PHOTO_STORAGE_BACKEND に応じた保存先（プロセス内で1つ）"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_photo_storage(PHOTO_STORAGE_BACKEND)
+    return _storage
+
+
+def create_photo_storage(backend):
+    if backend == 'local':
+        return LocalPhotoStorage(PHOTO_STORAGE_ROOT)
+    if backend == 's3':
+        if not PHOTO_S3_BUCKET:
+            raise ValueError("PHOTO_S3_BUCKET が設定されていません")
+        return S3PhotoStorage(PHOTO_S3_BUCKET, prefix=PHOTO_S3_PREFIX, endpoint_url=PHOTO_S3_ENDPOINT_URL)
+    raise ValueError(f"未対応の写真保存先: {backend}")
@@ -0,0 +1,482 @@
+# report_renderer.py - 点検チェックシート（Excel）の生成
+#
+# template.xlsx は最初の1回だけ解析し、解析済みのワークブックを pickle で保持する。
+# リクエストごとにそこから複製してセルを書き込むので、テンプレートの XML 解析と
+# アイコン PNG の読み込みは繰り返さない。
+#
+# 複数の点検をまとめて出力する場合（ChecksheetExporter）は、ZIP 出力のときだけ
+# 点検ごとの書き込み・保存をプロセスプールに分散する。
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from openpyxl import load_workbook
+from openpyxl.drawing.image import Image
+from openpyxl.drawing.spreadsheet_drawing import AnchorMarker, OneCellAnchor
+from openpyxl.drawing.xdr import XDRPositiveSize2D
+from openpyxl.styles import Alignment
+from openpyxl.utils import column_index_from_string
+
+EMU = 9525
+ICON_PX = 16
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+ZIP_MIMETYPE = "application/zip"
+
+# ============================================================
+# 点検レコード → チェックシートの items
+# ============================================================
+
+# 部位ごとのアイコン位置（CheckSheet の inspection_sections と同じ座標）
+# (部位, 状態) の組み合わせが無い場合は (部位, None) の位置に置く
+PART_ICON_POSITIONS = {
+    ("pole", None):    {"cell": "D6", "dx": 50, "dy": -5},    # 柱・梁: 破損
+    ("pole", "rust"):  {"cell": "D6", "dx": 115, "dy": -5},   # 柱・梁: 腐食（腐朽）
+    ("joint", None):   {"cell": "D7", "dx": 5, "dy": -5},     # 接合部: 破損
+    ("joint", "rust"): {"cell": "D7", "dx": 60, "dy": -5},    # 接合部: 腐食
+    ("chain", None):   {"cell": "D9", "dx": 65, "dy": -5},    # 揺動部（チェーン）: 破損
+    ("seat", None):    {"cell": "D11", "dx": 115, "dy": -5},  # 揺動部（座板）: 破損
+    ("seat", "crack"): {"cell": "D11", "dx": 5, "dy": -5},    # 揺動部（座板）: ヒビ
+}
+
+# 判定等級（GradeEnum の名前）ごとのアイコン。A（健全）は何も置かない
+GRADE_ICONS = {
+    "B": "triangle.png",
+    "C": "none.png",
+    "D": "none.png",
+}
+
+
+def inspection_items(record):
+    """
+    点検レコードからチェックシートの items を作る（/api/generate_excel の items と同じ形式）
+
+    record は DB に依存しない dict（プロセスプールに渡すため）:
+        {
+            "park_name": "...", "inspection_date": datetime, "actions_taken": "...",
+            "details": [{"part": "chain", "condition": "rust", "grade": "B"}, ...]
+        }
+    """
+    items = []
+
+    for detail in record.get("details", []):
+        icon = GRADE_ICONS.get(detail.get("grade"))
+        position = (PART_ICON_POSITIONS.get((detail.get("part"), detail.get("condition")))
+                    or PART_ICON_POSITIONS.get((detail.get("part"), None)))
+        if icon and position:
+            items.append({"type": "icon", "icon": icon, **position})
+
+    if record.get("park_name"):
+        items.append({"type": "text", "cell": "C2", "value": record["park_name"]})
+
+    inspection_date = record.get("inspection_date")
+    if inspection_date:
+        part_of_day = "朝" if inspection_date.hour < 12 else "夕"
+        items.append({"type": "text", "cell": "A6",
+                      "value": f"{part_of_day}\n{inspection_date.hour}:{inspection_date.minute:02d}"})
+        items.append({"type": "text", "cell": "H2", "value": f"{inspection_date.year}年度"})
+        items.append({"type": "text", "cell": "A11",
+                      "value": "点検日\n\n\n\n\n" + f"{inspection_date.month} ／ {inspection_date.day}"})
+
+    if record.get("actions_taken"):
+        items.append({"type": "text", "cell": "F6", "value": "●点検時に実施した措置\n" + record["actions_taken"]})
+
+    return items
+
+
+def sheet_title(record, used=()):
+    """シート名（Excel の制限: 31文字以内、[]:*?/\\ は使えない、ブック内で重複不可）"""
+    base = f"{record['inspection_id']}_{record.get('equipment_name') or ''}".rstrip("_")
+    base = re.sub(r'[\[\]:*?/\\]', '_', base)[:31]
+    title = base
+    n = 2
+    while title in used:
+        suffix = f"({n})"
+        title = base[:31 - len(suffix)] + suffix
+        n += 1
+    return title
+
+
+
+class ChecksheetRenderer:
+    """
+    テンプレートとアイコンをメモリに保持して、チェックシートを生成する
+
+    items の形式は /api/generate_excel と同じ:
+        {"type": "icon" | "text" | "number" | "checkbox", "cell": "D6", "dx": 0, "dy": 0, ...}
+
+    テンプレートファイルが更新された場合は次の render で読み込み直す
+    """
+
+    def __init__(self, template_path, icon_dir, icon_px=ICON_PX):
+        self.template_path = template_path
+        self.icon_dir = icon_dir
+        self.icon_px = icon_px
+
+        self._lock = threading.Lock()
+        self._template = None          # 解析済みワークブックの pickle
+        self._template_mtime = None
+        self._icons = {}               # icon_file -> PNG バイト列（存在しなければ None）
+
+    # ------------------------------------------------------------
+    # テンプレート・アイコンのキャッシュ
+    # ------------------------------------------------------------
+
+    def template_exists(self):
+        return os.path.exists(self.template_path)
+
+    def template_fingerprint(self):
+        """テンプレートファイルの (mtime_ns, size)。出力のキャッシュキーに使う"""
+        stat = os.stat(self.template_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _template_bytes(self):
+        mtime = os.stat(self.template_path).st_mtime_ns
+        with self._lock:
+            if self._template is None or self._template_mtime != mtime:
+                workbook = load_workbook(self.template_path)
+                self._template = pickle.dumps(workbook)
+                self._template_mtime = mtime
+            return self._template
+
+    def new_workbook(self):
+        """テンプレートの複製（解析済みのワークブックを pickle から復元するだけ）"""
+        return pickle.loads(self._template_bytes())
+
+    def icon_bytes(self, icon_file):
+        """アイコン PNG のバイト列（icon_dir 外のパスや存在しないファイルは None）"""
+        with self._lock:
+            if icon_file in self._icons:
+                return self._icons[icon_file]
+
+        icon_dir = os.path.abspath(self.icon_dir)
+        img_path = os.path.abspath(os.path.join(icon_dir, icon_file))
+        data = None
+        if img_path.startswith(icon_dir + os.sep) and os.path.exists(img_path):
+            with open(img_path, 'rb') as f:
+                data = f.read()
+
+        with self._lock:
+            self._icons[icon_file] = data
+        return data
+
+    # ------------------------------------------------------------
+    # セルへの書き込み
+    # ------------------------------------------------------------
+
+    def insert_text(self, ws, cell, value):
+        ws[cell] = value
+        ws[cell].alignment = Alignment(wrap_text=True, vertical="top")
+
+    def insert_icon(self, ws, cell, icon_file, dx=0, dy=0):
+        data = self.icon_bytes(icon_file)
+        if data is None:
+            return
+
+        img = Image(io.BytesIO(data))
+        img.width = self.icon_px
+        img.height = self.icon_px
+
+        # セル位置
+        col_letter = ''.join(filter(str.isalpha, cell))
+        row_number = int(''.join(filter(str.isdigit, cell)))
+        col_idx = column_index_from_string(col_letter) - 1
+
+        marker = AnchorMarker(
+            col=col_idx,
+            colOff=dx * EMU,
+            row=row_number - 1,
+            rowOff=dy * EMU
+        )
+
+        img.anchor = OneCellAnchor(
+            _from=marker,
+            ext=XDRPositiveSize2D(EMU * img.width, EMU * img.height)
+        )
+
+        ws.add_image(img)
+
+    def fill(self, ws, items):
+        """items をワークシートに書き込む"""
+        for item in items:
+            cell = item.get("cell")
+            if not cell:
+                continue
+
+            item_type = item.get("type")
+            dx = item.get("dx", 0)
+            dy = item.get("dy", 0)
+
+            if item_type == "icon" and item.get("icon"):
+                self.insert_icon(ws, cell, item["icon"], dx=dx, dy=dy)
+
+            elif item_type in ("text", "number"):
+                self.insert_text(ws, cell, str(item.get("value", "")))
+
+            elif item_type == "checkbox":
+                if item.get("value"):
+                    self.insert_icon(ws, cell, item.get("icon", "check.png"), dx=dx, dy=dy)
+
+    # ------------------------------------------------------------
+    # 出力
+    # ------------------------------------------------------------
+
+    def render(self, items):
+        """チェックシート1枚分の xlsx を BytesIO で返す"""
+        wb = self.new_workbook()
+        self.fill(wb.active, items)
+
+        stream = io.BytesIO()
+        wb.save(stream)
+        stream.seek(0)
+        return stream
+
+    def render_sheets(self, sheets):
+        """
+        複数のチェックシートを1つのブックのシートとして書き込み、xlsx を BytesIO で返す
+
+        Args:
+            sheets: [(シート名, items), ...]
+        """
+        wb = self.new_workbook()
+        template_ws = wb.active
+
+        for title, items in sheets:
+            ws = wb.copy_worksheet(template_ws)
+            ws.title = title
+            self.fill(ws, items)
+
+        if sheets:
+            wb.remove(template_ws)
+
+        stream = io.BytesIO()
+        wb.save(stream)
+        stream.seek(0)
+        return stream
+
+
+# ============================================================
+# 生成済みチェックシートのキャッシュ（ディスク）
+# ============================================================
+
+def render_cache_key(items, template_fingerprint):
+    """items（キー順・空白を正規化した JSON）とテンプレートのフィンガープリントの sha256"""
+    canonical = json.dumps(
+        {"items": items, "template": list(template_fingerprint)},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    生成した xlsx を root/ab/<key>.xlsx に保存する
+
+    合計サイズが max_bytes を超えたら、最終利用（mtime）が古いものから削除する。
+    max_bytes が 0 以下なら何も保存しない。
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._total = None             # 保存済みの合計サイズ（初回の put で数える）
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.xlsx")
+
+    def get(self, key):
+        """キャッシュ済みならそのパス（利用時刻を更新する）、無ければ None"""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 書きかけのファイルが読まれないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._entries())
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """(パス, サイズ, mtime) のリスト"""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".xlsx"):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self._total = total
+        if removed:
+            sys.stderr.write(f"↻ チェックシートキャッシュ: {removed} 件を削除（{total / 1024 / 1024:.1f}MB）\n")
+            sys.stderr.flush()
+
+# ============================================================
+# まとめて出力（プロセスプールで並列に生成）
+# ============================================================
+
+# ワーカープロセスごとのレンダラー（テンプレートはプロセス内で1回だけ解析する）
+_worker_renderer = None
+
+
+def _init_worker(template_path, icon_dir):
+    global _worker_renderer
+    _worker_renderer = ChecksheetRenderer(template_path, icon_dir)
+
+
+def _render_record(record):
+    return _worker_renderer.render(inspection_items(record)).getvalue()
+
+
+class _ZipStream:
+    """ZipFile の書き込み先。書かれたバイト列を溜めておき、pop() で取り出す（シーク不可として扱われる）"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ChecksheetExporter:
+    """
+    複数の点検レコードをまとめてチェックシートにする
+
+    ZIP（iter_zip）は max_workers 個のワーカープロセスで点検ごとに生成する（0 のときは
+    呼び出し元のプロセスで生成）。1つのブックにまとめる workbook はプールを使わず、呼び出し元の
+    プロセスで生成する（openpyxl はブックをまたいでシートを移せないので、シートごとに別の
+    プロセスで作って組み立てることができず、ワーカー1つに渡しても並列にはならないため）。
+    プールは初回利用時に作る。ワーカーは fork ではなく spawn で起動する（Web プロセスは
+    TensorFlow や推論・ジョブのスレッドが動いているので、fork した子プロセスがロックを
+    握ったまま止まることがある）。レンダラーは _init_worker で作り直すので引き継ぐものは無い。
+    """
+
+    def __init__(self, template_path, icon_dir, max_workers=2):
+        self.template_path = template_path
+        self.icon_dir = icon_dir
+        self.max_workers = max_workers
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._renderer = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.template_path, self.icon_dir)
+                )
+            return self._executor
+
+    def _local_renderer(self):
+        with self._lock:
+            if self._renderer is None:
+                self._renderer = ChecksheetRenderer(self.template_path, self.icon_dir)
+            return self._renderer
+
+    def _map(self, fn, args):
+        if self.max_workers <= 0:
+            if _worker_renderer is None:
+                _init_worker(self.template_path, self.icon_dir)
+            return map(fn, args)
+        return self._pool().map(fn, args)
+
+    def workbook(self, records):
+        """全点検を1つのブック（点検ごとに1シート）にした xlsx のバイト列（呼び出し元のプロセスで生成）"""
+        sheets = []
+        used = set()
+        for record in records:
+            title = sheet_title(record, used)
+            used.add(title)
+            sheets.append((title, inspection_items(record)))
+
+        return self._local_renderer().render_sheets(sheets).getvalue()
+
+    def iter_zip(self, records, name_format="checksheet_{inspection_id}.xlsx"):
+        """
+        点検ごとの xlsx をまとめた ZIP を少しずつ返すジェネレータ
+
+        ワーカーで生成できた順（records の順）に ZIP へ追加して、そのまま送り出す。
+        xlsx 自体が圧縮済みなので、ZIP 内では無圧縮で格納する。
+        """
+        records = list(records)
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+            for record, data in zip(records, self._map(_render_record, records)):
+                archive.writestr(name_format.format(**record), data)
+                yield stream.pop()
+        yield stream.pop()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,24 @@
+// sw.js - オフラインキューの送信を担当する Service Worker（/sw.js で配信）
+importScripts('/static/JS/upload_queue.js');
+
+self.addEventListener('install', function() {
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(self.clients.claim());
+});
+
+// 接続が戻ったらブラウザが発火する（Background Sync 対応ブラウザ）
+self.addEventListener('sync', function(event) {
+    if (event.tag === UPLOAD_SYNC_TAG) {
+        event.waitUntil(flushUploadQueue());
+    }
+});
+
+// Background Sync 非対応のブラウザでは、ページから online 時にメッセージで依頼される
+self.addEventListener('message', function(event) {
+    if (event.data === 'flush-upload-queue') {
+        event.waitUntil(flushUploadQueue());
+    }
+});
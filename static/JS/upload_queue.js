@@ -0,0 +1,157 @@
+// upload_queue.js - オフライン時の写真アップロードキュー（IndexedDB）
+// TakePhoto.html と Service Worker (sw.js) の両方から読み込む
+
+const UPLOAD_QUEUE_DB = 'park-upload-queue';
+const UPLOAD_QUEUE_STORE = 'uploads';
+const UPLOAD_SYNC_TAG = 'photo-upload-queue';
+const UPLOAD_BATCH_SIZE = 5;     // 1回の /api/bulk_upload で送る件数
+const UPLOAD_MAX_ATTEMPTS = 10;  // これを超えて失敗した写真はキューから外す（401 は数えない）
+const UPLOAD_LOGIN_REQUIRED = 'upload-queue-login-required';  // ページに送る通知の種類
+
+function openUploadQueue() {
+    return new Promise(function(resolve, reject) {
+        const request = indexedDB.open(UPLOAD_QUEUE_DB, 1);
+        request.onupgradeneeded = function() {
+            request.result.createObjectStore(UPLOAD_QUEUE_STORE, { keyPath: 'client_upload_id' });
+        };
+        request.onsuccess = function() { resolve(request.result); };
+        request.onerror = function() { reject(request.error); };
+    });
+}
+
+function withUploadStore(mode, callback) {
+    return openUploadQueue().then(function(db) {
+        return new Promise(function(resolve, reject) {
+            const tx = db.transaction(UPLOAD_QUEUE_STORE, mode);
+            const result = callback(tx.objectStore(UPLOAD_QUEUE_STORE));
+            tx.oncomplete = function() {
+                db.close();
+                resolve(result && 'result' in result ? result.result : result);
+            };
+            tx.onerror = function() {
+                db.close();
+                reject(tx.error);
+            };
+        });
+    });
+}
+
+// entry: { client_upload_id（撮影時に生成。省略時はここで生成）, inspection_id, part, item, image (Blob) }
+function enqueueUpload(entry) {
+    const record = Object.assign({
+        client_upload_id: crypto.randomUUID(),
+        created_at: new Date().toISOString(),
+        attempts: 0
+    }, entry);
+    return withUploadStore('readwrite', function(store) {
+        store.put(record);
+    }).then(function() {
+        return record;
+    });
+}
+
+function listQueuedUploads() {
+    return withUploadStore('readonly', function(store) {
+        return store.getAll();
+    });
+}
+
+function countQueuedUploads() {
+    return withUploadStore('readonly', function(store) {
+        return store.count();
+    });
+}
+
+// results: {client_upload_id: 'done' | 'failed'}
+function updateQueuedUploads(records, results) {
+    return withUploadStore('readwrite', function(store) {
+        records.forEach(function(record) {
+            const outcome = results[record.client_upload_id];
+            if (outcome === 'done') {
+                store.delete(record.client_upload_id);
+            } else if (outcome === 'failed') {
+                if (record.attempts + 1 >= UPLOAD_MAX_ATTEMPTS) {
+                    console.warn('再送の上限に達したためキューから外します:', record.client_upload_id);
+                    store.delete(record.client_upload_id);
+                } else {
+                    store.put(Object.assign({}, record, { attempts: record.attempts + 1 }));
+                }
+            }
+        });
+    });
+}
+
+// ログインし直すようページに知らせる（Service Worker からは postMessage、ページ内ではイベント）
+async function notifyUploadLoginRequired() {
+    const message = { type: UPLOAD_LOGIN_REQUIRED, pending: await countQueuedUploads() };
+    if (typeof window === 'undefined') {
+        const clients = await self.clients.matchAll({ includeUncontrolled: true });
+        clients.forEach(function(client) { client.postMessage(message); });
+    } else {
+        window.dispatchEvent(new CustomEvent(UPLOAD_LOGIN_REQUIRED, { detail: message }));
+    }
+}
+
+// キューの写真を UPLOAD_BATCH_SIZE 件ずつ送る。送れた件数を返す
+async function flushUploadQueue() {
+    const records = await listQueuedUploads();
+    let sent = 0;
+
+    for (let i = 0; i < records.length; i += UPLOAD_BATCH_SIZE) {
+        const batch = records.slice(i, i + UPLOAD_BATCH_SIZE);
+        const formData = new FormData();
+        formData.append('manifest', JSON.stringify(batch.map(function(record) {
+            return {
+                client_upload_id: record.client_upload_id,
+                inspection_id: record.inspection_id,
+                part: record.part
+            };
+        })));
+        batch.forEach(function(record) {
+            formData.append(record.client_upload_id, record.image, `${record.part}.jpg`);
+        });
+
+        let response;
+        try {
+            response = await fetch('/api/bulk_upload', {
+                method: 'POST',
+                body: formData,
+                credentials: 'same-origin'
+            });
+        } catch (error) {
+            break;  // まだオフライン
+        }
+        if (response.status === 401) {
+            // セッション切れ。写真はキューに残し（試行回数も増やさない）、ログインし直してもらう
+            await notifyUploadLoginRequired();
+            break;
+        }
+        if (!response.ok) {
+            break;  // 503 など。次の同期で再送
+        }
+
+        const body = await response.json();
+        const results = {};
+        let retryLater = false;
+        body.items.forEach(function(item) {
+            if (item.status === 'stored' || item.status === 'duplicate') {
+                results[item.client_upload_id] = 'done';
+                sent += 1;
+            } else if (item.status === 'rejected') {
+                console.warn('アップロードを受け付けられませんでした:', item.client_upload_id, item.error);
+                results[item.client_upload_id] = 'done';
+            } else {
+                results[item.client_upload_id] = 'failed';
+                // 推論サーバーが混雑しているときは残りのバッチも次の同期に回す
+                if (item.retry_after) {
+                    retryLater = true;
+                }
+            }
+        });
+        await updateQueuedUploads(batch, results);
+        if (retryLater) {
+            break;
+        }
+    }
+    return sent;
+}
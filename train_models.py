@@ -46,6 +46,10 @@ learning_rate = 0.0001
 # テストセット拡大パラメータ
 test_min_samples = 50  # 最大50サンプルまで許可（精度測定の信頼性向上）
 
+# 推論サーバー用の書き出し（例: ['tflite'] / ['tflite', 'onnx']、量子化: None / 'float16' / 'int8'）
+export_formats = []
+export_quantize = None
+
 # ============================================================
 # 関数定義
 # ============================================================
@@ -266,12 +270,72 @@ def evaluate_model(model, x_test, y_test, class_names, part_name):
     
     return accuracy
 
-def save_model(model, model_name):
-    """モデル保存"""
+def save_model(model, model_name, export_formats=(), quantize=None, representative_data=None):
+    """
+    モデル保存
+    
+    export_formats に 'tflite' / 'onnx' を指定すると、推論サーバー用の成果物も書き出す
+    （quantize: None / 'float16' / 'int8'。int8 は representative_data が必要）
+    """
     
     filepath = f'{model_name}.keras'
     model.save(filepath)
     print(f"✓ Model saved: {filepath}")
+    
+    if 'tflite' in export_formats:
+        export_tflite(model, model_name, quantize=quantize, representative_data=representative_data)
+    if 'onnx' in export_formats:
+        export_onnx(model, model_name)
+
+def export_tflite(model, model_name, quantize=None, representative_data=None):
+    """
+    TFLite 形式で書き出し
+    
+    quantize:
+        None      - float32 のまま
+        'float16' - 重みを float16 に量子化（サイズ半分、精度ほぼ同等）
+        'int8'    - 重み・活性化とも int8（入出力は float32 のまま）
+    """
+    import tempfile
+    
+    if quantize == 'int8' and representative_data is None:
+        raise ValueError("int8 量子化には representative_data（訓練画像の一部）が必要です")
+    
+    # Keras 3 のモデルは SavedModel を経由して変換する
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        model.export(saved_model_dir, format='tf_saved_model')
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        
+        if quantize == 'float16':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantize == 'int8':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            
+            def representative_dataset():
+                for sample in representative_data[:200]:
+                    yield [np.expand_dims(sample, axis=0).astype('float32')]
+            
+            converter.representative_dataset = representative_dataset
+        elif quantize is not None:
+            raise ValueError(f"未対応の量子化: {quantize}")
+        
+        tflite_model = converter.convert()
+    
+    filepath = f'{model_name}.tflite'
+    with open(filepath, 'wb') as f:
+        f.write(tflite_model)
+    print(f"✓ TFLite exported: {filepath} (quantize={quantize})")
+    return filepath
+
+def export_onnx(model, model_name):
+    """ONNX 形式で書き出し（tf2onnx が必要）"""
+    
+    filepath = f'{model_name}.onnx'
+    model.export(filepath, format='onnx')
+    print(f"✓ ONNX exported: {filepath}")
+    return filepath
 
 # ============================================================
 # メイン処理
@@ -325,7 +389,12 @@ def process_part(part_name, config):
         evaluate_model(model, x_test, y_test, config['class_names'], part_name)
         
         # 保存
-        save_model(model, part_name)
+        save_model(
+            model, part_name,
+            export_formats=export_formats,
+            quantize=export_quantize,
+            representative_data=x_train
+        )
         
         print(f"\n✓ {part_name.upper()} SUCCESS!")
         